@@ -19,6 +19,8 @@ from app.schemas.payment import PaymentDetail, AdminPaymentUpdate
 from app.schemas.download import DownloadDetail
 from app.api.deps import get_admin_user
 from app.services.payment import get_payment_processor
+from app.services.principal_cache import invalidate_user, invalidate_entitlement, invalidate_principal
+from app.utils.metrics import metrics
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -101,6 +103,7 @@ async def update_user(
     db.add(user)
     await db.commit()
     await db.refresh(user)
+    await invalidate_user(user.id)
     
     return user
 
@@ -126,6 +129,7 @@ async def delete_user(
     # Удаляем пользователя
     await db.delete(user)
     await db.commit()
+    await invalidate_principal(user_id)
     
     return {"success": True}
 
@@ -314,6 +318,7 @@ async def create_subscription(
         await db.commit()
         await db.refresh(subscription)
     
+    await invalidate_entitlement(subscription_create.user_id)
     return subscription
 
 @router.patch("/subscriptions/{subscription_id}", response_model=SubscriptionDetail)
@@ -343,6 +348,7 @@ async def update_subscription(
     db.add(subscription)
     await db.commit()
     await db.refresh(subscription)
+    await invalidate_entitlement(subscription.user_id)
     
     return subscription
 
@@ -403,6 +409,7 @@ async def update_payment(
     db.add(payment)
     await db.commit()
     await db.refresh(payment)
+    await invalidate_entitlement(payment.user_id)
     
     # Если статус изменен на COMPLETED, активируем связанную подписку
     if payment_update.status == PaymentStatus.COMPLETED:
@@ -608,4 +615,19 @@ async def get_downloads_stats(
             "successful_downloads": sum(day["successful"] for day in complete_stats),
             "failed_downloads": sum(day["failed"] for day in complete_stats)
         }
-    } 
\ No newline at end of file
+    } 
+
+@router.get("/metrics")
+async def get_metrics(
+    admin_user: User = Depends(get_admin_user)
+):
+    """
+    Получение внутренних метрик процесса API: попадания в кэши и т.д. (только для админов)
+
+    К распределениям процесса API добавляются наблюдения воркеров Celery
+    (ожидание в очередях загрузок и конвертаций), опубликованные в Redis.
+    """
+    snapshot = metrics.snapshot()
+    for name, series in (await metrics.shared_distributions()).items():
+        snapshot["distributions"].setdefault(name, []).extend(series)
+    return snapshot
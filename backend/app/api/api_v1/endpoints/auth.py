@@ -17,6 +17,7 @@ from app.auth.jwt import create_access_token, verify_token, verify_password, get
 from app.auth.oauth import GoogleOAuth
 from app.services.user import UserService
 from app.services.email import email_service
+from app.services.principal_cache import invalidate_user
 from app.schemas.auth import ForgotPasswordRequest, ResetPasswordRequest, VerifyEmailRequest
 
 router = APIRouter()
@@ -323,6 +324,7 @@ async def verify_email(
     
     db.add(user)
     await db.commit()
+    await invalidate_user(user.id)
     
     return {"message": "Email успешно подтвержден"}
 
@@ -348,6 +350,7 @@ async def resend_verification_email(
     
     db.add(current_user)
     await db.commit()
+    await invalidate_user(current_user.id)
     
     # Отправляем письмо
     await email_service.send_verification_email(current_user.email, token)
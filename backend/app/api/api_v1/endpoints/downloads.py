@@ -1,22 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Path, Request, status
+from fastapi.responses import StreamingResponse, Response, RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import and_
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 import os
 import aiofiles
 import asyncio
 import logging
 import shutil
 import uuid
+import time
+import json
+import mimetypes
+from urllib.parse import quote
 from datetime import datetime
 
 from app.utils.database import get_db
-from app.models import Download, SourceType, Resolution, User, Subscription, SubscriptionType
-from app.schemas.download import DownloadCreate, DownloadResponse, DownloadDetail, DownloadVideoRequest, VideoInfo, ConvertVideoRequest
+from app.models import (
+    Download, DownloadStatus, DownloadFormat, SourceType, Resolution, User, Subscription, SubscriptionType
+)
+from app.schemas.download import (
+    DownloadCreate, DownloadResponse, DownloadDetail, DownloadVideoRequest, VideoInfo, ConvertVideoRequest,
+    DownloadJobResponse, DownloadJobStatus
+)
 from app.services.downloader import VideoDownloader
+from app.services.download_scheduler import (
+    download_scheduler, SchedulerBusyError, tier_for_subscription, CELERY_TIER_PRIORITY
+)
+from app.services.worker_scheduler import worker_scheduler
 from app.api.deps import get_current_user, get_optional_user, check_subscription_active
+from app.services.principal_cache import get_active_subscription, invalidate_entitlement
 from app.core.config import settings
+from app.tasks.downloads import process_download
+from app.tasks.conversions import convert_download
+from app.worker import celery
+from app.services.progress import stream_progress, request_cancel, ProgressReporter, TERMINAL_STATUSES
+from app.utils.redis import get_redis
+from app.utils.file_response import RangeFileResponse, content_disposition
+from app.auth.signed_url import verify_file_signature
+from app.services.storage import get_storage, storage_key, file_url
+from app.services.storage_manager import storage_manager, StorageFullError
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -24,15 +48,14 @@ logger = logging.getLogger(__name__)
 # Инициализируем сервис загрузки
 downloader = VideoDownloader()
 
-@router.post("/", response_model=DownloadResponse)
+@router.post("/", response_model=DownloadJobResponse)
 async def create_download(
     download_create: DownloadCreate,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Запрос на скачивание видео. Проверяет наличие активной подписки и запускает процесс скачивания в фоне.
+    Запрос на скачивание видео. Проверяет наличие активной подписки и ставит скачивание в очередь Celery.
     """
     # Определяем тип источника
     source_type = detect_source_type(download_create.url)
@@ -48,35 +71,17 @@ async def create_download(
             detail="Нет активной подписки или достигнут лимит скачиваний для указанного разрешения"
         )
     
-    # Создаем запись о скачивании
-    download = Download(
-        user_id=current_user.id,
-        subscription_id=subscription_id,
-        source_url=download_create.url,
-        source_type=source_type,
-        resolution=download_create.resolution,
-        file_path="pending",  # Временное значение
-        status="in_progress"
-    )
-    
-    db.add(download)
-    await db.commit()
-    await db.refresh(download)
+    # Подписка уже загружена в сессию проверкой доступа, db.get не делает повторный запрос
+    subscription = await db.get(Subscription, subscription_id) if subscription_id else None
     
-    # Запускаем скачивание в фоне
-    background_tasks.add_task(
-        process_download,
-        download_id=download.id,
+    return await _enqueue_download(
+        db,
         url=download_create.url,
-        resolution=download_create.resolution,
+        resolution=download_create.resolution.value,
         user_id=current_user.id,
-        subscription_id=subscription_id
-    )
-    
-    return DownloadResponse(
-        id=download.id,
-        status="in_progress",
-        message="Видео поставлено в очередь на скачивание"
+        subscription_id=subscription_id,
+        tier=tier_for_subscription(subscription.type if subscription else None),
+        output_format=download_create.format.value
     )
 
 @router.get("/", response_model=List[DownloadDetail])
@@ -115,6 +120,99 @@ async def get_download(
     
     return download
 
+@router.get("/{download_id}/status", response_model=DownloadJobStatus)
+async def get_download_status(
+    download_id: int = Path(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Получение статуса фоновой загрузки (PENDING/PROCESSING/COMPLETED/FAILED).
+    Анонимные загрузки доступны без авторизации.
+    """
+    download = await _get_visible_download(db, download_id, current_user)
+    return await _job_status(download)
+
+@router.delete("/{download_id}", response_model=DownloadJobStatus)
+async def cancel_download(
+    download_id: int = Path(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Отмена фоновой загрузки. Задача в очереди снимается сразу, у выполняющейся
+    задачи воркер завершает процесс yt-dlp и удаляет недокачанные файлы.
+    """
+    download = await _get_visible_download(db, download_id, current_user)
+    
+    if download.status not in (DownloadStatus.PENDING, DownloadStatus.PROCESSING):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Скачивание уже завершено"
+        )
+    
+    # Флаг отмены нужен и для задачи в очереди: воркер мог уже взять ее в работу
+    if not await request_cancel(download.id):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Отмена загрузки временно недоступна"
+        )
+    
+    if download.status == DownloadStatus.PENDING:
+        download.status = DownloadStatus.CANCELLED
+        db.add(download)
+        await db.commit()
+        await db.refresh(download)
+        
+        if download.task_id:
+            # revoke передается воркерам через брокер, не блокируем event loop
+            await asyncio.to_thread(celery.control.revoke, download.task_id)
+        await ProgressReporter(download.id).publish({"status": DownloadStatus.CANCELLED.value})
+    
+    return await _job_status(download)
+
+@router.get("/{download_id}/events")
+async def stream_download_events(
+    http_request: Request,
+    download_id: int = Path(...),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Поток событий фоновой загрузки (Server-Sent Events): прогресс yt-dlp/ffmpeg
+    и смена статуса. Поток закрывается после статуса completed, failed или cancelled.
+    """
+    download = await _get_visible_download(db, download_id, current_user)
+    
+    if download.status in (
+        DownloadStatus.COMPLETED, DownloadStatus.FAILED, DownloadStatus.CANCELLED, DownloadStatus.REMOVED
+    ):
+        # Загрузка уже завершена - отдаем итоговое событие без подписки на Redis
+        final_event = {"id": download.id, "status": download.status.value}
+        if download.status == DownloadStatus.COMPLETED:
+            final_event.update(title=download.title, url=await _download_file_url(download))
+        elif download.status == DownloadStatus.FAILED:
+            final_event["error"] = download.error_message
+        return StreamingResponse(
+            iter([_format_sse(final_event)]), media_type="text/event-stream", headers=_SSE_HEADERS
+        )
+    
+    if get_redis() is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Поток событий недоступен, используйте /status"
+        )
+    
+    async def event_stream():
+        deadline = time.monotonic() + settings.DOWNLOAD_TASK_TIME_LIMIT
+        async for event in stream_progress(download_id):
+            if await http_request.is_disconnected() or time.monotonic() > deadline:
+                break
+            # None - нет событий, отправляем комментарий, чтобы прокси не закрыли соединение
+            yield _format_sse(event) if event is not None else ": keep-alive\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
 @router.post("/info", response_model=VideoInfo)
 async def get_video_info(
     request: DownloadVideoRequest,
@@ -132,6 +230,9 @@ async def get_video_info(
             detail=f"Ошибка получения информации о видео: {info['error']}"
         )
     
+    # Словарь может быть общим с кэшем информации о видео, поэтому изменяем копию
+    info = dict(info)
+    
     # Для неавторизованных пользователей ограничиваем доступные разрешения
     if not current_user:
         # Фильтруем форматы, оставляя только те, что разрешены для анонимных пользователей
@@ -147,19 +248,24 @@ async def get_video_info(
     
     return info
 
-@router.post("", response_model=DownloadResponse)
+@router.post("", response_model=Union[DownloadResponse, DownloadJobResponse])
 async def download_video(
     request: DownloadVideoRequest,
     background_tasks: BackgroundTasks,
+    http_request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: Optional[User] = Depends(get_optional_user)
 ):
     """
     Скачивание видео с указанного URL.
     Поддерживает анонимный режим с ограничением качества.
+    При queued=true загрузка выполняется в воркере Celery, а ответ содержит ID задачи.
+    При format=mp3 или wav скачивается только звук, без отдельного вызова /convert.
     """
-    # Определяем разрешение видео
+    # Определяем разрешение видео и формат результата
     resolution = request.resolution or "480p"
+    output_format = request.format.value
+    active_subscription = None
     
     # Проверка для неавторизованных пользователей
     if not current_user:
@@ -172,13 +278,8 @@ async def download_video(
             logger.info(f"Anonymous user requested resolution limited to {resolution}")
     else:
         # Для авторизованных пользователей проверяем подписку
-        # Получаем активные подписки пользователя
-        query = select(Subscription).where(
-            Subscription.user_id == current_user.id,
-            Subscription.is_active == 1
-        )
-        result = await db.execute(query)
-        active_subscription = result.scalar_one_or_none()
+        # Получаем активную подписку пользователя (из кэша или из БД)
+        active_subscription = await get_active_subscription(db, current_user.id)
         
         if not active_subscription:
             # У пользователя нет активной подписки, проверяем наличие пробной подписки
@@ -206,6 +307,7 @@ async def download_video(
                 db.add(trial_subscription)
                 await db.commit()
                 await db.refresh(trial_subscription)
+                await invalidate_entitlement(current_user.id)
                 
                 active_subscription = trial_subscription
             elif trial_subscription.downloads_used >= (trial_subscription.downloads_limit or settings.TRIAL_DOWNLOADS_LIMIT):
@@ -217,6 +319,23 @@ async def download_video(
             else:
                 active_subscription = trial_subscription
     
+    # Уровень приоритета в очереди загрузок
+    tier = tier_for_subscription(active_subscription.type if active_subscription else None)
+    
+    # В режиме очереди не держим HTTP-запрос открытым до окончания загрузки
+    if request.queued:
+        return await _enqueue_download(
+            db,
+            url=request.url,
+            resolution=resolution,
+            user_id=current_user.id if current_user else None,
+            subscription_id=active_subscription.id if active_subscription else None,
+            tier=tier,
+            use_instaloader=request.use_instaloader,
+            output_format=output_format,
+            user_key=_scheduler_user_key(current_user, http_request)
+        )
+    
     # Создаем уникальный идентификатор для загрузки
     download_id = str(uuid.uuid4())
     
@@ -235,20 +354,35 @@ async def download_video(
         # Сначала запускаем загрузку, чтобы получить начальную информацию
         filename_template = "%(title)s.%(ext)s"
         
-        if source_type == "instagram" and request.use_instaloader:
-            # Для Instagram используем instaloader, если запрошено
-            download_result = await downloader.download_instagram_with_instaloader(
-                url=request.url,
-                output_dir=download_dir
-            )
-        else:
-            # Для остальных платформ используем yt-dlp
-            download_result = await downloader.download_video(
-                url=request.url,
-                resolution=resolution,
-                output_dir=download_dir,
-                filename_template=filename_template
-            )
+        # Ограничиваем число одновременных процессов yt-dlp по платформам и пользователям
+        async with download_scheduler.slot(
+            source_type, _scheduler_user_key(current_user, http_request), tier
+        ):
+            # Место резервируется только после получения слота: запросы в очереди
+            # планировщика не держат резервы и не вызывают вытеснение файлов
+            async with storage_manager.reserve():
+                if source_type == "instagram" and request.use_instaloader:
+                    # Для Instagram используем instaloader, если запрошено
+                    download_coro = downloader.download_instagram_with_instaloader(
+                        url=request.url,
+                        output_dir=download_dir
+                    )
+                else:
+                    # Для остальных платформ используем yt-dlp
+                    download_coro = downloader.download_video(
+                        url=request.url,
+                        resolution=resolution,
+                        output_dir=download_dir,
+                        filename_template=filename_template,
+                        output_format=output_format
+                    )
+                # Если клиент отключился, загрузка прерывается и слот сразу освобождается
+                download_result = await _cancel_on_disconnect(http_request, download_coro)
+                
+                # Готовый файл передается в хранилище (для S3 - multipart-загрузка)
+                download_result = await downloader.store_result(
+                    download_result, current_user.id if current_user else None
+                )
         
         if not download_result.success:
             # Удаляем директорию в случае ошибки
@@ -267,6 +401,7 @@ async def download_video(
                 source_type=_get_source_type(source_type),
                 title=download_result.title,
                 resolution=_get_resolution(resolution),
+                format=DownloadFormat(output_format),
                 file_path=download_result.file_path,
                 file_size=download_result.file_size,
                 duration=download_result.duration,
@@ -282,10 +417,11 @@ async def download_video(
             
             await db.commit()
             await db.refresh(download)
+            if active_subscription:
+                await invalidate_entitlement(current_user.id)
         
-        # Получаем относительный путь к файлу для URL
-        relative_path = os.path.relpath(download_result.file_path, settings.UPLOAD_DIR)
-        download_url = f"/api/v1/downloads/file/{relative_path}"
+        # Подписанная ссылка на файл
+        download_url = file_url(download_result.file_path)
         
         return DownloadResponse(
             id=download_id,
@@ -293,9 +429,19 @@ async def download_video(
             url=download_url,
             file_size=download_result.file_size,
             resolution=resolution,
+            format=output_format,
             duration=download_result.duration
         )
         
+    except SchedulerBusyError as e:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise _queue_full_exception(e)
+    except StorageFullError as e:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise _storage_full_exception(e)
+    except HTTPException:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise
     except Exception as e:
         # Удаляем директорию в случае ошибки
         shutil.rmtree(download_dir, ignore_errors=True)
@@ -305,21 +451,24 @@ async def download_video(
             detail=f"Внутренняя ошибка сервера: {str(e)}"
         )
 
-@router.post("/convert", response_model=DownloadResponse)
+@router.post("/convert", response_model=Union[DownloadResponse, DownloadJobResponse])
 async def convert_video(
     request: ConvertVideoRequest,
+    http_request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     Конвертирует видео в указанный формат.
     Требует авторизации и активной подписки.
+    ffmpeg выполняется в воркере очереди конвертаций, а не в процессе API.
+    При queued=true ответ содержит ID задачи, иначе запрос ждет результата.
     """
     # Проверяем наличие активной подписки
-    await check_subscription_active(db, current_user.id)
+    subscription = await check_subscription_active(db, current_user.id)
     
     # Проверяем, существует ли исходный файл
-    if not os.path.exists(request.input_file):
+    if not await get_storage().exists(storage_key(request.input_file)):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Исходный файл не найден"
@@ -339,90 +488,104 @@ async def convert_video(
             detail="Нет прав на конвертацию данного файла"
         )
     
-    # Создаем директорию для результата конвертации
-    output_dir = os.path.dirname(request.input_file)
+    job = await _enqueue_conversion(
+        db,
+        source=download,
+        output_format=request.output_format,
+        preset=request.preset.value if request.preset else None,
+        user_id=current_user.id,
+        tier=tier_for_subscription(subscription.type)
+    )
+    if request.queued:
+        return job
     
     try:
-        # Запускаем процесс конвертации
-        convert_result = await downloader.convert_video(
-            input_path=request.input_file,
-            output_format=request.output_format,
-            output_dir=output_dir
+        # Если клиент отключился, конвертация в воркере отменяется
+        event = await _cancel_on_disconnect(
+            http_request, asyncio.wait_for(_wait_for_job(job.id), timeout=settings.CONVERT_WAIT_TIMEOUT)
         )
-        
-        if not convert_result.success:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Ошибка конвертации: {convert_result.error}"
-            )
-        
-        # Сохраняем информацию о конвертированном файле
-        converted_download = Download(
-            user_id=current_user.id,
-            subscription_id=download.subscription_id,
-            source_url=download.source_url,
-            source_type=download.source_type,
-            title=f"{download.title} (converted to {request.output_format})",
-            resolution=download.resolution,
-            file_path=convert_result.file_path,
-            file_size=convert_result.file_size,
-            duration=download.duration,
-            status="completed"
-        )
-        
-        db.add(converted_download)
-        await db.commit()
-        await db.refresh(converted_download)
-        
-        # Получаем относительный путь к файлу для URL
-        relative_path = os.path.relpath(convert_result.file_path, settings.UPLOAD_DIR)
-        download_url = f"/api/v1/downloads/file/{relative_path}"
-        
-        return DownloadResponse(
-            id=str(converted_download.id),
-            title=converted_download.title,
-            url=download_url,
-            file_size=converted_download.file_size,
-            resolution=str(converted_download.resolution.value),
-            duration=converted_download.duration
+    except HTTPException:
+        await request_cancel(job.id)
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Конвертация не завершилась, статус доступен по {job.status_url}"
         )
-        
-    except Exception as e:
-        logger.exception(f"Error converting video {request.input_file}: {str(e)}")
+    
+    if event.get("status") != DownloadStatus.COMPLETED.value:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Внутренняя ошибка сервера: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Ошибка конвертации: {event.get('error') or event.get('status')}"
         )
+    
+    return DownloadResponse(
+        id=str(job.id),
+        title=event.get("title") or "",
+        url=event["url"],
+        file_size=event.get("file_size"),
+        resolution="original",  # Конвертация не меняет разрешение исходника
+        format=request.output_format,
+        conversion=event.get("conversion")
+    )
 
 @router.get("/file/{file_path:path}")
 async def serve_file(
     file_path: str,
-    current_user: Optional[User] = Depends(get_optional_user)
+    http_request: Request,
+    md5: str = Query(..., description="Подпись ссылки"),
+    expires: int = Query(..., description="Время истечения ссылки (unix time)")
 ):
     """
-    Отдает скачанный файл пользователю.
-    Для авторизованных пользователей проверяет права.
+    Отдает скачанный файл по подписанной ссылке.
+    Ссылки выдаются после успешной загрузки с учетом прав пользователя, поэтому
+    здесь проверяется только подпись - без JWT и запросов к БД.
+    В режиме FILE_DELIVERY_MODE=accel сам файл отдает nginx (X-Accel-Redirect),
+    иначе файл отдается с поддержкой Range и условных запросов.
+    При STORAGE_BACKEND=s3 выполняется перенаправление на presigned URL хранилища.
     """
-    full_path = os.path.join(settings.UPLOAD_DIR, file_path)
+    if not verify_file_signature(file_path, md5, expires):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Ссылка недействительна или срок ее действия истек"
+        )
+    
+    if settings.STORAGE_BACKEND != "local":
+        # Ссылка выдана до переноса файлов в объектное хранилище - отправляем на presigned URL
+        return RedirectResponse(get_storage().url(os.path.normpath(file_path)))
+    
+    upload_root = os.path.realpath(settings.UPLOAD_DIR)
+    full_path = os.path.realpath(os.path.join(upload_root, file_path))
+    
+    # Не выпускаем путь за пределы директории загрузок
+    if os.path.commonpath([upload_root, full_path]) != upload_root:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Файл не найден"
+        )
     
     # Проверяем существование файла
-    if not os.path.exists(full_path):
+    if not os.path.isfile(full_path):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Файл не найден"
         )
     
-    # Для анонимных пользователей разрешаем только доступ к файлам в формате низкого качества
-    if not current_user:
-        # Проверяем разрешение файла (предполагается, что оно указано в имени файла)
-        if any(res in file_path.lower() for res in ["720", "1080", "hd", "fullhd", "2k", "4k"]):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Для скачивания файлов высокого качества требуется авторизация"
-            )
+    filename = os.path.basename(full_path)
+    await storage_manager.touch(full_path)
+    
+    if settings.FILE_DELIVERY_MODE == "accel":
+        # Backend только авторизует запрос; Range, ETag и sendfile обрабатывает nginx
+        relative_path = os.path.relpath(full_path, upload_root)
+        return Response(
+            headers={
+                "X-Accel-Redirect": settings.FILE_ACCEL_PREFIX + quote(relative_path),
+                "Content-Disposition": content_disposition(filename),
+                "Content-Type": mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            }
+        )
     
-    from fastapi.responses import FileResponse
-    return FileResponse(full_path)
+    return RangeFileResponse(http_request, full_path, filename=filename)
 
 @router.get("/history", response_model=List[DownloadResponse])
 async def get_download_history(
@@ -445,7 +608,7 @@ async def get_download_history(
         DownloadResponse(
             id=str(download.id),
             title=download.title,
-            url=f"/api/v1/downloads/file/{os.path.relpath(download.file_path, settings.UPLOAD_DIR)}",
+            url=await storage_manager.issue_url(download.file_path) if download.file_path else None,
             file_size=download.file_size,
             resolution=download.resolution.value,
             duration=download.duration
@@ -519,82 +682,226 @@ async def check_download_access(
     # Нет действующих подписок
     return False, None
 
-async def process_download(
-    download_id: int, 
-    url: str, 
-    resolution: Resolution,
+async def _enqueue_download(
+    db: AsyncSession,
+    url: str,
+    resolution: str,
+    user_id: Optional[int],
+    subscription_id: Optional[int],
+    tier: str,
+    use_instaloader: bool = False,
+    output_format: str = DownloadFormat.MP4.value,
+    user_key: Optional[str] = None
+) -> DownloadJobResponse:
+    """
+    Создает запись о скачивании со статусом PENDING и ставит задачу в очередь Celery
+    с приоритетом уровня подписки.
+    Возвращает ID задачи, по которому клиент опрашивает статус.
+    Если очередь воркеров переполнена, отвечает 429 с Retry-After.
+    """
+    task_id = str(uuid.uuid4())
+    try:
+        await worker_scheduler.admit(task_id, tier)
+    except SchedulerBusyError as e:
+        raise _queue_full_exception(e)
+    
+    download = Download(
+        user_id=user_id,
+        url=url,
+        format=DownloadFormat(output_format),
+        status=DownloadStatus.PENDING
+    )
+    
+    db.add(download)
+    await db.commit()
+    await db.refresh(download)
+    
+    # Публикация в брокер - блокирующий вызов, не задерживаем event loop
+    task = await asyncio.to_thread(
+        process_download.apply_async,
+        kwargs={
+            "download_id": download.id,
+            "url": url,
+            "resolution": resolution,
+            "user_id": user_id,
+            "subscription_id": subscription_id,
+            "use_instaloader": use_instaloader,
+            "tier": tier,
+            "enqueued_at": time.time(),
+            "output_format": output_format,
+            "user_key": user_key,
+        },
+        task_id=task_id,
+        priority=CELERY_TIER_PRIORITY[tier]
+    )
+    
+    download.task_id = task.id
+    db.add(download)
+    await db.commit()
+    
+    return DownloadJobResponse(
+        id=download.id,
+        status=DownloadStatus.PENDING.value,
+        status_url=f"/api/v1/downloads/{download.id}/status",
+        events_url=f"/api/v1/downloads/{download.id}/events"
+    )
+
+async def _enqueue_conversion(
+    db: AsyncSession,
+    source: Download,
+    output_format: str,
+    preset: Optional[str],
     user_id: int,
-    subscription_id: Optional[int]
-):
+    tier: str
+) -> DownloadJobResponse:
+    """
+    Создает запись о результате конвертации со статусом PENDING и ставит задачу
+    в очередь конвертаций. Статус и события доступны по тем же адресам, что и у загрузок.
+    """
+    download = Download(
+        user_id=user_id,
+        url=source.url,
+        title=f"{source.title} (converted to {output_format})",
+        format=_get_download_format(output_format),
+        status=DownloadStatus.PENDING
+    )
+    
+    db.add(download)
+    await db.commit()
+    await db.refresh(download)
+    
+    # Публикация в брокер - блокирующий вызов, не задерживаем event loop
+    task = await asyncio.to_thread(
+        convert_download.apply_async,
+        kwargs={
+            "download_id": download.id,
+            "input_path": source.file_path,
+            "output_format": output_format,
+            "user_id": user_id,
+            "preset": preset,
+            "tier": tier,
+            "enqueued_at": time.time(),
+        },
+        priority=CELERY_TIER_PRIORITY[tier]
+    )
+    
+    download.task_id = task.id
+    db.add(download)
+    await db.commit()
+    
+    return DownloadJobResponse(
+        id=download.id,
+        status=DownloadStatus.PENDING.value,
+        status_url=f"/api/v1/downloads/{download.id}/status",
+        events_url=f"/api/v1/downloads/{download.id}/events",
+        message="Видео поставлено в очередь на конвертацию"
+    )
+
+async def _wait_for_job(download_id: int) -> Dict[str, Any]:
+    """Ожидает терминальное событие фоновой задачи и возвращает его"""
+    async for event in stream_progress(download_id):
+        if event is not None and event.get("status") in TERMINAL_STATUSES:
+            return event
+    raise RuntimeError(f"Progress stream for download {download_id} ended without a final status")
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # nginx не должен буферизовать поток событий
+    "X-Accel-Buffering": "no",
+}
+
+async def _job_status(download: Download) -> DownloadJobStatus:
+    """Статус фоновой загрузки для ответа API"""
+    return DownloadJobStatus(
+        id=download.id,
+        status=download.status.value if download.status else DownloadStatus.PENDING.value,
+        title=download.title,
+        url=await _download_file_url(download),
+        error=download.error_message,
+        created_at=download.created_at,
+        updated_at=download.updated_at
+    )
+
+async def _cancel_on_disconnect(http_request: Request, coro):
     """
-    Фоновая задача для скачивания видео.
-    Обновляет запись в БД после завершения скачивания.
+    Выполняет coro, пока клиент подключен. При отключении клиента задача
+    отменяется (процесс yt-dlp/ffmpeg завершается) и возвращается ответ 499.
     """
+    task = asyncio.ensure_future(coro)
     try:
-        # Создаем асинхронную сессию базы данных
-        async with AsyncSessionLocal() as db:
-            # Получаем загрузку из БД
-            query = select(Download).where(Download.id == download_id)
-            result = await db.execute(query)
-            download = result.scalar_one_or_none()
-            
-            if not download:
-                logger.error(f"Download ID {download_id} not found in DB")
-                return
-            
-            # Создаем директорию для пользователя
-            user_dir = os.path.join(settings.UPLOAD_DIR, str(user_id))
-            os.makedirs(user_dir, exist_ok=True)
-            
-            # Запускаем скачивание
-            downloader = VideoDownloader()
-            result = await downloader.download_video(
-                url=url,
-                resolution=resolution.value,
-                output_dir=user_dir
-            )
-            
-            if not result.success:
-                # Обновляем статус в БД при ошибке
-                download.status = "failed"
-                db.add(download)
-                await db.commit()
-                logger.error(f"Download failed: {result.error}")
-                return
-            
-            # Обновляем запись в БД
-            download.title = result.title
-            download.file_path = result.file_path
-            download.file_size = result.file_size
-            download.duration = result.duration
-            download.status = "completed"
-            db.add(download)
-            
-            # Если есть подписка, обновляем счетчик скачиваний
-            if subscription_id:
-                query = select(Subscription).where(Subscription.id == subscription_id)
-                result = await db.execute(query)
-                subscription = result.scalar_one_or_none()
-                
-                if subscription:
-                    subscription.downloads_used += 1
-                    db.add(subscription)
-            
-            await db.commit()
-            
-    except Exception as e:
-        logger.exception(f"Error during download process: {str(e)}")
-        
-        # Обновляем статус в БД при любой другой ошибке
-        async with AsyncSessionLocal() as db:
-            query = select(Download).where(Download.id == download_id)
-            result = await db.execute(query)
-            download = result.scalar_one_or_none()
-            
-            if download:
-                download.status = "failed"
-                db.add(download)
-                await db.commit()
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=1.0)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info(f"Client disconnected, cancelling {http_request.url.path}")
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise HTTPException(status_code=499, detail="Клиент закрыл соединение")
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+def _format_sse(event: Dict[str, Any]) -> str:
+    """Форматирует событие прогресса как сообщение Server-Sent Events"""
+    event_name = "status" if event.get("status") in TERMINAL_STATUSES else "progress"
+    return f"event: {event_name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+async def _get_visible_download(
+    db: AsyncSession, download_id: int, current_user: Optional[User]
+) -> Download:
+    """
+    Возвращает загрузку, доступную текущему пользователю.
+    Анонимные загрузки доступны всем, остальные - только владельцу.
+    """
+    query = select(Download).where(Download.id == download_id)
+    result = await db.execute(query)
+    download = result.scalar_one_or_none()
+    
+    if not download or (
+        download.user_id is not None
+        and (not current_user or current_user.id != download.user_id)
+    ):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Скачивание не найдено")
+    
+    return download
+
+async def _download_file_url(download: Download) -> Optional[str]:
+    """
+    Подписанная ссылка на скачивание файла завершенной загрузки
+
+    Выдача ссылки продлевает файл в очереди вытеснения (storage_manager.issue_url)
+    """
+    if download.status != DownloadStatus.COMPLETED or not download.file_path:
+        return None
+    return await storage_manager.issue_url(download.file_path)
+
+def _scheduler_user_key(current_user: Optional[User], http_request: Request) -> str:
+    """Ключ пользователя для справедливого распределения слотов загрузки"""
+    if current_user:
+        return f"user:{current_user.id}"
+    # Анонимные пользователи различаются по IP (nginx передает X-Real-IP)
+    client_ip = http_request.headers.get("X-Real-IP") or (
+        http_request.client.host if http_request.client else "unknown"
+    )
+    return f"ip:{client_ip}"
+
+def _queue_full_exception(error: SchedulerBusyError) -> HTTPException:
+    """Ответ 429 при переполненной очереди загрузок"""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Сервис перегружен, повторите запрос позже",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def _storage_full_exception(error: StorageFullError) -> HTTPException:
+    """Ответ 507, когда файл не поместится в хранилище"""
+    return HTTPException(
+        status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+        detail="Недостаточно места для сохранения файла, повторите запрос позже",
+        headers={"Retry-After": str(settings.STORAGE_FULL_RETRY_DELAY)}
+    )
 
 def _get_source_type(source_type_str: str) -> SourceType:
     """Преобразует строковый тип источника в enum"""
@@ -606,6 +913,13 @@ def _get_source_type(source_type_str: str) -> SourceType:
     }
     return mapping.get(source_type_str, SourceType.OTHER)
 
+def _get_download_format(format_str: str) -> Optional[DownloadFormat]:
+    """Формат для Download.format (None для форматов вне DownloadFormat)"""
+    try:
+        return DownloadFormat(format_str)
+    except ValueError:
+        return None
+
 def _get_resolution(resolution_str: str) -> Resolution:
     """Преобразует строковое разрешение в enum"""
     mapping = {
@@ -5,6 +5,7 @@ from sqlalchemy import and_, desc
 from typing import List, Optional
 from datetime import datetime
 import logging
+import asyncio
 import json
 
 from app.utils.database import get_db
@@ -12,6 +13,9 @@ from app.models import User, Payment, PaymentStatus, PaymentMethod, Subscription
 from app.schemas.payment import PaymentCreate, PaymentResponse, PaymentDetail, PaymentCallback
 from app.api.deps import get_current_user
 from app.services.payment import get_payment_processor
+from app.services.payment_events import parse_webhook, callback_event, record_event
+from app.services.principal_cache import invalidate_entitlement
+from app.tasks.payments import process_payment_event
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -141,61 +145,67 @@ async def get_payment(
     
     return payment
 
-@router.post("/callback")
-async def payment_callback(
-    callback_data: PaymentCallback,
-    background_tasks: BackgroundTasks,
+async def _enqueue_event(event_id: Optional[int]) -> None:
+    if event_id is None:
+        return
+    try:
+        # Публикация в брокер - блокирующий вызов, не задерживаем event loop
+        await asyncio.to_thread(process_payment_event.delay, event_id)
+    except Exception as e:
+        # Событие уже сохранено: его поставит в очередь check_pending_payments
+        logger.error(f"Failed to enqueue payment event {event_id}: {str(e)}")
+
+
+@router.post("/webhook")
+async def payment_webhook(
     request: Request,
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Обработка обратного вызова от платежной системы
+    Прием уведомлений платежных систем (ЮKassa, Stripe)
+
+    Уведомление только сохраняется и ставится в очередь воркера, поэтому
+    ответ отправляется сразу. Повторные доставки того же события
+    подтверждаются без повторной обработки.
     """
+    body = await request.body()
     try:
-        # Получаем дополнительные данные запроса
-        headers = dict(request.headers)
-        
-        logger.info(f"Payment callback received: {callback_data.dict()}")
-        logger.info(f"Headers: {headers}")
-        
-        # Проверяем существование платежа по transaction_id
-        query = select(Payment).where(Payment.transaction_id == callback_data.payment_id)
-        result = await db.execute(query)
-        payment = result.scalar_one_or_none()
-        
-        if not payment:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Платеж с transaction_id {callback_data.payment_id} не найден"
-            )
-        
-        # Определяем новый статус платежа
-        new_status = None
-        if callback_data.status.lower() in ["succeeded", "completed", "paid"]:
-            new_status = PaymentStatus.COMPLETED
-        elif callback_data.status.lower() in ["canceled", "failed"]:
-            new_status = PaymentStatus.FAILED
-        else:
-            new_status = PaymentStatus.PENDING
-        
-        # Обновляем статус платежа
-        payment_processor = get_payment_processor(payment.payment_method.value)
-        
-        background_tasks.add_task(
-            payment_processor.update_payment_status,
-            payment_id=payment.id,
-            status=new_status
-        )
-        
-        return {"status": "success", "message": "Callback processed"}
-        
-    except Exception as e:
-        logger.exception(f"Error processing payment callback: {str(e)}")
+        event = parse_webhook(body, request.headers.get("stripe-signature"))
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Rejected payment webhook: {str(e)}")
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Ошибка обработки обратного вызова: {str(e)}"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Некорректное уведомление"
         )
 
+    await _enqueue_event(await record_event(db, event, body))
+    return {"status": "success"}
+
+
+@router.post("/callback")
+async def payment_callback(
+    callback_data: PaymentCallback,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Обработка обратного вызова от платежной системы
+
+    Обратный вызов обрабатывается так же, как уведомление /webhook:
+    статус платежа воркер запрашивает у платежной системы.
+    """
+    logger.info(f"Payment callback received: {callback_data.dict()}")
+
+    event = callback_event(callback_data.payment_id, callback_data.status.lower())
+    payload = json.dumps(callback_data.dict()).encode()
+    await _enqueue_event(await record_event(db, event, payload))
+    return {"status": "success", "message": "Callback processed"}
+
+async def _check_payment_and_invalidate(payment_processor, payment_id: int, user_id: int) -> None:
+    await payment_processor.check_payment(payment_id=payment_id)
+    # Проверка могла активировать подписку
+    await invalidate_entitlement(user_id)
+
+
 @router.post("/check/{payment_id}")
 async def check_payment(
     payment_id: int,
@@ -229,8 +239,10 @@ async def check_payment(
     payment_processor = get_payment_processor(payment.payment_method.value)
     
     background_tasks.add_task(
-        payment_processor.check_payment,
-        payment_id=payment.id
+        _check_payment_and_invalidate,
+        payment_processor,
+        payment_id=payment.id,
+        user_id=current_user.id
     )
     
     return {"status": "pending", "message": "Запрос на проверку статуса платежа отправлен"} 
\ No newline at end of file
@@ -16,6 +16,7 @@ from app.api.deps import get_current_user, get_admin_user, get_current_active_us
 from app.core.config import settings
 from app.services.payment import get_payment_processor
 from app.services.payment import PaymentService
+from app.services.principal_cache import invalidate_entitlement
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -219,6 +220,7 @@ async def create_subscription(
         db.add(subscription)
         await db.commit()
         await db.refresh(subscription)
+        await invalidate_entitlement(current_user.id)
         
         return subscription
     
@@ -294,6 +296,7 @@ async def create_trial_subscription(
     db.add(subscription)
     await db.commit()
     await db.refresh(subscription)
+    await invalidate_entitlement(current_user.id)
     
     return subscription
 
@@ -9,6 +9,7 @@ from app.schemas.user import UserDetail, UserUpdate
 from app.schemas.download import DownloadDetail
 from app.schemas.subscription import SubscriptionDetail
 from app.api.deps import get_current_user
+from app.services.principal_cache import invalidate_user
 from app.api.api_v1.endpoints.auth import get_password_hash
 
 router = APIRouter()
@@ -45,6 +46,7 @@ async def update_current_user(
     db.add(current_user)
     await db.commit()
     await db.refresh(current_user)
+    await invalidate_user(current_user.id)
     
     return current_user
 
@@ -2,13 +2,13 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 from typing import Optional, Union
 
 from app.core.config import settings
 from app.utils.database import get_db
 from app.models.user import User, UserRole
 from app.models.subscription import Subscription
+from app.services.principal_cache import get_cached_user, get_active_subscription
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_PREFIX}/auth/login",
@@ -41,10 +41,8 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    # Получаем пользователя из БД
-    query = select(User).where(User.id == user_id)
-    result = await db.execute(query)
-    user = result.scalar_one_or_none()
+    # Получаем пользователя из кэша или из БД
+    user = await get_cached_user(db, user_id)
     
     if not user:
         raise credentials_exception
@@ -97,10 +95,8 @@ async def get_optional_user(
         if user_id is None:
             return None
         
-        # Получаем пользователя из БД
-        query = select(User).where(User.id == user_id)
-        result = await db.execute(query)
-        user = result.scalar_one_or_none()
+        # Получаем пользователя из кэша или из БД
+        user = await get_cached_user(db, user_id)
         
         if not user or not user.is_active:
             return None
@@ -123,13 +119,8 @@ async def check_subscription_active(db: AsyncSession, user_id: int) -> Subscript
     Raises:
         HTTPException: Если у пользователя нет активной подписки
     """
-    # Получаем активные подписки
-    query = select(Subscription).where(
-        Subscription.user_id == user_id,
-        Subscription.is_active == 1
-    )
-    result = await db.execute(query)
-    subscription = result.scalar_one_or_none()
+    # Получаем активную подписку из кэша или из БД
+    subscription = await get_active_subscription(db, user_id)
     
     if not subscription:
         raise HTTPException(
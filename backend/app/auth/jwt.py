@@ -9,7 +9,7 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.utils.database import get_db
-from app.services.user import UserService
+from app.services.principal_cache import get_cached_user
 from app.auth.password import verify_password, get_password_hash
 
 logger = logging.getLogger(__name__)
@@ -58,8 +58,7 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user_service = UserService(db)
-    user = await user_service.get_user_by_id(int(user_id))
+    user = await get_cached_user(db, int(user_id))
     if user is None:
         raise credentials_exception
     
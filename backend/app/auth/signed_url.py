@@ -0,0 +1,62 @@
+import os
+import time
+import base64
+import hashlib
+import hmac
+from typing import Optional
+from urllib.parse import quote
+
+from app.core.config import settings
+
+# Префикс, под которым nginx отдает файлы по подписанным ссылкам
+SIGNED_FILES_PREFIX = "/files/"
+
+
+def _secret() -> str:
+    return settings.FILE_URL_SECRET or settings.SECRET_KEY
+
+
+def sign_file_path(relative_path: str, expires: int) -> str:
+    """
+    Подпись ссылки на файл в формате nginx secure_link_md5
+
+    Подписывается строка "<expires>/files/<relative_path> <secret>", что
+    соответствует директиве secure_link_md5 "$secure_link_expires$uri <secret>".
+    nginx secure_link поддерживает только MD5, поэтому используется он,
+    а не HMAC; секрет известен только backend и nginx.
+
+    Returns:
+        MD5 в base64url без выравнивания, как ожидает nginx
+    """
+    payload = f"{expires}{SIGNED_FILES_PREFIX}{relative_path} {_secret()}"
+    digest = hashlib.md5(payload.encode("utf-8")).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def signed_file_url(file_path: str, ttl: Optional[int] = None) -> str:
+    """
+    Создает подписанную ссылку на файл из UPLOAD_DIR с ограниченным сроком действия
+
+    В режиме FILE_DELIVERY_MODE=accel ссылка ведет прямо в nginx (/files/),
+    иначе в /api/v1/downloads/file/, где подпись проверяет backend.
+
+    Args:
+        file_path: Путь к файлу (абсолютный или относительно UPLOAD_DIR)
+        ttl: Срок действия ссылки в секундах (по умолчанию FILE_URL_TTL)
+    """
+    relative_path = os.path.normpath(os.path.relpath(file_path, settings.UPLOAD_DIR))
+    expires = int(time.time()) + (ttl or settings.FILE_URL_TTL)
+    signature = sign_file_path(relative_path, expires)
+
+    base = SIGNED_FILES_PREFIX if settings.FILE_DELIVERY_MODE == "accel" else "/api/v1/downloads/file/"
+    return f"{base}{quote(relative_path)}?md5={signature}&expires={expires}"
+
+
+def verify_file_signature(relative_path: str, signature: str, expires: int) -> bool:
+    """
+    Проверяет подпись ссылки (сравнение за постоянное время) и срок ее действия
+    """
+    if expires < time.time():
+        return False
+    expected = sign_file_path(os.path.normpath(relative_path), expires)
+    return hmac.compare_digest(expected, signature)
@@ -25,6 +25,11 @@ class Settings(BaseSettings):
     DB_ECHO: bool = False
     DB_POOL_SIZE: int = 5
     DB_MAX_OVERFLOW: int = 10
+    # Пул соединений воркера Celery: один движок на процесс, задачи выполняются последовательно
+    DB_WORKER_POOL_SIZE: int = 2
+    DB_WORKER_MAX_OVERFLOW: int = 3
+    DB_WORKER_POOL_RECYCLE: int = 30 * 60  # Раньше wait_timeout MariaDB, чтобы не получать оборванные соединения
+    DB_WORKER_POOL_TIMEOUT: int = 60
     
     # Настройки CORS
     CORS_ORIGINS: Union[List[str], str] = ["*"]
@@ -32,7 +37,169 @@ class Settings(BaseSettings):
     # Настройки для загрузок
     UPLOAD_DIR: str = Field(default="/tmp/youtube-downloader")
     MAX_UPLOAD_SIZE: int = 5 * 1024 * 1024 * 1024  # 5GB
+    # "direct" - файл отдает backend (Range/ETag), "accel" - nginx по заголовку X-Accel-Redirect
+    FILE_DELIVERY_MODE: str = "direct"
+    FILE_ACCEL_PREFIX: str = "/protected-downloads/"  # internal location nginx, указывающая на UPLOAD_DIR
+    # Секрет подписанных ссылок на файлы (тот же, что в secure_link_md5 nginx); по умолчанию SECRET_KEY
+    FILE_URL_SECRET: Optional[str] = None
+    FILE_URL_TTL: int = 6 * 60 * 60  # Срок действия ссылки на файл
+
+    # Хранилище готовых файлов: "local" - диск UPLOAD_DIR, "s3" - S3-совместимое (AWS S3, MinIO)
+    STORAGE_BACKEND: str = "local"
+    S3_BUCKET: Optional[str] = None
+    S3_ENDPOINT_URL: Optional[str] = None  # Например http://minio:9000; пусто - AWS S3
+    S3_REGION: Optional[str] = None
+    S3_ACCESS_KEY_ID: Optional[str] = None
+    S3_SECRET_ACCESS_KEY: Optional[str] = None
+    S3_PREFIX: str = "downloads"
+    S3_MULTIPART_CHUNK_SIZE: int = 16 * 1024 * 1024  # Размер части multipart-загрузки
+    S3_MAX_CONCURRENCY: int = 8  # Параллельные части при загрузке и скачивании
+
+    # Учет места в хранилище: вытеснение давно не выдававшихся файлов по водяным знакам
+    STORAGE_MAX_BYTES: Optional[int] = None  # Емкость хранилища; по умолчанию размер тома UPLOAD_DIR
+    STORAGE_USER_MAX_BYTES: Optional[int] = None  # Квота на пользователя
+    STORAGE_HIGH_WATERMARK: float = 0.90  # Выше этой доли заполнения начинается вытеснение
+    STORAGE_LOW_WATERMARK: float = 0.80  # До этой доли заполнения вытесняются файлы
+    STORAGE_EVICTION_BATCH: int = 100
+    STORAGE_FULL_RETRY_DELAY: int = 5 * 60  # Задержка повтора фоновой загрузки при нехватке места
+    STORAGE_FULL_MAX_RETRIES: int = 12
+
+    # Очистка старых файлов (app.tasks.cleanup.remove_old_files)
+    CLEANUP_BATCH_SIZE: int = 500  # Записей в одной транзакции
+    CLEANUP_CONCURRENCY: int = 16  # Одновременных удалений файлов
+    # Файлы в UPLOAD_DIR без записи в downloads (анонимные загрузки, остатки неудачных загрузок)
+    ORPHAN_ACTION: str = "quarantine"  # "quarantine" - перенос в <UPLOAD_DIR>/.orphans, "delete" - удаление
+    ORPHAN_GRACE_SECONDS: int = 12 * 60 * 60  # Больше FILE_URL_TTL и времени выполнения загрузки
+    ORPHAN_QUARANTINE_DAYS: int = 7
+    ORPHAN_BATCH_SIZE: int = 500  # Путей в одном запросе к БД
+
+    # Фоновые загрузки через Celery
+    DOWNLOAD_QUEUE_NAME: str = "downloads"
+    DOWNLOAD_TASK_SOFT_TIME_LIMIT: int = 60 * 60  # 1 час на загрузку
+    DOWNLOAD_TASK_TIME_LIMIT: int = 60 * 60 + 300
+    
+    # Конвертация в отдельной очереди и пуле воркеров (celery worker -Q conversions)
+    CONVERT_QUEUE_NAME: str = "conversions"
+    CONVERT_TASK_SOFT_TIME_LIMIT: int = 65 * 60  # Копирование потоков и повтор с перекодированием по CONVERT_TIMEOUT
+    CONVERT_TASK_TIME_LIMIT: int = 70 * 60
+    CONVERT_WORKER_CONCURRENCY: Optional[int] = None  # Процессов воркера конвертаций, по умолчанию половина ядер
+    CONVERT_VIDEO_THREADS: Optional[int] = None  # -threads для перекодирования видео, по умолчанию ядра / процессы
+    CONVERT_WAIT_TIMEOUT: int = 30 * 60  # Сколько /downloads/convert без queued ждет результата
+    
+    # Кэш результатов конвертации (ключ - SHA-256 исходника, формат и пресет)
+    CONVERT_CACHE_ENABLED: bool = True
+    CONVERT_CACHE_DIR: Optional[str] = None  # По умолчанию <UPLOAD_DIR>/.cache/conversions
+    CONVERT_CACHE_MAX_BYTES: int = 20 * 1024 * 1024 * 1024  # 20GB
+    CONVERT_CACHE_MAX_AGE_DAYS: int = 7
+    CONVERT_SOURCE_HASH_TTL: int = 7 * 24 * 60 * 60  # Сколько хранится хэш содержимого исходника
+    
+    # Кэш скачанных файлов (дедупликация по ID видео, разрешению и формату)
+    DOWNLOAD_CACHE_ENABLED: bool = True
+    DOWNLOAD_CACHE_DIR: Optional[str] = None  # По умолчанию <UPLOAD_DIR>/.cache/downloads
+    DOWNLOAD_CACHE_MAX_BYTES: int = 50 * 1024 * 1024 * 1024  # 50GB
+    DOWNLOAD_CACHE_MAX_AGE_DAYS: int = 7
+    
+    # Объединение одновременных загрузок одного видео (single-flight)
+    DOWNLOAD_SINGLEFLIGHT_LOCK_TTL: int = 60
+    DOWNLOAD_SINGLEFLIGHT_WAIT_TIMEOUT: int = 60 * 60
     
+    # Кэш информации о видео (/downloads/info), TTL в секундах по платформам
+    VIDEO_INFO_CACHE_ENABLED: bool = True
+    VIDEO_INFO_CACHE_TTL: Dict[str, int] = {
+        "youtube": 6 * 60 * 60,
+        "vk": 60 * 60,
+        "tiktok": 30 * 60,
+        "instagram": 30 * 60,
+        "other": 30 * 60,
+    }
+    VIDEO_INFO_NEGATIVE_TTL: int = 60  # Кэширование ошибок экстрактора
+    VIDEO_INFO_LOCAL_CACHE_SIZE: int = 2048
+    
+    # Настройки yt-dlp
+    YTDLP_MAX_FILESIZE: int = 2 * 1024 * 1024 * 1024  # 2GB
+    # "subprocess" - запуск CLI на каждый вызов, "library" - пул прогретых процессов с YoutubeDL
+    YTDLP_ENGINE: str = "subprocess"
+    YTDLP_POOL_SIZE: int = 4
+    YTDLP_POOL_MAX_TASKS_PER_CHILD: int = 100
+    
+    # Параллельная загрузка фрагментов DASH/HLS и HTTP-запросы по диапазонам, по платформам
+    DOWNLOAD_CONCURRENT_FRAGMENTS: Dict[str, int] = {
+        "youtube": 4,
+        "vk": 4,
+        "tiktok": 1,
+        "instagram": 1,
+        "other": 2,
+    }
+    # Размер диапазона HTTP-запроса (0 - файл одним запросом); YouTube ограничивает скорость длинных запросов
+    DOWNLOAD_HTTP_CHUNK_SIZE: Dict[str, int] = {
+        "youtube": 10 * 1024 * 1024,
+        "vk": 0,
+        "tiktok": 0,
+        "instagram": 0,
+        "other": 0,
+    }
+    # Внешний загрузчик (например, "aria2c"); не используется, если не установлен
+    DOWNLOAD_EXTERNAL_DOWNLOADER: Optional[str] = None
+    DOWNLOAD_EXTERNAL_DOWNLOADER_ARGS: List[str] = [
+        "--max-connection-per-server=8", "--split=8", "--min-split-size=1M"
+    ]
+    # Общая полоса всех загрузок в байтах/с (None - без ограничения)
+    DOWNLOAD_BANDWIDTH_LIMIT: Optional[int] = None
+    DOWNLOAD_BANDWIDTH_SHARES: int = 4  # Доля одной загрузки - LIMIT / SHARES, сумма долей не больше LIMIT
+    DOWNLOAD_BANDWIDTH_MIN_RATE: int = 256 * 1024  # Меньшего остатка бюджета загрузка не получает, а ждет
+    
+    # Ограничения параллельных загрузок и конвертаций в процессе API
+    DOWNLOAD_MAX_CONCURRENT: int = 8
+    DOWNLOAD_SOURCE_LIMITS: Dict[str, int] = {
+        "youtube": 4,
+        "tiktok": 2,
+        "vk": 2,
+        "instagram": 2,
+        "other": 2,
+    }
+    DOWNLOAD_MAX_PER_USER: int = 2
+    DOWNLOAD_MAX_QUEUE: int = 100  # При большей очереди отвечаем 429
+    DOWNLOAD_AVG_JOB_SECONDS: int = 60  # Начальная оценка для Retry-After
+    DOWNLOAD_PAID_RESERVED_SLOTS: int = 3  # Слоты, доступные только платным подпискам
+    # Ограничения загрузок в воркерах Celery (режим queued), общие для всех воркеров через Redis;
+    # лимиты по платформам, на пользователя и глубина очереди - те же, что и в процессе API
+    # Должно совпадать с числом процессов воркера очереди downloads: DOWNLOAD_PAID_RESERVED_SLOTS
+    # из них доступны только платным подпискам
+    DOWNLOAD_WORKER_MAX_CONCURRENT: int = 8
+    DOWNLOAD_SLOT_RETRY_DELAY: int = 5  # Через сколько секунд задача без слота снова пробует его занять
+    DOWNLOAD_QUEUE_WAIT_TIMEOUT: int = 60 * 60  # Сколько задача может ждать слот, прежде чем завершиться ошибкой
+    DOWNLOAD_PROGRESS_INTERVAL: float = 1.0  # Не чаще одного события прогресса в секунду
+    DOWNLOAD_PROGRESS_TTL: int = 60 * 60  # Сколько хранится последнее событие прогресса
+    # Таймауты процессов yt-dlp по платформам (секунды): общее время и время без прогресса.
+    # Должны быть меньше DOWNLOAD_TASK_SOFT_TIME_LIMIT
+    DOWNLOAD_TIMEOUTS: Dict[str, int] = {
+        "youtube": 30 * 60,
+        "tiktok": 5 * 60,
+        "vk": 20 * 60,
+        "instagram": 5 * 60,
+        "other": 20 * 60,
+    }
+    DOWNLOAD_IDLE_TIMEOUTS: Dict[str, int] = {
+        "youtube": 120,
+        "tiktok": 60,
+        "vk": 120,
+        "instagram": 60,
+        "other": 120,
+    }
+    CONVERT_TIMEOUT: int = 30 * 60
+    CONVERT_IDLE_TIMEOUT: int = 120
+    CONVERT_STREAM_COPY_ENABLED: bool = True  # Копировать совместимые потоки вместо перекодирования
+    CONVERT_DEFAULT_PRESET: str = "fast"  # "fast" (veryfast, CRF 23) или "quality" (medium, CRF 20)
+    FFPROBE_TIMEOUT: int = 30
+    DOWNLOAD_CANCEL_POLL_INTERVAL: float = 1.0  # Как часто воркер проверяет запрос отмены
+    VIDEO_INFO_MAX_CONCURRENT: int = 8
+    
+    # Кэш пользователя и активной подписки для авторизованных запросов
+    PRINCIPAL_CACHE_ENABLED: bool = True
+    PRINCIPAL_CACHE_TTL: int = 60  # В Redis
+    PRINCIPAL_CACHE_LOCAL_TTL: int = 10  # В памяти процесса: задержка применения изменений из других процессов
+    PRINCIPAL_CACHE_LOCAL_SIZE: int = 10000
+
     # Google OAuth
     GOOGLE_CLIENT_ID: Optional[str] = None
     GOOGLE_CLIENT_SECRET: Optional[str] = None
@@ -41,11 +208,13 @@ class Settings(BaseSettings):
     # YooKassa платежи
     YOOKASSA_SHOP_ID: Optional[str] = None
     YOOKASSA_SECRET_KEY: Optional[str] = None
+    YOOKASSA_API_URL: str = "https://api.yookassa.ru/v3"
     
     # Stripe платежи
     STRIPE_SECRET_KEY: Optional[str] = None
     STRIPE_PUBLIC_KEY: Optional[str] = None
     STRIPE_WEBHOOK_SECRET: Optional[str] = None
+    STRIPE_API_URL: str = "https://api.stripe.com/v1"
     
     # Общие настройки платежной системы
     PAYMENT_PROVIDER: str = Field(default="test")  # "yookassa", "stripe", "test"
@@ -53,6 +222,27 @@ class Settings(BaseSettings):
     PAYMENT_API_SECRET: Optional[str] = None
     PAYMENT_TEST_MODE: bool = True
     PAYMENT_WEBHOOK_URL: Optional[str] = None
+    # Опрос статусов незавершенных платежей (app.tasks.payments.check_pending_payments)
+    PAYMENT_POLL_CONCURRENCY: int = 20  # Одновременных запросов к платежным системам
+    PAYMENT_POLL_RATE_LIMITS: Dict[str, float] = {  # Запросов в секунду на платежную систему
+        "yookassa": 10.0,
+        "stripe": 20.0,
+    }
+    PAYMENT_POLL_BATCH_SIZE: int = 200
+    PAYMENT_POLL_TIME_BUDGET: int = 12 * 60  # Меньше интервала запуска задачи (15 минут)
+    PAYMENT_POLL_BACKOFF_BASE: int = 60  # Первая пауза для платежа, оставшегося в ожидании
+    PAYMENT_POLL_BACKOFF_MAX: int = 6 * 60 * 60
+    PAYMENT_POLL_MIN_AGE: int = 10 * 60  # Более новые платежи подтверждаются уведомлениями
+    # Уведомления платежных систем (POST /payments/webhook)
+    PAYMENT_EVENT_MAX_RETRIES: int = 8
+    PAYMENT_EVENT_RETRY_DELAY: int = 30  # Первая пауза, дальше удваивается
+    PAYMENT_EVENT_STALE_AFTER: int = 5 * 60  # Необработанные дольше ставятся в очередь повторно
+
+    # Общий HTTP-клиент (app.utils.http)
+    HTTP_CLIENT_TIMEOUT: float = 15.0
+    HTTP_CLIENT_CONNECT_TIMEOUT: float = 5.0
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE: int = 20
     
     # URL фронтенда для редиректов
     FRONTEND_URL: str = Field(default="http://localhost:3000")
@@ -120,6 +310,16 @@ class Settings(BaseSettings):
                     return values.get("STRIPE_SECRET_KEY")
         return v
     
+    @validator("FILE_URL_SECRET", always=True)
+    def check_file_url_secret(cls, v, values):
+        # Прежнее значение по умолчанию из docker-compose общеизвестно: по нему можно подделать ссылку
+        if v == "change-me-file-url-secret":
+            raise ValueError("FILE_URL_SECRET must not be the placeholder value")
+        # В режиме accel ссылки проверяет nginx, которому SECRET_KEY неизвестен
+        if not v and values.get("FILE_DELIVERY_MODE") == "accel":
+            raise ValueError("FILE_URL_SECRET must be set when FILE_DELIVERY_MODE=accel")
+        return v
+    
     @validator("PAYMENT_WEBHOOK_URL", pre=True)
     def set_webhook_url(cls, v, values):
         if not v:
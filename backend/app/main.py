@@ -8,6 +8,8 @@ import time
 from app.core.config import settings
 from app.api.api_v1.api import api_router
 from app.utils.database import get_db
+from app.services.ytdlp_engine import ytdlp_engine
+from app.utils.http import close_http_client
 
 # Настройка логирования
 logging.basicConfig(
@@ -62,7 +64,13 @@ async def startup_event():
     
     # Создаем директорию для загрузок, если не существует
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    
+    # Прогреваем пул процессов yt-dlp, чтобы первые запросы не ждали импорта
+    if settings.YTDLP_ENGINE == "library":
+        ytdlp_engine.warm_up()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    logger.info("Application shutting down...") 
\ No newline at end of file
+    logger.info("Application shutting down...")
+    ytdlp_engine.shutdown(wait=False)
+    await close_http_client()
\ No newline at end of file
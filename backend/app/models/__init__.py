@@ -1,4 +1,4 @@
 from app.models.user import User, UserRole
 from app.models.download import Download, SourceType, Resolution, DownloadStatus, DownloadFormat
 from app.models.subscription import Subscription, SubscriptionType, SubscriptionStatus
-from app.models.payment import Payment, PaymentStatus, PaymentMethod, PaymentHistory 
\ No newline at end of file
+from app.models.payment import Payment, PaymentStatus, PaymentMethod, PaymentHistory, PaymentEvent, PaymentEventStatus 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, Integer, String, DateTime, ForeignKey, Enum
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, ForeignKey, Enum, Text
 from sqlalchemy.orm import relationship
 import enum
 from datetime import datetime
@@ -11,6 +11,8 @@ class DownloadStatus(enum.Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+    REMOVED = "removed"  # Файл удален очисткой или вытеснен из хранилища
 
 
 class DownloadFormat(enum.Enum):
@@ -46,7 +48,9 @@ class Download(Base):
     title = Column(String(255), nullable=True)
     format = Column(Enum(DownloadFormat), default=DownloadFormat.MP4)
     status = Column(Enum(DownloadStatus), default=DownloadStatus.PENDING)
-    file_path = Column(String(255), nullable=True)
+    file_path = Column(String(255), nullable=True, index=True)
+    task_id = Column(String(255), nullable=True)  # ID задачи Celery для фоновых загрузок
+    error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 import enum
 from datetime import datetime
@@ -13,6 +13,13 @@ class PaymentStatus(str, enum.Enum):
     REFUNDED = "refunded"
 
 
+class PaymentEventStatus(str, enum.Enum):
+    RECEIVED = "received"
+    PROCESSED = "processed"
+    IGNORED = "ignored"  # Событие не меняет статус платежа
+    FAILED = "failed"
+
+
 class PaymentMethod(str, enum.Enum):
     CARD = "card"
     YOOMONEY = "yoomoney"
@@ -61,4 +68,25 @@ class Payment(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # Обратная связь с пользователем
-    user = relationship("User", back_populates="payments") 
\ No newline at end of file
+    user = relationship("User", back_populates="payments")
+
+
+class PaymentEvent(Base):
+    """Уведомление платежной системы, сохраненное до обработки."""
+    __tablename__ = "payment_events"
+    __table_args__ = (
+        # Повторная доставка того же уведомления не создает новую запись
+        UniqueConstraint("provider", "event_id", name="uq_payment_events_provider_event"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(20), nullable=False)
+    event_id = Column(String(255), nullable=False)
+    event_type = Column(String(100), nullable=True)
+    provider_payment_id = Column(String(255), nullable=True, index=True)
+    payload = Column(Text, nullable=False)
+    status = Column(Enum(PaymentEventStatus), default=PaymentEventStatus.RECEIVED, nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
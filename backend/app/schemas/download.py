@@ -14,6 +14,15 @@ class Resolution(str, enum.Enum):
     RES_2160P = "2160p"
     AUDIO_ONLY = "audio_only"
 
+class DownloadFormat(str, enum.Enum):
+    MP4 = "mp4"
+    MP3 = "mp3"
+    WAV = "wav"
+
+class ConvertPreset(str, enum.Enum):
+    FAST = "fast"  # libx264 veryfast, CRF 23
+    QUALITY = "quality"  # libx264 medium, CRF 20
+
 class SourceType(str, enum.Enum):
     YOUTUBE = "youtube"
     TIKTOK = "tiktok"
@@ -24,7 +33,9 @@ class SourceType(str, enum.Enum):
 class DownloadVideoRequest(BaseModel):
     url: str = Field(..., description="URL видео для скачивания")
     resolution: Optional[str] = Field(None, description="Разрешение видео (360p, 480p, 720p, 1080p, etc)")
+    format: DownloadFormat = Field(DownloadFormat.MP4, description="Формат результата (mp4, mp3, wav)")
     use_instaloader: bool = Field(False, description="Использовать instaloader для скачивания из Instagram")
+    queued: bool = Field(False, description="Поставить загрузку в очередь и сразу вернуть ID задачи")
     
     @validator('url')
     def validate_url(cls, v):
@@ -47,7 +58,25 @@ class DownloadResponse(BaseModel):
     url: str
     file_size: Optional[int] = None
     resolution: str
+    format: Optional[str] = None
     duration: Optional[int] = None
+    conversion: Optional[str] = None  # Для /convert: remux, extract_audio, copy_video, transcode или cached
+
+class DownloadJobResponse(BaseModel):
+    id: int
+    status: str
+    status_url: str
+    events_url: str
+    message: str = "Видео поставлено в очередь на скачивание"
+
+class DownloadJobStatus(BaseModel):
+    id: int
+    status: str
+    title: Optional[str] = None
+    url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
 class DownloadDetail(BaseModel):
     id: int
@@ -75,6 +104,8 @@ class VideoInfo(BaseModel):
 class ConvertVideoRequest(BaseModel):
     input_file: str = Field(..., description="Путь к исходному видео")
     output_format: str = Field(..., description="Формат вывода (mp3, mp4, etc)")
+    preset: Optional[ConvertPreset] = Field(None, description="Пресет перекодирования видео (fast, quality)")
+    queued: bool = Field(False, description="Сразу вернуть ID задачи, не дожидаясь конвертации")
     
     @validator('output_format')
     def validate_format(cls, v):
@@ -86,6 +117,7 @@ class ConvertVideoRequest(BaseModel):
 class DownloadCreate(BaseModel):
     url: str = Field(..., description="URL видео для скачивания")
     resolution: Resolution = Field(default=Resolution.RES_720P, description="Разрешение видео")
+    format: DownloadFormat = Field(default=DownloadFormat.MP4, description="Формат результата (mp4, mp3, wav)")
     
     @validator('url')
     def validate_url(cls, v):
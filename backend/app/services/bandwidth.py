@@ -0,0 +1,135 @@
+import time
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator
+
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.utils.metrics import metrics
+from app.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Активные загрузки: участник - ID загрузки, score - срок действия аренды;
+# выделенная загрузке скорость хранится в отдельном хэше
+LEASES_KEY = "downloads:bandwidth:leases"
+RATES_KEY = "downloads:bandwidth:rates"
+
+# Как часто загрузка, которой не хватило полосы, проверяет бюджет снова
+_WAIT_INTERVAL = 1.0
+
+# Выдача доли: истекшие аренды снимаются, новая загрузка получает не больше
+# доли одной загрузки и не больше еще не распределенной полосы. Если остаток
+# меньше минимальной доли, возвращается 0 и аренда не создается
+_ACQUIRE_SCRIPT = """
+local expired = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1])
+for _, member in ipairs(expired) do
+    redis.call('zrem', KEYS[1], member)
+    redis.call('hdel', KEYS[2], member)
+end
+local allocated = 0
+for _, rate in ipairs(redis.call('hvals', KEYS[2])) do
+    allocated = allocated + tonumber(rate)
+end
+local grant = math.min(tonumber(ARGV[5]), tonumber(ARGV[4]) - allocated)
+if grant <= 0 or (grant < tonumber(ARGV[6]) and allocated > 0) then
+    return 0
+end
+redis.call('zadd', KEYS[1], ARGV[3], ARGV[2])
+redis.call('hset', KEYS[2], ARGV[2], grant)
+return grant
+"""
+
+
+class BandwidthBudget:
+    """
+    Общий бюджет полосы DOWNLOAD_BANDWIDTH_LIMIT для всех загрузок yt-dlp
+
+    Каждая загрузка при старте получает долю total / DOWNLOAD_BANDWIDTH_SHARES,
+    но не больше остатка бюджета после уже выданных долей всех процессов API
+    и воркеров (аренды в Redis истекают сами, если процесс упал). yt-dlp не
+    меняет ограничение на ходу, поэтому доля фиксируется на время загрузки.
+    Если остаток меньше DOWNLOAD_BANDWIDTH_MIN_RATE, загрузка ждет, пока другие
+    вернут свои доли, поэтому сумма долей никогда не превышает бюджет.
+    Без Redis бюджет распределяется только внутри текущего процесса.
+    """
+
+    def __init__(self, total: Optional[int] = None, shares: Optional[int] = None, min_rate: Optional[int] = None):
+        self.total = total if total is not None else settings.DOWNLOAD_BANDWIDTH_LIMIT
+        self.shares = shares or settings.DOWNLOAD_BANDWIDTH_SHARES
+        self.min_rate = min_rate if min_rate is not None else settings.DOWNLOAD_BANDWIDTH_MIN_RATE
+        self._local_allocated = 0
+
+    def _grant(self, allocated: int) -> int:
+        grant = min(self.total // self.shares, self.total - allocated)
+        if grant <= 0 or (grant < self.min_rate and allocated > 0):
+            return 0
+        return grant
+
+    async def _acquire(self, member: str) -> Optional[int]:
+        """Выделяет долю через Redis (0 - полосы не хватает, None - Redis недоступен)"""
+        redis = get_redis()
+        if redis is None:
+            return None
+
+        now = time.time()
+        try:
+            rate = await redis.eval(
+                _ACQUIRE_SCRIPT, 2, LEASES_KEY, RATES_KEY,
+                now, member, now + settings.DOWNLOAD_TASK_TIME_LIMIT,
+                self.total, self.total // self.shares, self.min_rate
+            )
+            return int(rate)
+        except RedisError as e:
+            logger.warning(f"Failed to register download in bandwidth budget: {str(e)}")
+            return None
+
+    async def _release(self, member: str) -> None:
+        try:
+            async with get_redis().pipeline(transaction=True) as pipe:
+                pipe.zrem(LEASES_KEY, member)
+                pipe.hdel(RATES_KEY, member)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to release bandwidth lease: {str(e)}")
+
+    @asynccontextmanager
+    async def share(self) -> AsyncIterator[Optional[int]]:
+        """
+        Контекстный менеджер: доля бюджета (байт/с) на время загрузки
+        или None, если бюджет не задан. Ждет, пока освободится полоса
+        """
+        if not self.total:
+            yield None
+            return
+
+        member = uuid.uuid4().hex
+        waited = False
+        while True:
+            rate = await self._acquire(member)
+            shared = rate is not None
+            if not shared:
+                rate = self._grant(self._local_allocated)
+            if rate:
+                break
+            if not waited:
+                metrics.inc("download_bandwidth_waits")
+                waited = True
+            await asyncio.sleep(_WAIT_INTERVAL)
+
+        if not shared:
+            self._local_allocated += rate
+        try:
+            metrics.observe("download_bandwidth_share_bytes", rate)
+            yield rate
+        finally:
+            if shared:
+                await asyncio.shield(self._release(member))
+            else:
+                self._local_allocated -= rate
+
+
+bandwidth_budget = BandwidthBudget()
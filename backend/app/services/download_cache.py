@@ -0,0 +1,318 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Параметры URL, которые не влияют на содержимое видео
+_TRACKING_PARAMS = {"si", "feature", "pp", "fbclid", "gclid", "igshid", "igsh", "is_from_webapp", "sender_device"}
+
+_CANONICAL_PATTERNS = [
+    ("youtube", re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([\w-]{11})')),
+    ("tiktok", re.compile(r'tiktok\.com/(?:@[^/]+/video|v|embed(?:/v2)?)/(\d+)')),
+    ("vk", re.compile(r'vk\.com/(?:.*[?&]z=)?(?:video|clip)(-?\d+_\d+)')),
+    ("instagram", re.compile(r'instagram\.com/(?:[^/]+/)?(?:p|reel|reels|tv)/([\w-]+)')),
+]
+
+META_FILENAME = "meta.json"
+
+# Служебные директории внутри корня кэша
+_SERVICE_DIRS = ("tmp", "staging")
+
+# Размер блока при подсчете хэша содержимого файла
+_HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def canonical_video_id(url: str) -> str:
+    """
+    Нормализует URL видео до идентификатора вида "<extractor>:<id>"
+
+    Ссылки одной и той же платформы в разных формах (youtu.be, shorts, watch?v=)
+    сводятся к одному ключу. Для неизвестных платформ используется URL
+    без фрагмента и трекинговых параметров.
+
+    Args:
+        url: URL видео
+
+    Returns:
+        Канонический идентификатор видео
+    """
+    for extractor, pattern in _CANONICAL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return f"{extractor}:{match.group(1)}"
+
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in _TRACKING_PARAMS and not k.startswith("utm_")
+    )
+    normalized = urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower().removeprefix("www.").removeprefix("m."),
+        parts.path.rstrip("/"),
+        urlencode(query),
+        ""
+    ))
+    return f"url:{normalized}"
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 содержимого файла (выполнять в пуле потоков)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def conversion_key(source_hash: str, output_format: str, preset: Optional[str] = None) -> str:
+    """
+    Ключ кэша конвертаций: хэш содержимого исходника, формат и пресет
+    """
+    raw = f"{source_hash}|{output_format}|{preset or settings.CONVERT_DEFAULT_PRESET}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DownloadCache:
+    """
+    Дедуплицирующий кэш скачанных (и сконвертированных) файлов на диске
+
+    Каждая запись хранится в директории <root>/<key[:2]>/<key>/ вместе с meta.json.
+    Файлы выдаются пользователям жесткими ссылками, поэтому количество ссылок
+    на объект кэша (st_nlink - 1) служит счетчиком ссылок, а удаление записи
+    из кэша не затрагивает уже выданные копии.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        staging_ttl: Optional[int] = None
+    ):
+        self.root = root or settings.DOWNLOAD_CACHE_DIR or os.path.join(settings.UPLOAD_DIR, ".cache", "downloads")
+        self.max_bytes = max_bytes if max_bytes is not None else settings.DOWNLOAD_CACHE_MAX_BYTES
+        # Возраст, после которого временные директории считаются брошенными
+        self.staging_ttl = staging_ttl or settings.DOWNLOAD_TASK_TIME_LIMIT
+
+    def make_key(self, url: str, resolution: str, output_format: Optional[str] = None) -> str:
+        """
+        Строит ключ кэша из канонического ID видео, разрешения и формата
+        """
+        raw = f"{canonical_video_id(url)}|{resolution}|{output_format or 'auto'}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def make_staging_dir(self) -> str:
+        """
+        Создает временную директорию для загрузки, которая затем попадет в кэш.
+        Директория находится на той же файловой системе, что и кэш, поэтому
+        публикация файла в кэше не требует копирования.
+        """
+        staging_dir = os.path.join(self.root, "staging", uuid.uuid4().hex)
+        os.makedirs(staging_dir, exist_ok=True)
+        return staging_dir
+
+    def _read_meta(self, entry_dir: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(entry_dir, META_FILENAME), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, entry_dir: str, meta: Dict[str, Any]) -> None:
+        meta_path = os.path.join(entry_dir, META_FILENAME)
+        tmp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+
+    def _link_or_copy(self, src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Другая файловая система или ФС без поддержки жестких ссылок
+            shutil.copy2(src, dst)
+
+    def fetch(self, key: str, output_dir: str, filename: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Выдает файл из кэша в директорию загрузки
+
+        Файл появляется под итоговым именем атомарно (ссылка на временное имя
+        и переименование), уже существующий файл с этим именем заменяется.
+
+        Args:
+            key: Ключ кэша
+            output_dir: Директория, куда нужно поместить файл
+            filename: Имя файла в output_dir (по умолчанию имя файла в записи кэша)
+
+        Returns:
+            Метаданные записи (title, duration, file_path, file_size) или None при промахе
+        """
+        entry_dir = self._entry_dir(key)
+        meta = self._read_meta(entry_dir)
+        if not meta:
+            return None
+
+        cached_path = os.path.join(entry_dir, meta["filename"])
+        if not os.path.exists(cached_path):
+            return None
+
+        os.makedirs(output_dir, exist_ok=True)
+        file_path = os.path.join(output_dir, filename or meta["filename"])
+        tmp_path = os.path.join(output_dir, f".{uuid.uuid4().hex}.tmp")
+        try:
+            self._link_or_copy(cached_path, tmp_path)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.lexists(tmp_path):
+                os.unlink(tmp_path)
+
+        meta["last_access"] = time.time()
+        meta["hits"] = meta.get("hits", 0) + 1
+        try:
+            self._write_meta(entry_dir, meta)
+        except OSError as e:
+            logger.warning(f"Failed to update download cache meta for {key}: {str(e)}")
+
+        return {
+            "file_path": file_path,
+            "title": meta.get("title", ""),
+            "duration": meta.get("duration"),
+            "file_size": os.path.getsize(file_path),
+        }
+
+    def store(self, key: str, file_path: str, title: str = "", duration: Optional[int] = None) -> bool:
+        """
+        Помещает скачанный файл в кэш
+
+        Запись собирается во временной директории и публикуется атомарным
+        переименованием, поэтому параллельные читатели не видят неполных записей.
+
+        Returns:
+            True, если запись добавлена
+        """
+        if not os.path.isfile(file_path):
+            return False
+
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return False
+
+        tmp_dir = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            filename = os.path.basename(file_path)
+            self._link_or_copy(file_path, os.path.join(tmp_dir, filename))
+            now = time.time()
+            self._write_meta(tmp_dir, {
+                "key": key,
+                "filename": filename,
+                "title": title,
+                "duration": duration,
+                "created_at": now,
+                "last_access": now,
+                "hits": 0,
+            })
+
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                # Запись уже добавлена параллельной загрузкой
+                return False
+            return True
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _iter_entries(self) -> List[Dict[str, Any]]:
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name in _SERVICE_DIRS:
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.is_dir():
+                    continue
+                meta = self._read_meta(entry.path)
+                if not meta:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(entry.path, meta["filename"]))
+                except OSError:
+                    continue
+                entries.append({
+                    "dir": entry.path,
+                    "size": stat.st_size,
+                    "refcount": stat.st_nlink - 1,
+                    "last_access": meta.get("last_access", 0),
+                })
+        return entries
+
+    def evict(self, max_age_days: Optional[int] = None) -> Dict[str, int]:
+        """
+        Удаляет устаревшие записи и записи сверх бюджета по размеру (LRU)
+
+        Args:
+            max_age_days: Удалять записи, к которым не обращались дольше указанного срока
+
+        Returns:
+            Статистика: количество удаленных записей и освобожденные байты
+        """
+        entries = sorted(self._iter_entries(), key=lambda e: e["last_access"])
+        total_size = sum(e["size"] for e in entries)
+        cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+
+        evicted_count = 0
+        freed_bytes = 0
+        for entry in entries:
+            expired = cutoff is not None and entry["last_access"] < cutoff
+            if not expired and total_size <= self.max_bytes:
+                continue
+
+            shutil.rmtree(entry["dir"], ignore_errors=True)
+            total_size -= entry["size"]
+            evicted_count += 1
+            # Место на диске освобождается, только если на файл больше нет ссылок
+            if entry["refcount"] <= 0:
+                freed_bytes += entry["size"]
+
+        # Временные директории прерванных записей и загрузок
+        for service_dir in _SERVICE_DIRS:
+            service_root = os.path.join(self.root, service_dir)
+            if not os.path.isdir(service_root):
+                continue
+            for entry in os.scandir(service_root):
+                if entry.stat().st_mtime < time.time() - self.staging_ttl:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+        return {
+            "evicted_count": evicted_count,
+            "freed_bytes": freed_bytes,
+            "total_size": total_size
+        }
+
+
+download_cache = DownloadCache()
+
+# Результаты конвертаций (/downloads/convert) по содержимому исходника
+conversion_cache = DownloadCache(
+    root=settings.CONVERT_CACHE_DIR or os.path.join(settings.UPLOAD_DIR, ".cache", "conversions"),
+    max_bytes=settings.CONVERT_CACHE_MAX_BYTES,
+    staging_ttl=settings.CONVERT_TASK_TIME_LIMIT
+)
@@ -0,0 +1,292 @@
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque, Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Deque, Optional
+
+from app.core.config import settings
+from app.models.subscription import SubscriptionType
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Уровни приоритета в порядке обслуживания
+TIER_PAID = "paid"
+TIER_TRIAL = "trial"
+TIER_ANONYMOUS = "anonymous"
+TIERS = (TIER_PAID, TIER_TRIAL, TIER_ANONYMOUS)
+
+PAID_SUBSCRIPTION_TYPES = {
+    SubscriptionType.MONTHLY,
+    SubscriptionType.YEARLY,
+    SubscriptionType.ONE_TIME,
+    SubscriptionType.PACK_10,
+    SubscriptionType.BASIC,
+    SubscriptionType.PREMIUM,
+}
+
+# Приоритет задач Celery по уровням (для Redis-брокера 0 - наивысший). Приоритет
+# только меняет порядок ожидающих задач; слоты воркеров резервирует worker_scheduler
+CELERY_TIER_PRIORITY = {
+    TIER_PAID: 0,
+    TIER_TRIAL: 5,
+    TIER_ANONYMOUS: 9,
+}
+
+
+def tier_for_subscription(subscription_type: Optional[str]) -> str:
+    """
+    Определяет уровень приоритета по типу подписки
+
+    Args:
+        subscription_type: Subscription.type или None для анонимных пользователей
+
+    Returns:
+        Уровень приоритета (paid, trial, anonymous)
+    """
+    if subscription_type is None:
+        return TIER_ANONYMOUS
+    if subscription_type in PAID_SUBSCRIPTION_TYPES:
+        return TIER_PAID
+    return TIER_TRIAL
+
+
+class SchedulerBusyError(Exception):
+    """Очередь загрузок переполнена"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Download queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Waiter:
+    source_type: str
+    user_key: str
+    tier: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class DownloadScheduler:
+    """
+    Планировщик загрузок и конвертаций в пределах процесса
+
+    Ограничивает общее число одновременных задач, число задач на платформу
+    (результат determine_source_type) и на пользователя. Задачи сверх лимита
+    ждут в очереди своего уровня: платные подписчики обслуживаются раньше
+    пробных и анонимных, а reserved_slots слотов доступны только им. Внутри
+    уровня пользователи обслуживаются по кругу. Если очередь длиннее
+    max_queue, acquire выбрасывает SchedulerBusyError с оценкой ожидания.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        source_limits: Optional[Dict[str, int]] = None,
+        per_user_limit: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        reserved_slots: Optional[int] = None
+    ):
+        self.max_concurrent = max_concurrent or settings.DOWNLOAD_MAX_CONCURRENT
+        self.source_limits = source_limits if source_limits is not None else settings.DOWNLOAD_SOURCE_LIMITS
+        self.per_user_limit = per_user_limit or settings.DOWNLOAD_MAX_PER_USER
+        self.max_queue = max_queue if max_queue is not None else settings.DOWNLOAD_MAX_QUEUE
+        reserved = reserved_slots if reserved_slots is not None else settings.DOWNLOAD_PAID_RESERVED_SLOTS
+        # Хотя бы один слот остается доступным всем уровням
+        self.reserved_slots = max(0, min(reserved, self.max_concurrent - 1))
+
+        self._active = 0
+        self._active_unpaid = 0
+        self._active_by_source: Counter = Counter()
+        self._active_by_user: Counter = Counter()
+        # Очереди ожидания по уровням и пользователям; порядок ключей задает очередность обслуживания
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {tier: OrderedDict() for tier in TIERS}
+        self._queue_depth = 0
+        # Скользящая оценка длительности задачи для заголовка Retry-After
+        self._avg_job_seconds = float(settings.DOWNLOAD_AVG_JOB_SECONDS)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_depth
+
+    def retry_after(self) -> int:
+        """
+        Оценивает, через сколько секунд в очереди освободится место
+        """
+        waves = (self._queue_depth + 1) / max(1, self.max_concurrent)
+        return max(1, math.ceil(waves * self._avg_job_seconds))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "active": self._active,
+            "active_unpaid": self._active_unpaid,
+            "queue_depth": self._queue_depth,
+            "queue_depth_by_tier": {tier: self._tier_depth(tier) for tier in TIERS},
+            "active_by_source": dict(self._active_by_source),
+            "avg_job_seconds": round(self._avg_job_seconds, 1),
+        }
+
+    def _tier_depth(self, tier: str) -> int:
+        return sum(len(queue) for queue in self._queues[tier].values())
+
+    def _can_run(self, source_type: str, user_key: str, tier: str) -> bool:
+        if tier != TIER_PAID and self._active_unpaid >= self.max_concurrent - self.reserved_slots:
+            # Зарезервированные слоты доступны только платным подписчикам
+            return False
+        source_limit = self.source_limits.get(source_type, self.source_limits.get("other", self.max_concurrent))
+        return (
+            self._active < self.max_concurrent
+            and self._active_by_source[source_type] < source_limit
+            and self._active_by_user[user_key] < self.per_user_limit
+        )
+
+    def _start(self, source_type: str, user_key: str, tier: str) -> None:
+        self._active += 1
+        if tier != TIER_PAID:
+            self._active_unpaid += 1
+        self._active_by_source[source_type] += 1
+        self._active_by_user[user_key] += 1
+        self._publish_stats()
+
+    def _publish_stats(self) -> None:
+        metrics.set_gauge("download_scheduler_active", self._active)
+        metrics.set_gauge("download_scheduler_queue_depth", self._queue_depth)
+        for tier in TIERS:
+            metrics.set_gauge("download_scheduler_tier_queue_depth", self._tier_depth(tier), tier=tier)
+
+    def _pick_waiter(self) -> Optional[_Waiter]:
+        """
+        Выбирает следующего ожидающего: уровни по приоритету, пользователи внутри уровня по кругу
+        """
+        for tier in TIERS:
+            queues = self._queues[tier]
+            for user_key in list(queues.keys()):
+                queue = queues[user_key]
+                # Отмененные ожидающие удаляются из очереди в своем обработчике отмены
+                for cancelled in [w for w in queue if w.future.done()]:
+                    self._remove_waiter(cancelled)
+                if user_key not in queues:
+                    continue
+
+                waiter = next(
+                    (w for w in queue if self._can_run(w.source_type, w.user_key, w.tier)), None
+                )
+                if waiter is None:
+                    continue
+
+                queue.remove(waiter)
+                self._queue_depth -= 1
+                if queue:
+                    # Пользователь переходит в конец круга
+                    queues.move_to_end(user_key)
+                else:
+                    del queues[user_key]
+                return waiter
+        return None
+
+    def _dispatch(self) -> None:
+        """
+        Раздает освободившиеся слоты ожидающим
+        """
+        while self._queue_depth and self._active < self.max_concurrent:
+            waiter = self._pick_waiter()
+            if waiter is None:
+                break
+
+            self._start(waiter.source_type, waiter.user_key, waiter.tier)
+            metrics.observe(
+                "download_queue_wait_seconds", time.monotonic() - waiter.enqueued_at, tier=waiter.tier
+            )
+            waiter.future.set_result(None)
+
+        self._publish_stats()
+
+    def _remove_waiter(self, waiter: _Waiter) -> None:
+        queues = self._queues[waiter.tier]
+        queue = queues.get(waiter.user_key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queue_depth -= 1
+            if not queue:
+                del queues[waiter.user_key]
+            self._publish_stats()
+
+    async def acquire(self, source_type: str, user_key: str, tier: str = TIER_ANONYMOUS) -> None:
+        """
+        Ожидает свободный слот для задачи
+
+        Raises:
+            SchedulerBusyError: Если очередь ожидания переполнена
+        """
+        if not self._queue_depth and self._can_run(source_type, user_key, tier):
+            self._start(source_type, user_key, tier)
+            metrics.observe("download_queue_wait_seconds", 0.0, tier=tier)
+            return
+
+        # Платные подписчики получают отказ только при вдвое большей очереди
+        max_queue = self.max_queue * 2 if tier == TIER_PAID else self.max_queue
+        if self._queue_depth >= max_queue:
+            metrics.inc("download_scheduler_rejected", source=source_type, tier=tier)
+            raise SchedulerBusyError(self.retry_after())
+
+        waiter = _Waiter(source_type, user_key, tier, asyncio.get_running_loop().create_future())
+        self._queues[tier].setdefault(user_key, deque()).append(waiter)
+        self._queue_depth += 1
+        # Задача может запуститься сразу, если очередь заблокирована лимитами других платформ
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Слот уже выдан, но задача отменена - возвращаем его
+                self.release(source_type, user_key, tier)
+            else:
+                self._remove_waiter(waiter)
+            raise
+
+    def release(
+        self,
+        source_type: str,
+        user_key: str,
+        tier: str = TIER_ANONYMOUS,
+        duration: Optional[float] = None
+    ) -> None:
+        """
+        Освобождает слот и передает его следующему ожидающему
+        """
+        self._active -= 1
+        if tier != TIER_PAID:
+            self._active_unpaid -= 1
+        self._active_by_source[source_type] -= 1
+        self._active_by_user[user_key] -= 1
+        if self._active_by_user[user_key] <= 0:
+            del self._active_by_user[user_key]
+
+        if duration is not None:
+            self._avg_job_seconds = 0.9 * self._avg_job_seconds + 0.1 * duration
+
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, source_type: str, user_key: str, tier: str = TIER_ANONYMOUS):
+        """
+        Контекстный менеджер: занимает слот на время выполнения блока
+        """
+        await self.acquire(source_type, user_key, tier)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(source_type, user_key, tier, time.monotonic() - started_at)
+
+
+download_scheduler = DownloadScheduler()
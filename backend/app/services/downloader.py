@@ -1,15 +1,88 @@
 import os
+import json
 import asyncio
 import logging
 import re
+import time
+import shutil
+import uuid
+import hashlib
 import tempfile
-from typing import Optional, Dict, Any, List
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
 from dataclasses import dataclass
 
 from app.core.config import settings
+from app.services.download_cache import (
+    download_cache, conversion_cache, conversion_key, file_sha256, canonical_video_id
+)
+from app.services.singleflight import download_singleflight, conversion_singleflight
+from app.services.ytdlp_engine import ytdlp_engine
+from app.services.bandwidth import bandwidth_budget
+from app.services.storage import get_storage, storage_key
+from app.services.storage_manager import storage_manager
+from app.services.progress import (
+    ProgressReporter, parse_ytdlp_progress, FfmpegProgressParser, YTDLP_PROGRESS_TEMPLATES
+)
+from app.utils.cache import TwoTierCache
+from app.utils.metrics import metrics
+from app.services.transcode import (
+    ConversionPlan, MODE_TRANSCODE, probe_media, plan_conversion, transcode_plan
+)
+from app.utils.process import run_process, ProcessResult, ProcessTimeoutError
 
 logger = logging.getLogger(__name__)
 
+# Префикс строки с результатом загрузки в выводе yt-dlp
+YTDLP_RESULT_PREFIX = "[result]"
+
+# Форматы, для которых yt-dlp скачивает только звуковую дорожку и сам извлекает звук
+AUDIO_DOWNLOAD_FORMATS = ("mp3", "wav")
+# Битрейт mp3 в кбит/с, как при конвертации через /downloads/convert
+MP3_AUDIO_QUALITY = "192"
+
+# Ограничение одновременных запросов информации о видео
+_info_semaphore = asyncio.Semaphore(settings.VIDEO_INFO_MAX_CONCURRENT)
+
+# Кэш информации о видео для /downloads/info
+video_info_cache = TwoTierCache(
+    "video_info", local_maxsize=settings.VIDEO_INFO_LOCAL_CACHE_SIZE, local_ttl=5 * 60
+)
+
+# SHA-256 исходников конвертации по ключу хранилища, чтобы не читать файл при каждом запросе
+source_hash_cache = TwoTierCache("source_hash", local_maxsize=4096, local_ttl=5 * 60)
+
+def _timeout_message(action: str, error: ProcessTimeoutError) -> str:
+    """Текст ошибки для процесса, остановленного по таймауту"""
+    if error.reason == "idle":
+        return f"{action} остановлена: нет прогресса {int(error.timeout)} с"
+    return f"{action} остановлена: превышено время выполнения {int(error.timeout)} с"
+
+@lru_cache(maxsize=None)
+def _external_downloader() -> Optional[str]:
+    """Внешний загрузчик из DOWNLOAD_EXTERNAL_DOWNLOADER, если он установлен"""
+    name = settings.DOWNLOAD_EXTERNAL_DOWNLOADER
+    if name and not shutil.which(name):
+        logger.warning(f"External downloader {name} not found, using yt-dlp native downloader")
+        return None
+    return name
+
+def _conversion_filename(input_path: str, output_format: str) -> str:
+    """
+    Уникальное имя результата конвертации: каждая конвертация получает свой файл,
+    который не совпадает ни с исходником, ни с результатами других конвертаций
+    """
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return f"{stem}.{uuid.uuid4().hex[:12]}.{output_format}"
+
+def _remove_partial_file(path: Optional[str]) -> None:
+    """Удаляет недописанный файл результата"""
+    if path and os.path.exists(path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            logger.warning(f"Failed to remove partial file {path}: {str(e)}")
+
 @dataclass
 class DownloadResult:
     success: bool
@@ -18,103 +91,254 @@ class DownloadResult:
     file_size: Optional[int] = None
     duration: Optional[int] = None
     error: str = ""
+    conversion: Optional[str] = None  # Способ конвертации (см. app.services.transcode)
 
 
 class VideoDownloader:
     """Сервис для скачивания видео с различных платформ с использованием yt-dlp"""
     
+    async def store_result(self, result: DownloadResult, user_id: Optional[int] = None) -> DownloadResult:
+        """
+        Передает скачанный файл в хранилище (STORAGE_BACKEND) и учитывает его размер
+        
+        file_path результата остается логическим путем в UPLOAD_DIR, по которому
+        файл находится в хранилище. При ошибке локальный файл удаляется.
+        """
+        if not result.success:
+            return result
+        
+        try:
+            size = result.file_size or os.path.getsize(result.file_path)
+            await get_storage().store(result.file_path)
+            await storage_manager.record(result.file_path, size, user_id)
+        except Exception as e:
+            logger.exception(f"Failed to store {result.file_path}: {str(e)}")
+            _remove_partial_file(result.file_path)
+            return DownloadResult(success=False, error=f"Ошибка сохранения файла: {str(e)}")
+        
+        return result
+    
     async def download_video(
-        self, url: str, resolution: str, output_dir: str, filename_template: str = "%(id)s.%(ext)s"
+        self,
+        url: str,
+        resolution: str,
+        output_dir: str,
+        filename_template: str = "%(id)s.%(ext)s",
+        progress: Optional[ProgressReporter] = None,
+        output_format: str = "mp4"
     ) -> DownloadResult:
         """
-        Скачивает видео с указанного URL с заданным разрешением
+        Скачивает видео с указанного URL с заданным разрешением.
+        Повторные запросы того же видео в том же разрешении и формате выдаются из кэша без запуска yt-dlp.
+        
+        Для mp3 и wav скачивается только звуковая дорожка, и yt-dlp сразу
+        извлекает из нее звук в нужном формате: отдельная конвертация не нужна.
         
         Args:
             url: URL видео для скачивания
-            resolution: Разрешение видео (360p, 480p, 720p и т.д.)
+            resolution: Разрешение видео (360p, 480p, 720p и т.д., для mp3 и wav не используется)
             output_dir: Директория для сохранения видео
             filename_template: Шаблон имени файла для yt-dlp
+            progress: Получатель событий прогресса (для фоновых загрузок)
+            output_format: Формат результата (mp4, mp3, wav)
             
         Returns:
             DownloadResult с результатами скачивания
         """
+        if not settings.DOWNLOAD_CACHE_ENABLED:
+            return await self._download_with_ytdlp(
+                url, resolution, output_dir, filename_template, progress, output_format
+            )
+        
+        cache_key = self._get_cache_key(url, resolution, output_format)
+        cached = await self._fetch_cached(cache_key, output_dir)
+        if cached:
+            logger.info(f"Download cache hit for {url} ({resolution}, {output_format})")
+            return cached
+        
+        # Одновременные запросы одного видео объединяются в одну загрузку,
+        # остальные ожидают ее завершения и получают файл из кэша
+        outcome = await download_singleflight.do(
+            cache_key,
+            lambda: self._download_into_cache(
+                cache_key, url, resolution, filename_template, progress, output_format
+            )
+        )
+        
+        if not outcome["success"]:
+            return DownloadResult(success=False, error=outcome["error"])
+        
+        cached = await self._fetch_cached(cache_key, output_dir)
+        if cached:
+            return cached
+        
+        logger.warning(f"Download cache entry for {url} disappeared, downloading directly")
+        return await self._download_with_ytdlp(
+            url, resolution, output_dir, filename_template, progress, output_format
+        )
+    
+    def _get_cache_key(self, url: str, resolution: str, output_format: str) -> str:
+        """
+        Ключ кэша загрузок. Для звуковых форматов разрешение не влияет на результат,
+        для mp4 ключ совпадает с прежним (формат контейнера выбирает yt-dlp)
+        """
+        if output_format in AUDIO_DOWNLOAD_FORMATS:
+            return download_cache.make_key(url, "audio_only", output_format)
+        return download_cache.make_key(url, resolution)
+    
+    async def _fetch_cached(self, cache_key: str, output_dir: str) -> Optional[DownloadResult]:
+        """
+        Выдает файл из кэша загрузок в директорию output_dir
+        """
+        try:
+            cached = await asyncio.to_thread(download_cache.fetch, cache_key, output_dir)
+        except OSError as e:
+            logger.warning(f"Download cache lookup failed for {cache_key}: {str(e)}")
+            return None
+        
+        return DownloadResult(success=True, **cached) if cached else None
+    
+    async def _download_into_cache(
+        self,
+        cache_key: str,
+        url: str,
+        resolution: str,
+        filename_template: str,
+        progress: Optional[ProgressReporter] = None,
+        output_format: str = "mp4"
+    ) -> Dict[str, Any]:
+        """
+        Скачивает видео во временную директорию кэша и публикует его в кэше.
+        Возвращает JSON-сериализуемый результат для single-flight.
+        """
+        staging_dir = download_cache.make_staging_dir()
+        try:
+            result = await self._download_with_ytdlp(
+                url, resolution, staging_dir, filename_template, progress, output_format
+            )
+            
+            if result.success:
+                try:
+                    await asyncio.to_thread(
+                        download_cache.store, cache_key, result.file_path, result.title, result.duration
+                    )
+                except OSError as e:
+                    logger.warning(f"Failed to store {result.file_path} in download cache: {str(e)}")
+            
+            return {"success": result.success, "error": result.error}
+        finally:
+            await asyncio.to_thread(shutil.rmtree, staging_dir, True)
+    
+    async def _download_with_ytdlp(
+        self,
+        url: str,
+        resolution: str,
+        output_dir: str,
+        filename_template: str,
+        progress: Optional[ProgressReporter] = None,
+        output_format: str = "mp4"
+    ) -> DownloadResult:
+        """
+        Скачивает видео через yt-dlp без использования кэша.
+        Вывод yt-dlp читается построчно по мере загрузки, строки прогресса передаются в progress.
+        """
+        if settings.YTDLP_ENGINE == "library":
+            return await self._download_with_engine(
+                url, resolution, output_dir, filename_template, progress, output_format
+            )
+        
         try:
             # Определяем тип источника
             source_type = self.determine_source_type(url)
             
-            # Создаем временную директорию для файла конфигурации
-            with tempfile.NamedTemporaryFile(mode='w+', suffix='.txt', delete=False) as temp_file:
-                temp_file_path = temp_file.name
-                
-                # Формируем опции для yt-dlp в зависимости от разрешения
-                format_string = self._get_format_string(resolution)
-                
-                # Добавляем специфичные настройки для разных платформ
-                extra_options = self._get_extra_options(source_type)
-                
-                # Подготавливаем команду
-                output_template = os.path.join(output_dir, filename_template)
-                cmd = [
-                    "yt-dlp",
-                    "--format", format_string,
-                    "--write-info-json",
-                    "--max-filesize", str(settings.YTDLP_MAX_FILESIZE),
-                    "-o", output_template,
-                    "--print", "%(title)s",
-                    "--print", "%(duration)s",
-                    "--print", "%(filename)s",
-                ]
-                
-                # Добавляем дополнительные опции для конкретных платформ
-                cmd.extend(extra_options)
-                
+            # Формируем опции для yt-dlp в зависимости от разрешения и формата
+            format_string = self._get_format_string(resolution, output_format)
+            
+            # Добавляем специфичные настройки для разных платформ
+            extra_options = self._get_extra_options(source_type)
+            
+            # Подготавливаем команду. Результат печатается одной JSON-строкой на стадии
+            # after_move (печать без стадии включает --simulate)
+            output_template = os.path.join(output_dir, filename_template)
+            cmd = [
+                "yt-dlp",
+                "--format", format_string,
+                "--write-info-json",
+                "--max-filesize", str(settings.YTDLP_MAX_FILESIZE),
+                "-o", output_template,
+                "--print", f"after_move:{YTDLP_RESULT_PREFIX} %(.{{title,duration,filepath}})j",
+                "--newline",
+                "--progress",
+            ]
+            for template in YTDLP_PROGRESS_TEMPLATES:
+                cmd.extend(["--progress-template", template])
+            
+            # Извлечение звука выполняется постобработкой yt-dlp в том же запуске
+            cmd.extend(self._get_audio_options(output_format))
+            
+            # Добавляем дополнительные опции для конкретных платформ
+            cmd.extend(extra_options)
+            
+            printed: Dict[str, Any] = {}
+            
+            async def on_progress_line(line: str) -> bool:
+                # События постобработки (postprocess:) yt-dlp пишет в stderr, загрузки - в stdout
+                event = parse_ytdlp_progress(line)
+                if event is None:
+                    return False
+                if progress:
+                    await progress.publish(event)
+                return True
+            
+            async def on_line(line: str) -> None:
+                # Строки разбираются по мере поступления, целиком вывод не хранится
+                if line.startswith(YTDLP_RESULT_PREFIX):
+                    printed.update(json.loads(line[len(YTDLP_RESULT_PREFIX):]))
+                    return
+                await on_progress_line(line)
+            
+            # Запускаем процесс скачивания с долей общего бюджета полосы
+            timeout, idle_timeout = self._get_timeouts(source_type)
+            async with bandwidth_budget.share() as rate_limit:
+                cmd.extend(self._get_transfer_options(source_type, rate_limit))
                 # Добавляем URL в конце
                 cmd.append(url)
-                
-                # Запускаем процесс скачивания
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    text=True
+                # Строки прогресса в stderr не вытесняют из хвоста сообщения об ошибках
+                result = await run_process(
+                    cmd, on_stdout_line=on_line, on_stderr_line=on_progress_line,
+                    timeout=timeout, idle_timeout=idle_timeout
                 )
-                
-                stdout, stderr = await process.communicate()
-                
-                if process.returncode != 0:
-                    logger.error(f"yt-dlp error for URL {url}: {stderr}")
-                    return DownloadResult(
-                        success=False,
-                        error=f"Ошибка скачивания: {stderr}"
-                    )
-                
-                # Разбираем вывод
-                output_lines = stdout.strip().split("\n")
-                if len(output_lines) >= 3:
-                    title = output_lines[0]
-                    try:
-                        duration = int(float(output_lines[1]))
-                    except (ValueError, TypeError):
-                        duration = 0
-                    
-                    filename = output_lines[2]
-                    file_size = 0
-                    
-                    if os.path.exists(filename):
-                        file_size = os.path.getsize(filename)
-                    
-                    return DownloadResult(
-                        success=True,
-                        file_path=filename,
-                        title=title,
-                        file_size=file_size,
-                        duration=duration
-                    )
-                else:
-                    return DownloadResult(
-                        success=False,
-                        error="Неожиданный формат вывода yt-dlp"
-                    )
+            
+            if result.returncode != 0:
+                logger.error(f"yt-dlp error for URL {url}: {result.stderr_tail}")
+                return DownloadResult(
+                    success=False,
+                    error=f"Ошибка скачивания: {result.stderr_tail}"
+                )
+            
+            filename = printed.get("filepath")
+            if not filename:
+                return DownloadResult(
+                    success=False,
+                    error="Неожиданный формат вывода yt-dlp"
+                )
+            
+            try:
+                duration = int(float(printed.get("duration") or 0))
+            except (ValueError, TypeError):
+                duration = 0
+            
+            return DownloadResult(
+                success=True,
+                file_path=filename,
+                title=printed.get("title", ""),
+                file_size=os.path.getsize(filename) if os.path.exists(filename) else 0,
+                duration=duration
+            )
+        
+        except ProcessTimeoutError as e:
+            logger.warning(f"yt-dlp killed for URL {url}: {str(e)}")
+            return DownloadResult(success=False, error=_timeout_message("Загрузка", e))
                 
         except Exception as e:
             logger.exception(f"Error downloading video from {url}: {str(e)}")
@@ -122,10 +346,71 @@ class VideoDownloader:
                 success=False,
                 error=f"Ошибка скачивания: {str(e)}"
             )
-        finally:
-            # Удаляем временный файл
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+    
+    async def _download_with_engine(
+        self,
+        url: str,
+        resolution: str,
+        output_dir: str,
+        filename_template: str,
+        progress: Optional[ProgressReporter] = None,
+        output_format: str = "mp4"
+    ) -> DownloadResult:
+        """
+        Скачивает видео через пул процессов с yt_dlp.YoutubeDL (YTDLP_ENGINE=library)
+        """
+        try:
+            source_type = self.determine_source_type(url)
+            
+            opts = {
+                "format": self._get_format_string(resolution, output_format),
+                "writeinfojson": True,
+                "max_filesize": settings.YTDLP_MAX_FILESIZE,
+                "outtmpl": os.path.join(output_dir, filename_template),
+                "quiet": True,
+                "no_warnings": True,
+                "noprogress": True,
+                **self._get_audio_ydl_opts(output_format),
+                **self._get_extra_ydl_opts(source_type)
+            }
+            timeout, idle_timeout = self._get_timeouts(source_type)
+            # Зависшее соединение прерывается по таймауту сокета
+            opts.setdefault("socket_timeout", idle_timeout)
+            
+            # Процесс пула публикует прогресс в Redis сам, через progress hooks
+            async with bandwidth_budget.share() as rate_limit:
+                opts.update(self._get_transfer_ydl_opts(source_type, rate_limit))
+                outcome = await ytdlp_engine.download(
+                    url, opts, progress_id=progress.download_id if progress else None, timeout=timeout
+                )
+            
+            if "error" in outcome:
+                logger.error(f"yt-dlp error for URL {url}: {outcome['error']}")
+                return DownloadResult(
+                    success=False,
+                    error=f"Ошибка скачивания: {outcome['error']}"
+                )
+            
+            filename = outcome["filename"]
+            try:
+                duration = int(float(outcome.get("duration") or 0))
+            except (ValueError, TypeError):
+                duration = 0
+            
+            return DownloadResult(
+                success=True,
+                file_path=filename,
+                title=outcome.get("title", ""),
+                file_size=os.path.getsize(filename) if os.path.exists(filename) else 0,
+                duration=duration
+            )
+            
+        except Exception as e:
+            logger.exception(f"Error downloading video from {url}: {str(e)}")
+            return DownloadResult(
+                success=False,
+                error=f"Ошибка скачивания: {str(e)}"
+            )
     
     def determine_source_type(self, url: str) -> str:
         """
@@ -148,6 +433,14 @@ class VideoDownloader:
         else:
             return "other"
     
+    def _get_timeouts(self, source_type: str) -> Tuple[int, int]:
+        """
+        Возвращает общий таймаут и таймаут простоя (без вывода прогресса) для платформы
+        """
+        timeout = settings.DOWNLOAD_TIMEOUTS.get(source_type, settings.DOWNLOAD_TIMEOUTS["other"])
+        idle_timeout = settings.DOWNLOAD_IDLE_TIMEOUTS.get(source_type, settings.DOWNLOAD_IDLE_TIMEOUTS["other"])
+        return timeout, idle_timeout
+    
     def _get_extra_options(self, source_type: str) -> List[str]:
         """
         Возвращает дополнительные опции для yt-dlp в зависимости от типа источника
@@ -167,10 +460,116 @@ class VideoDownloader:
         else:
             return []
     
-    def _get_format_string(self, resolution: str) -> str:
+    def _get_extra_ydl_opts(self, source_type: str) -> Dict[str, Any]:
         """
-        Получает строку формата для yt-dlp на основе указанного разрешения
+        Возвращает опции YoutubeDL для платформы, аналогичные _get_extra_options
+        
+        Args:
+            source_type: Тип источника видео
+            
+        Returns:
+            Словарь дополнительных опций для yt_dlp.YoutubeDL
+        """
+        if source_type == "tiktok":
+            return {"cookiesfrombrowser": ("chrome",)}
+        elif source_type == "vk":
+            return {"nocheckcertificate": True}
+        elif source_type == "instagram":
+            return {"cookiesfrombrowser": ("chrome",), "nocheckcertificate": True}
+        else:
+            return {}
+    
+    def _get_transfer_settings(self, source_type: str, rate_limit: Optional[int]) -> Dict[str, Any]:
+        """
+        Параметры передачи для платформы: число параллельных фрагментов,
+        размер HTTP-диапазона, внешний загрузчик и ограничение скорости
+        
+        Ограничение yt-dlp действует на каждое соединение с фрагментом, поэтому
+        доля бюджета делится между фрагментами. Внешний загрузчик получает ее
+        целиком как общее ограничение.
+        """
+        fragments = settings.DOWNLOAD_CONCURRENT_FRAGMENTS.get(
+            source_type, settings.DOWNLOAD_CONCURRENT_FRAGMENTS["other"]
+        )
+        chunk_size = settings.DOWNLOAD_HTTP_CHUNK_SIZE.get(source_type, settings.DOWNLOAD_HTTP_CHUNK_SIZE["other"])
+        external = _external_downloader()
+        if rate_limit and not external:
+            rate_limit = max(1, rate_limit // fragments)
+        return {
+            "fragments": fragments,
+            "chunk_size": chunk_size,
+            "external": external,
+            "rate_limit": rate_limit,
+        }
+    
+    def _get_transfer_options(self, source_type: str, rate_limit: Optional[int] = None) -> List[str]:
+        """
+        Возвращает опции yt-dlp для параллельной загрузки фрагментов и ограничения скорости
+        
+        Args:
+            source_type: Тип источника видео
+            rate_limit: Доля общего бюджета полосы в байтах/с (None - без ограничения)
+        """
+        transfer = self._get_transfer_settings(source_type, rate_limit)
+        options = ["--concurrent-fragments", str(transfer["fragments"])]
+        if transfer["chunk_size"]:
+            options.extend(["--http-chunk-size", str(transfer["chunk_size"])])
+        if transfer["external"]:
+            options.extend([
+                "--downloader", transfer["external"],
+                "--downloader-args",
+                f"{transfer['external']}:{' '.join(settings.DOWNLOAD_EXTERNAL_DOWNLOADER_ARGS)}",
+            ])
+        if transfer["rate_limit"]:
+            options.extend(["--limit-rate", str(transfer["rate_limit"])])
+        return options
+    
+    def _get_transfer_ydl_opts(self, source_type: str, rate_limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Возвращает опции YoutubeDL, аналогичные _get_transfer_options
+        """
+        transfer = self._get_transfer_settings(source_type, rate_limit)
+        opts: Dict[str, Any] = {"concurrent_fragment_downloads": transfer["fragments"]}
+        if transfer["chunk_size"]:
+            opts["http_chunk_size"] = transfer["chunk_size"]
+        if transfer["external"]:
+            opts["external_downloader"] = {"default": transfer["external"]}
+            opts["external_downloader_args"] = {transfer["external"]: list(settings.DOWNLOAD_EXTERNAL_DOWNLOADER_ARGS)}
+        if transfer["rate_limit"]:
+            opts["ratelimit"] = transfer["rate_limit"]
+        return opts
+    
+    def _get_audio_options(self, output_format: str) -> List[str]:
+        """
+        Возвращает опции yt-dlp для извлечения звука в output_format
+        (пустой список для видеоформатов)
+        """
+        if output_format not in AUDIO_DOWNLOAD_FORMATS:
+            return []
+        options = ["--extract-audio", "--audio-format", output_format]
+        if output_format == "mp3":
+            options.extend(["--audio-quality", f"{MP3_AUDIO_QUALITY}K"])
+        return options
+    
+    def _get_audio_ydl_opts(self, output_format: str) -> Dict[str, Any]:
+        """
+        Возвращает опции YoutubeDL, аналогичные _get_audio_options
+        """
+        if output_format not in AUDIO_DOWNLOAD_FORMATS:
+            return {}
+        postprocessor = {"key": "FFmpegExtractAudio", "preferredcodec": output_format}
+        if output_format == "mp3":
+            postprocessor["preferredquality"] = MP3_AUDIO_QUALITY
+        return {"postprocessors": [postprocessor]}
+    
+    def _get_format_string(self, resolution: str, output_format: str = "mp4") -> str:
+        """
+        Получает строку формата для yt-dlp на основе указанного разрешения.
+        Для звуковых форматов выбирается только звуковая дорожка.
         """
+        if output_format in AUDIO_DOWNLOAD_FORMATS:
+            resolution = "audio_only"
+        
         resolution_map = {
             "360p": "bestvideo[height<=360]+bestaudio/best[height<=360]/best",
             "480p": "bestvideo[height<=480]+bestaudio/best[height<=480]/best",
@@ -185,7 +584,8 @@ class VideoDownloader:
     
     async def get_video_info(self, url: str) -> Dict[str, Any]:
         """
-        Получает информацию о видео без скачивания
+        Получает информацию о видео без скачивания.
+        Результат кэшируется с TTL по платформе, ошибки экстрактора - на короткое время.
         
         Args:
             url: URL видео
@@ -193,40 +593,57 @@ class VideoDownloader:
         Returns:
             Словарь с информацией о видео
         """
+        if not settings.VIDEO_INFO_CACHE_ENABLED:
+            async with _info_semaphore:
+                info, _ = await self._fetch_video_info(url)
+            return info
+        
+        cache_key = hashlib.sha256(canonical_video_id(url).encode("utf-8")).hexdigest()
+        info = await video_info_cache.get(cache_key)
+        if info is not None:
+            return info
+        
+        async with _info_semaphore:
+            info, cacheable = await self._fetch_video_info(url)
+        if cacheable:
+            if "error" in info:
+                ttl = settings.VIDEO_INFO_NEGATIVE_TTL
+            else:
+                ttl = settings.VIDEO_INFO_CACHE_TTL.get(
+                    info.get("source_type", "other"), settings.VIDEO_INFO_CACHE_TTL.get("other", 600)
+                )
+            await video_info_cache.set(cache_key, info, ttl)
+        
+        return info
+    
+    async def _fetch_video_info(self, url: str) -> Tuple[Dict[str, Any], bool]:
+        """
+        Получает информацию о видео через yt-dlp
+        
+        Returns:
+            Кортеж (информация о видео, можно ли кэшировать результат)
+        """
         try:
             # Определяем тип источника
             source_type = self.determine_source_type(url)
             
-            # Получаем дополнительные опции для платформы
-            extra_options = self._get_extra_options(source_type)
-            
-            cmd = [
-                "yt-dlp",
-                "--skip-download",
-                "--dump-json",
-            ]
-            
-            # Добавляем дополнительные опции для конкретных платформ
-            cmd.extend(extra_options)
-            
-            # Добавляем URL в конце
-            cmd.append(url)
-            
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"yt-dlp info error for URL {url}: {stderr}")
-                return {"error": stderr}
-            
-            import json
-            info = json.loads(stdout)
+            if settings.YTDLP_ENGINE == "library":
+                outcome = await ytdlp_engine.extract_info(url, {
+                    "quiet": True,
+                    "no_warnings": True,
+                    **self._get_extra_ydl_opts(source_type)
+                })
+                
+                if "error" in outcome:
+                    logger.error(f"yt-dlp info error for URL {url}: {outcome['error']}")
+                    return {"error": outcome["error"]}, True
+                
+                info = outcome["info"]
+            else:
+                info, error = await self._dump_info_with_cli(url, source_type)
+                if error is not None:
+                    # Ошибка экстрактора (видео удалено, приватное и т.д.) кэшируется ненадолго
+                    return {"error": error}, True
             
             # Трансформируем формат в более удобный
             formats = []
@@ -242,11 +659,49 @@ class VideoDownloader:
                 "extractor": info.get("extractor", ""),
                 "extractor_key": info.get("extractor_key", ""),
                 "source_type": source_type
-            }
+            }, True
             
         except Exception as e:
             logger.exception(f"Error getting video info from {url}: {str(e)}")
-            return {"error": str(e)}
+            return {"error": str(e)}, False
+    
+    async def _dump_info_with_cli(self, url: str, source_type: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Получает информацию о видео, запуская CLI yt-dlp
+        
+        Returns:
+            Кортеж (информация yt-dlp, текст ошибки)
+        """
+        # Получаем дополнительные опции для платформы
+        extra_options = self._get_extra_options(source_type)
+        
+        cmd = [
+            "yt-dlp",
+            "--skip-download",
+            "--dump-json",
+        ]
+        
+        # Добавляем дополнительные опции для конкретных платформ
+        cmd.extend(extra_options)
+        
+        # Добавляем URL в конце
+        cmd.append(url)
+        
+        # Вывод --dump-json нужен целиком, поэтому здесь используется communicate()
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        
+        stdout, stderr = await process.communicate()
+        
+        if process.returncode != 0:
+            error = stderr.decode("utf-8", errors="replace")
+            logger.error(f"yt-dlp info error for URL {url}: {error}")
+            return None, error
+        
+        return json.loads(stdout), None
     
     def _transform_formats(self, formats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
@@ -271,90 +726,293 @@ class VideoDownloader:
         return result
     
     async def convert_video(
-        self, input_path: str, output_format: str, output_dir: str
+        self,
+        input_path: str,
+        output_format: str,
+        output_dir: str,
+        progress: Optional[ProgressReporter] = None,
+        duration: Optional[float] = None,
+        user_id: Optional[int] = None,
+        preset: Optional[str] = None
     ) -> DownloadResult:
         """
-        Конвертирует видео в указанный формат
+        Конвертирует видео в указанный формат и сохраняет результат в хранилище
+        
+        Результаты кэшируются по содержимому исходника, формату и пресету:
+        повторная конвертация выдается из кэша без запуска ffmpeg, а
+        одновременные конвертации одного исходника объединяются в одну.
         
         Args:
-            input_path: Путь к исходному видео
+            input_path: Логический путь к исходному видео (Download.file_path)
             output_format: Формат для конвертации (mp4, mp3, avi, и т.д.)
             output_dir: Директория для сохранения результата
+            progress: Получатель событий прогресса ffmpeg
+            duration: Длительность видео в секундах для расчета процента
+            user_id: Владелец результата (для учета места)
+            preset: Пресет перекодирования видео (fast или quality, по умолчанию CONVERT_DEFAULT_PRESET)
             
         Returns:
             DownloadResult с результатами конвертации
         """
-        try:
-            if not os.path.exists(input_path):
-                return DownloadResult(
-                    success=False,
-                    error=f"Файл не найден: {input_path}"
+        storage = get_storage()
+        input_key = storage_key(input_path)
+        if not await storage.exists(input_key):
+            return DownloadResult(
+                success=False,
+                error=f"Файл не найден: {input_path}"
+            )
+        
+        # Имя результата строится по логическому пути: у локальной копии из S3 имя временное
+        title = os.path.splitext(os.path.basename(input_path))[0]
+        output_filename = _conversion_filename(input_path, output_format)
+        
+        if not settings.CONVERT_CACHE_ENABLED:
+            # ffmpeg работает с локальным файлом; для S3 исходник скачивается во временную директорию
+            async with storage.local_copy(input_key) as local_input:
+                result = await self._convert_local(
+                    local_input, output_format, output_dir, progress, duration, preset, output_filename
+                )
+            result.title = title
+            return await self.store_result(result, user_id)
+        
+        source_size = await storage.size(input_key)
+        source_hash = await self._cached_source_hash(input_key, source_size)
+        
+        # При известном хэше кэш проверяется до скачивания исходника из S3
+        if source_hash:
+            cache_key = conversion_key(source_hash, output_format, preset)
+            cached = await self._fetch_converted(cache_key, output_dir, output_filename, title)
+            if cached:
+                logger.info(f"Conversion cache hit for {input_path} ({output_format})")
+                return await self._store_converted(cached, user_id)
+        
+        async with storage.local_copy(input_key) as local_input:
+            if not source_hash:
+                source_hash = await asyncio.to_thread(file_sha256, local_input)
+                await source_hash_cache.set(
+                    input_key, {"size": source_size, "sha256": source_hash}, settings.CONVERT_SOURCE_HASH_TTL
                 )
+                cache_key = conversion_key(source_hash, output_format, preset)
+                cached = await self._fetch_converted(cache_key, output_dir, output_filename, title)
+                if cached:
+                    logger.info(f"Conversion cache hit for {input_path} ({output_format})")
+                    return await self._store_converted(cached, user_id)
+            
+            outcome = await conversion_singleflight.do(
+                cache_key,
+                lambda: self._convert_into_cache(cache_key, local_input, output_format, progress, duration, preset)
+            )
+            if not outcome["success"]:
+                return DownloadResult(success=False, error=outcome["error"])
             
+            cached = await self._fetch_converted(cache_key, output_dir, output_filename, title)
+            if cached:
+                cached.conversion = outcome["conversion"]
+                return await self._store_converted(cached, user_id)
+            
+            logger.warning(f"Conversion cache entry for {input_path} disappeared, converting directly")
+            result = await self._convert_local(
+                local_input, output_format, output_dir, progress, duration, preset, output_filename
+            )
+            result.title = title
+        
+        return await self._store_converted(result, user_id)
+    
+    async def _cached_source_hash(self, input_key: str, size: Optional[int]) -> Optional[str]:
+        """Хэш содержимого исходника, если он уже считался для файла того же размера"""
+        cached = await source_hash_cache.get(input_key)
+        if cached and size is not None and cached.get("size") == size:
+            return cached["sha256"]
+        return None
+    
+    async def _fetch_converted(
+        self, cache_key: str, output_dir: str, filename: str, title: str
+    ) -> Optional[DownloadResult]:
+        """
+        Выдает результат конвертации из кэша в output_dir под именем filename
+        """
+        try:
+            cached = await asyncio.to_thread(conversion_cache.fetch, cache_key, output_dir, filename)
+        except OSError as e:
+            logger.warning(f"Conversion cache lookup failed for {cache_key}: {str(e)}")
+            return None
+        
+        if not cached:
+            return None
+        return DownloadResult(
+            success=True,
+            file_path=cached["file_path"],
+            title=title,
+            file_size=cached["file_size"],
+            duration=cached["duration"],
+            conversion="cached"
+        )
+    
+    async def _convert_into_cache(
+        self,
+        cache_key: str,
+        input_path: str,
+        output_format: str,
+        progress: Optional[ProgressReporter],
+        duration: Optional[float],
+        preset: Optional[str]
+    ) -> Dict[str, Any]:
+        """
+        Конвертирует файл во временную директорию кэша и публикует результат в кэше.
+        Возвращает JSON-сериализуемый результат для single-flight.
+        """
+        staging_dir = conversion_cache.make_staging_dir()
+        try:
+            result = await self._convert_local(input_path, output_format, staging_dir, progress, duration, preset)
+            
+            if result.success:
+                try:
+                    await asyncio.to_thread(
+                        conversion_cache.store, cache_key, result.file_path, result.title, result.duration
+                    )
+                except OSError as e:
+                    logger.warning(f"Failed to store {result.file_path} in conversion cache: {str(e)}")
+            
+            return {"success": result.success, "error": result.error, "conversion": result.conversion}
+        finally:
+            await asyncio.to_thread(shutil.rmtree, staging_dir, True)
+    
+    async def _store_converted(self, result: DownloadResult, user_id: Optional[int]) -> DownloadResult:
+        """
+        Сохраняет результат конвертации в хранилище. Файл по этому пути мог быть
+        заменен, поэтому его хэш как исходника больше недействителен.
+        """
+        if result.success:
+            await source_hash_cache.delete(storage_key(result.file_path))
+        return await self.store_result(result, user_id)
+    
+    async def _convert_local(
+        self,
+        input_path: str,
+        output_format: str,
+        output_dir: str,
+        progress: Optional[ProgressReporter] = None,
+        duration: Optional[float] = None,
+        preset: Optional[str] = None,
+        output_filename: Optional[str] = None
+    ) -> DownloadResult:
+        """
+        Конвертирует локальный файл через ffmpeg, результат сохраняется в output_dir
+        под именем output_filename (по умолчанию уникальное имя по исходнику).
+        ffmpeg пишет во временный файл, который по готовности атомарно
+        переименовывается, поэтому читатели не видят недописанный результат.
+        """
+        output_path = None
+        try:
             # Формируем имя выходного файла
             filename = os.path.basename(input_path)
             filename_without_ext = os.path.splitext(filename)[0]
-            output_filename = f"{filename_without_ext}.{output_format}"
-            output_path = os.path.join(output_dir, output_filename)
+            output_filename = output_filename or _conversion_filename(input_path, output_format)
+            final_path = os.path.join(output_dir, output_filename)
+            if os.path.abspath(final_path) == os.path.abspath(input_path):
+                return DownloadResult(success=False, error="Ошибка конвертации: результат совпадает с исходным файлом")
+            # Расширение сохраняется: по нему ffmpeg выбирает контейнер
+            output_path = os.path.join(output_dir, f".{uuid.uuid4().hex}.{output_format}")
+            # При хранении в S3 локальной директории загрузки может уже не быть
+            os.makedirs(output_dir, exist_ok=True)
             
-            # Подготавливаем команду ffmpeg
-            cmd = [
-                "ffmpeg",
-                "-i", input_path,
-                "-y",  # Перезаписывать существующие файлы
-            ]
+            # По кодекам исходника выбираем копирование потоков или перекодирование
+            media_info = await probe_media(input_path)
+            plan = plan_conversion(media_info, output_format, preset)
+            if duration is None and media_info is not None and media_info.duration:
+                duration = media_info.duration
             
-            # Добавляем специфичные настройки для разных форматов
-            if output_format == "mp3":
-                cmd.extend([
-                    "-vn",  # Убираем видео
-                    "-acodec", "libmp3lame",
-                    "-ab", "192k",  # Битрейт
-                ])
-            elif output_format in ["mp4", "avi", "mkv"]:
-                cmd.extend([
-                    "-c:v", "libx264",  # Видео кодек
-                    "-c:a", "aac",  # Аудио кодек
-                    "-b:a", "192k",  # Аудио битрейт
-                ])
-            
-            # Добавляем путь к выходному файлу
-            cmd.append(output_path)
-            
-            # Запускаем процесс конвертации
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                text=True
-            )
+            started_at = time.monotonic()
+            result = await self._run_ffmpeg(input_path, output_path, plan, progress, duration)
             
-            stdout, stderr = await process.communicate()
+            if result.returncode != 0 and plan.mode != MODE_TRANSCODE:
+                # Копирование потоков может не пройти (например, из-за меток времени) - перекодируем
+                logger.warning(f"FFmpeg {plan.mode} failed for {input_path}, falling back to transcode: {result.stderr_tail}")
+                plan = transcode_plan(output_format, preset)
+                result = await self._run_ffmpeg(input_path, output_path, plan, progress, duration)
             
-            if process.returncode != 0:
-                logger.error(f"FFmpeg error: {stderr}")
+            if result.returncode != 0:
+                logger.error(f"FFmpeg error: {result.stderr_tail}")
+                _remove_partial_file(output_path)
                 return DownloadResult(
                     success=False,
-                    error=f"Ошибка конвертации: {stderr}"
+                    error=f"Ошибка конвертации: {result.stderr_tail}"
                 )
             
+            elapsed = time.monotonic() - started_at
+            metrics.inc("conversions", mode=plan.mode, format=output_format)
+            metrics.observe("conversion_seconds", elapsed, mode=plan.mode)
+            logger.info(f"Converted {input_path} to {output_format} via {plan.mode} in {elapsed:.1f}s")
+            
+            os.replace(output_path, final_path)
+            output_path = None
+            
             # Получаем размер файла
-            file_size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+            file_size = os.path.getsize(final_path)
             
             return DownloadResult(
                 success=True,
-                file_path=output_path,
+                file_path=final_path,
                 title=filename_without_ext,
-                file_size=file_size
+                file_size=file_size,
+                conversion=plan.mode
             )
             
+        except ProcessTimeoutError as e:
+            logger.warning(f"FFmpeg killed for {input_path}: {str(e)}")
+            _remove_partial_file(output_path)
+            return DownloadResult(success=False, error=_timeout_message("Конвертация", e))
+        
+        except asyncio.CancelledError:
+            # Конвертация отменена - недописанный файл не должен остаться рядом с исходным
+            _remove_partial_file(output_path)
+            raise
+            
         except Exception as e:
             logger.exception(f"Error converting video {input_path}: {str(e)}")
+            _remove_partial_file(output_path)
             return DownloadResult(
                 success=False,
                 error=f"Ошибка конвертации: {str(e)}"
             )
     
+    async def _run_ffmpeg(
+        self,
+        input_path: str,
+        output_path: str,
+        plan: ConversionPlan,
+        progress: Optional[ProgressReporter],
+        duration: Optional[float]
+    ) -> ProcessResult:
+        """Запускает ffmpeg по плану конвертации с публикацией прогресса"""
+        cmd = [
+            "ffmpeg",
+            "-i", input_path,
+            "-y",  # Перезаписывать существующие файлы
+            "-progress", "pipe:1",  # Машиночитаемый прогресс в stdout
+            "-nostats",
+            *plan.args,
+        ]
+        if plan.threads:
+            # Число потоков задано планом, чтобы задачи пула конвертаций не делили ядра вслепую
+            cmd.extend(["-threads", str(plan.threads)])
+        cmd.append(output_path)
+        
+        parser = FfmpegProgressParser(duration)
+        
+        async def on_line(line: str) -> None:
+            event = parser.feed(line)
+            if event and progress:
+                await progress.publish(event)
+        
+        # ffmpeg пишет в stderr весь лог, для текста ошибки хранится только его хвост
+        return await run_process(
+            cmd,
+            on_stdout_line=on_line,
+            timeout=settings.CONVERT_TIMEOUT,
+            idle_timeout=settings.CONVERT_IDLE_TIMEOUT
+        )
+    
     async def download_instagram_with_instaloader(self, url: str, output_dir: str) -> DownloadResult:
         """
         Скачивает видео или фото из Instagram с использованием instaloader
@@ -366,6 +1024,7 @@ class VideoDownloader:
         Returns:
             DownloadResult с результатами скачивания
         """
+        temp_dir = None
         try:
             # Извлекаем идентификатор поста из URL
             match = re.search(r'instagram\.com/p/([^/]+)', url)
@@ -393,20 +1052,14 @@ class VideoDownloader:
             ]
             
             # Запускаем процесс скачивания
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = await process.communicate()
+            timeout, idle_timeout = self._get_timeouts("instagram")
+            result = await run_process(cmd, timeout=timeout, idle_timeout=idle_timeout)
             
-            if process.returncode != 0:
-                logger.error(f"Instaloader error: {stderr}")
+            if result.returncode != 0:
+                logger.error(f"Instaloader error: {result.stderr_tail}")
                 return DownloadResult(
                     success=False,
-                    error=f"Ошибка скачивания из Instagram: {stderr}"
+                    error=f"Ошибка скачивания из Instagram: {result.stderr_tail}"
                 )
             
             # Ищем скачанный файл
@@ -457,6 +1110,10 @@ class VideoDownloader:
                     error="Не удалось найти скачанный файл"
                 )
             
+        except ProcessTimeoutError as e:
+            logger.warning(f"Instaloader killed for {url}: {str(e)}")
+            return DownloadResult(success=False, error=_timeout_message("Загрузка", e))
+            
         except Exception as e:
             logger.exception(f"Error downloading from Instagram {url}: {str(e)}")
             return DownloadResult(
@@ -465,5 +1122,5 @@ class VideoDownloader:
             )
         finally:
             # Удаляем временную директорию
-            import shutil
-            shutil.rmtree(temp_dir, ignore_errors=True)
\ No newline at end of file
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
\ No newline at end of file
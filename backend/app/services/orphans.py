@@ -0,0 +1,225 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterator, Tuple, Set
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models.download import Download
+from app.services.storage import get_storage
+from app.services.storage_manager import storage_manager
+from app.utils.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Директория карантина внутри UPLOAD_DIR: <UPLOAD_DIR>/.orphans/<дата>/<исходный путь>
+QUARANTINE_DIRNAME = ".orphans"
+
+
+def _is_recent(stat_result: os.stat_result, threshold: float) -> bool:
+    # ctime меняется и при создании жесткой ссылки: файл, только что выданный
+    # из кэша загрузок, имеет старый mtime, но свежий ctime
+    return max(stat_result.st_mtime, stat_result.st_ctime) > threshold
+
+
+def _walk_candidates(root: str, grace_seconds: float, batch_size: int) -> Iterator[List[Tuple[str, int]]]:
+    """
+    Обходит UPLOAD_DIR через os.scandir и отдает пачки (путь, размер) файлов,
+    которые не менялись дольше grace_seconds
+
+    Скрытые директории верхнего уровня (кэш загрузок, карантин, временные
+    копии из S3) пропускаются. Пустые старые директории загрузок удаляются.
+    """
+    threshold = time.time() - grace_seconds
+    batch: List[Tuple[str, int]] = []
+    stack = [root]
+
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+        if not entries and directory != root:
+            try:
+                if not _is_recent(os.stat(directory), threshold):
+                    os.rmdir(directory)
+            except OSError:
+                pass
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if directory == root and entry.name.startswith("."):
+                        continue
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat_result = entry.stat(follow_symlinks=False)
+                    if _is_recent(stat_result, threshold):
+                        continue
+                    batch.append((entry.path, stat_result.st_size))
+                    if len(batch) >= batch_size:
+                        yield batch
+                        batch = []
+            except FileNotFoundError:
+                # Файл удален во время обхода
+                continue
+
+    if batch:
+        yield batch
+
+
+async def _referenced_paths(file_paths: List[str]) -> Set[str]:
+    """Пути из пачки, на которые ссылаются записи downloads (индекс ix_downloads_file_path)"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Download.file_path).where(Download.file_path.in_(file_paths))
+        )
+        return set(result.scalars())
+
+
+def _dispose(path: str, root: str, action: str, quarantine_root: str) -> None:
+    """Удаляет файл-сироту или переносит его в карантин"""
+    if action == "quarantine":
+        target = os.path.join(quarantine_root, os.path.relpath(path, root))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+    else:
+        os.remove(path)
+
+    parent = os.path.dirname(path)
+    if parent != root:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            pass
+
+
+def _tree_size(path: str) -> int:
+    """Суммарный размер файлов в директории"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _purge_quarantine(quarantine_dir: str, max_age_days: int) -> Tuple[int, int]:
+    """
+    Удаляет директории карантина старше max_age_days
+
+    Returns:
+        (число удаленных директорий, освобожденный объем в байтах)
+    """
+    threshold = time.time() - max_age_days * 24 * 60 * 60
+    removed = 0
+    freed = 0
+    try:
+        entries = list(os.scandir(quarantine_dir))
+    except FileNotFoundError:
+        return 0, 0
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < threshold:
+            size = _tree_size(entry.path)
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+            freed += size
+    return removed, freed
+
+
+async def reconcile_orphans(
+    dry_run: bool = False,
+    action: Optional[str] = None,
+    grace_seconds: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Находит в UPLOAD_DIR файлы, на которые не ссылается ни одна запись downloads,
+    и удаляет их или переносит в карантин
+
+    Сиротами становятся файлы анонимных загрузок (для них запись не создается),
+    остатки неудачных загрузок (.part, .info.json) и пустые директории загрузок.
+    Файлы, которые менялись за последние ORPHAN_GRACE_SECONDS, не трогаются:
+    так не затрагиваются выполняющиеся загрузки и файлы, ссылки на которые
+    еще действуют. Если STORAGE_BACKEND не local, готовые файлы живут в
+    объектном хранилище и все старые локальные файлы считаются остатками.
+
+    Args:
+        dry_run: Только подсчитать сирот и их объем
+        action: "delete" или "quarantine" (по умолчанию ORPHAN_ACTION)
+        grace_seconds: Минимальный возраст файла (по умолчанию ORPHAN_GRACE_SECONDS)
+
+    Returns:
+        Статистику; reclaimed_bytes - действительно освобожденное место (удаленные
+        файлы и очищенный карантин), quarantined_bytes - объем перенесенных
+        в карантин файлов, которые занимают место до очистки карантина
+    """
+    root = os.path.realpath(settings.UPLOAD_DIR)
+    action = action or settings.ORPHAN_ACTION
+    grace_seconds = grace_seconds if grace_seconds is not None else settings.ORPHAN_GRACE_SECONDS
+    quarantine_dir = os.path.join(root, QUARANTINE_DIRNAME)
+    quarantine_root = os.path.join(quarantine_dir, datetime.utcnow().strftime("%Y%m%d%H%M%S"))
+    check_db = get_storage().name == "local"
+
+    stats = {
+        "scanned": 0, "orphans": 0, "reclaimed_bytes": 0, "quarantined_bytes": 0,
+        "errors": 0, "quarantine_purged": 0
+    }
+    # Карантин находится на том же томе, поэтому перенос в него место не освобождает
+    freed_key = "quarantined_bytes" if action == "quarantine" else "reclaimed_bytes"
+    if not os.path.isdir(root):
+        return stats
+
+    batches = _walk_candidates(root, grace_seconds, settings.ORPHAN_BATCH_SIZE)
+    while True:
+        # Обход диска блокирующий, поэтому каждая пачка читается в пуле потоков
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+
+        stats["scanned"] += len(batch)
+        referenced: Set[str] = set()
+        if check_db:
+            # В БД хранятся пути относительно настроенного UPLOAD_DIR, а не realpath
+            logical = {path: os.path.join(settings.UPLOAD_DIR, os.path.relpath(path, root)) for path, _ in batch}
+            referenced_logical = await _referenced_paths(list(logical.values()))
+            referenced = {path for path, value in logical.items() if value in referenced_logical}
+
+        for path, size in batch:
+            if path in referenced:
+                continue
+            stats["orphans"] += 1
+            if dry_run:
+                stats[freed_key] += size
+                continue
+
+            try:
+                await asyncio.to_thread(_dispose, path, root, action, quarantine_root)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                stats["errors"] += 1
+                logger.error(f"Failed to {action} orphan file {path}: {str(e)}")
+                continue
+
+            stats[freed_key] += size
+            await storage_manager.forget(os.path.join(settings.UPLOAD_DIR, os.path.relpath(path, root)))
+
+    if not dry_run:
+        stats["quarantine_purged"], purged_bytes = await asyncio.to_thread(
+            _purge_quarantine, quarantine_dir, settings.ORPHAN_QUARANTINE_DAYS
+        )
+        stats["reclaimed_bytes"] += purged_bytes
+
+    logger.info(f"Orphan reconciliation finished (dry_run={dry_run}, action={action}): {stats}")
+    return stats
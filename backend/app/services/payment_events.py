@@ -0,0 +1,198 @@
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, List
+
+import stripe
+from sqlalchemy import select, update, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.payment import Payment, PaymentStatus, PaymentEvent, PaymentEventStatus
+from app.services.payment_poller import FETCHERS, PollBackoff, apply_results, provider_for
+from app.services.principal_cache import invalidate_subscription_owners
+from app.utils.database import AsyncSessionLocal
+from app.utils.http import get_http_client
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentNotFoundError(Exception):
+    """Уведомление пришло раньше, чем платеж сохранен с ID платежной системы"""
+
+
+@dataclass
+class WebhookEvent:
+    provider: str
+    event_id: str
+    event_type: Optional[str]
+    provider_payment_id: Optional[str]
+
+
+def parse_webhook(body: bytes, stripe_signature: Optional[str] = None) -> WebhookEvent:
+    """
+    Разбирает уведомление ЮKassa или Stripe (Stripe - по заголовку Stripe-Signature)
+
+    Подпись Stripe проверяется сразу. Содержимому уведомлений не доверяем:
+    итоговый статус платежа воркер запрашивает у платежной системы.
+
+    Raises:
+        ValueError: Некорректное тело или подпись уведомления
+    """
+    if stripe_signature is not None:
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            raise ValueError("STRIPE_WEBHOOK_SECRET is not configured")
+        try:
+            stripe.WebhookSignature.verify_header(body.decode(), stripe_signature, settings.STRIPE_WEBHOOK_SECRET)
+        except stripe.error.SignatureVerificationError as e:
+            raise ValueError(str(e)) from e
+
+        data = json.loads(body)
+        payment_object = (data.get("data") or {}).get("object") or {}
+        object_id = payment_object.get("id") or ""
+        return WebhookEvent(
+            provider="stripe",
+            event_id=data["id"],
+            event_type=data.get("type"),
+            provider_payment_id=object_id if object_id.startswith(("pi_", "cs_")) else None,
+        )
+
+    data = json.loads(body)
+    payment_object = data.get("object") or {}
+    if not data.get("event") or not payment_object.get("id"):
+        raise ValueError("Not a YooKassa notification")
+
+    # У уведомлений ЮKassa нет собственного ID: событие однозначно задается типом и платежом
+    return WebhookEvent(
+        provider="yookassa",
+        event_id=f"{data['event']}:{payment_object['id']}",
+        event_type=data["event"],
+        provider_payment_id=payment_object["id"] if data["event"].startswith("payment.") else None,
+    )
+
+
+def callback_event(provider_payment_id: str, status: str) -> WebhookEvent:
+    """Событие для обратного вызова /payments/callback"""
+    return WebhookEvent(
+        provider=provider_for(provider_payment_id),
+        event_id=f"callback:{status}:{provider_payment_id}",
+        event_type=f"callback.{status}",
+        provider_payment_id=provider_payment_id,
+    )
+
+
+async def record_event(db: AsyncSession, event: WebhookEvent, payload: bytes) -> Optional[int]:
+    """
+    Сохраняет уведомление и возвращает его ID для обработки
+
+    Повторная доставка того же события отсекается уникальным индексом
+    (INSERT IGNORE), тогда возвращается None. События, не относящиеся к
+    платежам, сохраняются сразу со статусом IGNORED и тоже возвращают None.
+    """
+    status = PaymentEventStatus.RECEIVED if event.provider_payment_id else PaymentEventStatus.IGNORED
+    result = await db.execute(
+        insert(PaymentEvent)
+        .prefix_with("IGNORE")
+        .values(
+            provider=event.provider,
+            event_id=event.event_id,
+            event_type=event.event_type,
+            provider_payment_id=event.provider_payment_id,
+            payload=payload.decode(errors="replace"),
+            status=status,
+            attempts=0,
+            created_at=datetime.utcnow(),
+        )
+    )
+    await db.commit()
+
+    if not result.rowcount or status != PaymentEventStatus.RECEIVED:
+        return None
+    return result.lastrowid
+
+
+async def _finish_event(db: AsyncSession, event_id: int, status: PaymentEventStatus, error: Optional[str] = None) -> None:
+    await db.execute(
+        update(PaymentEvent)
+        .where(PaymentEvent.id == event_id)
+        .values(status=status, error_message=error, processed_at=datetime.utcnow())
+    )
+
+
+async def process_event(event_id: int) -> str:
+    """
+    Применяет сохраненное уведомление к платежу и подписке
+
+    Статус платежа запрашивается у платежной системы, изменения и отметка
+    об обработке события фиксируются одной транзакцией. Повторная обработка
+    безопасна: статусы меняются только у платежей, которые еще в ожидании.
+
+    Raises:
+        PaymentNotFoundError, httpx.HTTPError: Обработку нужно повторить позже
+    """
+    async with AsyncSessionLocal() as db:
+        event = await db.get(PaymentEvent, event_id)
+        if event is None or event.status != PaymentEventStatus.RECEIVED:
+            return "skipped"
+        provider, provider_payment_id = event.provider, event.provider_payment_id
+
+        await db.execute(
+            update(PaymentEvent)
+            .where(PaymentEvent.id == event_id)
+            .values(attempts=PaymentEvent.attempts + 1)
+        )
+        await db.commit()
+
+    # Запрос к платежной системе выполняется вне транзакции
+    result = await FETCHERS[provider](get_http_client(), provider_payment_id)
+
+    async with AsyncSessionLocal() as db:
+        payment_id = await db.scalar(
+            select(Payment.id).where(Payment.provider_payment_id == provider_payment_id)
+        )
+        if payment_id is None:
+            raise PaymentNotFoundError(f"Payment {provider_payment_id} not found")
+
+        result.payment_id = payment_id
+        if result.status == PaymentStatus.PENDING:
+            # Промежуточное событие (например, waiting_for_capture) статус не меняет
+            await _finish_event(db, event_id, PaymentEventStatus.IGNORED)
+            await db.commit()
+            return "ignored"
+
+        await apply_results(db, [result])
+        await _finish_event(db, event_id, PaymentEventStatus.PROCESSED)
+        await db.commit()
+        await invalidate_subscription_owners(db, [result.subscription_id])
+
+    await PollBackoff().update([result])
+    logger.info(f"Payment event {event_id}: payment {payment_id} is {result.status.value}")
+    return "processed"
+
+
+async def fail_event(event_id: int, error: str) -> None:
+    """Отмечает событие, обработка которого исчерпала попытки (платеж проверит опрос)"""
+    async with AsyncSessionLocal() as db:
+        await _finish_event(db, event_id, PaymentEventStatus.FAILED, error)
+        await db.commit()
+
+
+async def stale_event_ids(limit: int = 500) -> List[int]:
+    """
+    Сохраненные события, которые так и не попали к воркеру
+    (постановка в очередь не удалась после сохранения)
+    """
+    created_before = datetime.utcnow() - timedelta(seconds=settings.PAYMENT_EVENT_STALE_AFTER)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(PaymentEvent.id)
+            .where(
+                PaymentEvent.status == PaymentEventStatus.RECEIVED,
+                PaymentEvent.attempts == 0,
+                PaymentEvent.created_at < created_before,
+            )
+            .order_by(PaymentEvent.id)
+            .limit(limit)
+        )
+        return list(result.scalars())
@@ -0,0 +1,320 @@
+import json
+import time
+import random
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+import httpx
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.models.payment import Payment, PaymentStatus
+from app.models.subscription import Subscription, SubscriptionStatus
+from app.utils.database import AsyncSessionLocal
+from app.utils.http import get_http_client
+from app.utils.redis import get_redis
+from app.services.principal_cache import invalidate_subscription_owners
+
+logger = logging.getLogger(__name__)
+
+# Расписание повторных проверок: ID платежа -> {"attempts": ..., "next_at": ...}
+BACKOFF_KEY = "payments:poll:backoff"
+
+
+@dataclass
+class PendingPayment:
+    id: int
+    provider_payment_id: str
+
+
+@dataclass
+class PollResult:
+    payment_id: int
+    provider_payment_id: str
+    status: PaymentStatus
+    subscription_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов: rate запросов в секунду, всплеск до burst
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def provider_for(provider_payment_id: str) -> str:
+    """Платежная система по формату ID платежа (pi_/cs_ - Stripe, UUID - ЮKassa)"""
+    if provider_payment_id.startswith(("pi_", "cs_")):
+        return "stripe"
+    return "yookassa"
+
+
+def _subscription_id(metadata: Optional[Dict[str, Any]]) -> Optional[int]:
+    value = (metadata or {}).get("subscription_id")
+    return int(value) if value else None
+
+
+async def fetch_yookassa_status(client: httpx.AsyncClient, provider_payment_id: str) -> PollResult:
+    response = await client.get(
+        f"{settings.YOOKASSA_API_URL}/payments/{provider_payment_id}",
+        auth=(settings.YOOKASSA_SHOP_ID or "", settings.YOOKASSA_SECRET_KEY or ""),
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    status = {
+        "succeeded": PaymentStatus.COMPLETED,
+        "canceled": PaymentStatus.FAILED,
+    }.get(data.get("status"), PaymentStatus.PENDING)
+    return PollResult(0, provider_payment_id, status, _subscription_id(data.get("metadata")))
+
+
+async def fetch_stripe_status(client: httpx.AsyncClient, provider_payment_id: str) -> PollResult:
+    headers = {"Authorization": f"Bearer {settings.STRIPE_SECRET_KEY or ''}"}
+    if provider_payment_id.startswith("cs_"):
+        response = await client.get(f"{settings.STRIPE_API_URL}/checkout/sessions/{provider_payment_id}", headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        if data.get("payment_status") == "paid":
+            status = PaymentStatus.COMPLETED
+        elif data.get("status") == "expired":
+            status = PaymentStatus.FAILED
+        else:
+            status = PaymentStatus.PENDING
+    else:
+        response = await client.get(f"{settings.STRIPE_API_URL}/payment_intents/{provider_payment_id}", headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        status = {
+            "succeeded": PaymentStatus.COMPLETED,
+            "canceled": PaymentStatus.FAILED,
+        }.get(data.get("status"), PaymentStatus.PENDING)
+
+    return PollResult(0, provider_payment_id, status, _subscription_id(data.get("metadata")))
+
+
+FETCHERS: Dict[str, Callable[[httpx.AsyncClient, str], Awaitable[PollResult]]] = {
+    "yookassa": fetch_yookassa_status,
+    "stripe": fetch_stripe_status,
+}
+
+
+class PaymentStatusPoller:
+    """
+    Параллельная проверка статусов платежей у платежных систем
+
+    Запросы идут через общий клиент с keep-alive соединениями, одновременно
+    выполняется не больше PAYMENT_POLL_CONCURRENCY запросов, а частота
+    запросов к каждой платежной системе ограничена PAYMENT_POLL_RATE_LIMITS.
+    """
+
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        concurrency: Optional[int] = None,
+        rate_limits: Optional[Dict[str, float]] = None
+    ):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency or settings.PAYMENT_POLL_CONCURRENCY)
+        rate_limits = rate_limits or settings.PAYMENT_POLL_RATE_LIMITS
+        self.buckets = {provider: TokenBucket(rate) for provider, rate in rate_limits.items()}
+
+    async def check(self, payment: PendingPayment) -> PollResult:
+        provider = provider_for(payment.provider_payment_id)
+        async with self.semaphore:
+            bucket = self.buckets.get(provider)
+            if bucket:
+                await bucket.acquire()
+            try:
+                result = await FETCHERS[provider](self.client or get_http_client(), payment.provider_payment_id)
+            except (httpx.HTTPError, ValueError) as e:
+                # Ошибка сети или платежной системы - платеж проверяется позже, как ожидающий
+                return PollResult(payment.id, payment.provider_payment_id, PaymentStatus.PENDING, error=str(e))
+
+        result.payment_id = payment.id
+        return result
+
+    async def check_many(self, payments: List[PendingPayment]) -> List[PollResult]:
+        return await asyncio.gather(*(self.check(payment) for payment in payments))
+
+
+class PollBackoff:
+    """
+    Экспоненциальная пауза между проверками платежа, который остается в ожидании
+
+    Расписание хранится в Redis, чтобы переживать перезапуск воркеров.
+    Без Redis все ожидающие платежи проверяются при каждом запуске.
+    """
+
+    async def due(self, payments: List[PendingPayment]) -> List[PendingPayment]:
+        redis = get_redis()
+        if redis is None or not payments:
+            return payments
+        try:
+            values = await redis.hmget(BACKOFF_KEY, [str(payment.id) for payment in payments])
+        except RedisError as e:
+            logger.warning(f"Failed to read payment poll backoff: {str(e)}")
+            return payments
+
+        now = time.time()
+        return [
+            payment for payment, value in zip(payments, values)
+            if value is None or json.loads(value)["next_at"] <= now
+        ]
+
+    async def update(self, results: List[PollResult]) -> None:
+        redis = get_redis()
+        if redis is None or not results:
+            return
+
+        pending = [result.payment_id for result in results if result.status == PaymentStatus.PENDING]
+        finished = [str(result.payment_id) for result in results if result.status != PaymentStatus.PENDING]
+        try:
+            attempts = await redis.hmget(BACKOFF_KEY, [str(payment_id) for payment_id in pending]) if pending else []
+            now = time.time()
+            schedule = {}
+            for payment_id, value in zip(pending, attempts):
+                attempt = (json.loads(value)["attempts"] if value else 0) + 1
+                delay = min(settings.PAYMENT_POLL_BACKOFF_BASE * 2 ** (attempt - 1), settings.PAYMENT_POLL_BACKOFF_MAX)
+                # Разброс, чтобы платежи одного времени не проверялись одной пачкой
+                delay *= random.uniform(0.8, 1.2)
+                schedule[str(payment_id)] = json.dumps({"attempts": attempt, "next_at": now + delay})
+
+            async with redis.pipeline(transaction=False) as pipe:
+                if schedule:
+                    pipe.hset(BACKOFF_KEY, mapping=schedule)
+                if finished:
+                    pipe.hdel(BACKOFF_KEY, *finished)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to update payment poll backoff: {str(e)}")
+
+
+async def apply_results(db: AsyncSession, results: List[PollResult]) -> None:
+    """
+    Сохраняет итоговые статусы пачки платежей (без фиксации транзакции)
+
+    Статусы меняются только у платежей и подписок, которые все еще в ожидании,
+    поэтому результаты опроса и уведомлений не перезаписывают друг друга.
+    """
+    completed = [result for result in results if result.status == PaymentStatus.COMPLETED]
+    failed = [result for result in results if result.status == PaymentStatus.FAILED]
+
+    payments_table = Payment.__table__
+    subscriptions_table = Subscription.__table__
+
+    if completed:
+        await db.execute(
+            update(payments_table)
+            .where(payments_table.c.id.in_([result.payment_id for result in completed]))
+            .where(payments_table.c.status == PaymentStatus.PENDING)
+            .values(status=PaymentStatus.COMPLETED)
+        )
+        activations = [
+            {"subscription_id": result.subscription_id, "provider_payment_id": result.provider_payment_id}
+            for result in completed if result.subscription_id
+        ]
+        if activations:
+            await db.execute(
+                update(subscriptions_table)
+                .where(subscriptions_table.c.id == bindparam("subscription_id"))
+                .where(subscriptions_table.c.status == SubscriptionStatus.PENDING.value)
+                .values(status=SubscriptionStatus.ACTIVE.value, payment_id=bindparam("provider_payment_id")),
+                activations
+            )
+    if failed:
+        await db.execute(
+            update(payments_table)
+            .where(payments_table.c.id.in_([result.payment_id for result in failed]))
+            .where(payments_table.c.status == PaymentStatus.PENDING)
+            .values(status=PaymentStatus.FAILED)
+        )
+        canceled = [result.subscription_id for result in failed if result.subscription_id]
+        if canceled:
+            await db.execute(
+                update(subscriptions_table)
+                .where(subscriptions_table.c.id.in_(canceled))
+                .where(subscriptions_table.c.status == SubscriptionStatus.PENDING.value)
+                .values(status=SubscriptionStatus.CANCELED.value)
+            )
+
+
+async def poll_pending_payments(poller: Optional[PaymentStatusPoller] = None) -> Dict[str, Any]:
+    """
+    Проверяет незавершенные платежи пачками по PAYMENT_POLL_BATCH_SIZE
+
+    Обычно платеж подтверждается уведомлением платежной системы, поэтому
+    опрашиваются только платежи старше PAYMENT_POLL_MIN_AGE, для которых
+    уведомление не пришло или потерялось. Платежи, по которым еще рано
+    повторять проверку, пропускаются. Если обход не уложился в
+    PAYMENT_POLL_TIME_BUDGET, оставшиеся платежи проверит следующий запуск.
+    """
+    poller = poller or PaymentStatusPoller()
+    backoff = PollBackoff()
+    deadline = time.monotonic() + settings.PAYMENT_POLL_TIME_BUDGET
+
+    stats = {"total_pending": 0, "checked": 0, "completed_count": 0, "failed_count": 0, "errors": 0}
+    last_id = 0
+    created_before = datetime.utcnow() - timedelta(seconds=settings.PAYMENT_POLL_MIN_AGE)
+
+    while time.monotonic() < deadline:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Payment.id, Payment.provider_payment_id)
+                .where(
+                    Payment.status == PaymentStatus.PENDING,
+                    Payment.provider_payment_id.isnot(None),
+                    Payment.created_at < created_before,
+                    Payment.id > last_id,
+                )
+                .order_by(Payment.id)
+                .limit(settings.PAYMENT_POLL_BATCH_SIZE)
+            )
+            batch = [PendingPayment(row.id, row.provider_payment_id) for row in result]
+
+        if not batch:
+            break
+        last_id = batch[-1].id
+        stats["total_pending"] += len(batch)
+
+        due = await backoff.due(batch)
+        results = await poller.check_many(due)
+
+        if any(result.status != PaymentStatus.PENDING for result in results):
+            async with AsyncSessionLocal() as db:
+                await apply_results(db, results)
+                await db.commit()
+                await invalidate_subscription_owners(db, (result.subscription_id for result in results))
+        await backoff.update(results)
+
+        stats["checked"] += len(results)
+        stats["completed_count"] += sum(1 for r in results if r.status == PaymentStatus.COMPLETED)
+        stats["failed_count"] += sum(1 for r in results if r.status == PaymentStatus.FAILED)
+        stats["errors"] += sum(1 for r in results if r.error)
+    else:
+        logger.warning(f"Payment polling stopped after {settings.PAYMENT_POLL_TIME_BUDGET}s budget at payment {last_id}")
+
+    return stats
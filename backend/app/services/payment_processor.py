@@ -1,12 +1,12 @@
 import uuid
 import logging
-import httpx
 from typing import Optional, Dict, Any, Union
 import json
 from datetime import datetime
 
 from app.core.config import settings
 from app.models.payment import PaymentStatus, PaymentMethod
+from app.utils.http import get_http_client
 
 logger = logging.getLogger(__name__)
 
@@ -143,22 +143,22 @@ class PaymentProcessor:
         
         try:
             # Отправляем запрос к YooKassa API
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    api_url,
-                    json=payment_data,
-                    auth=(self.api_key, self.api_secret),
-                    headers={"Idempotence-Key": str(uuid.uuid4())}
-                )
+            client = get_http_client()
+            response = await client.post(
+                api_url,
+                json=payment_data,
+                auth=(self.api_key, self.api_secret),
+                headers={"Idempotence-Key": str(uuid.uuid4())}
+            )
                 
-                if response.status_code != 200:
-                    logger.error(f"Ошибка YooKassa API: {response.text}")
-                    raise Exception(f"Ошибка API YooKassa: {response.status_code}")
+            if response.status_code != 200:
+                logger.error(f"Ошибка YooKassa API: {response.text}")
+                raise Exception(f"Ошибка API YooKassa: {response.status_code}")
                 
-                result = response.json()
+            result = response.json()
                 
-                # Возвращаем URL для оплаты
-                return result["confirmation"]["confirmation_url"]
+            # Возвращаем URL для оплаты
+            return result["confirmation"]["confirmation_url"]
                 
         except Exception as e:
             logger.exception(f"Ошибка при создании платежа в YooKassa: {str(e)}")
@@ -171,31 +171,31 @@ class PaymentProcessor:
         api_url = f"{self.api_urls['yookassa']}/payments/{external_payment_id}"
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    api_url,
-                    auth=(self.api_key, self.api_secret)
-                )
+            client = get_http_client()
+            response = await client.get(
+                api_url,
+                auth=(self.api_key, self.api_secret)
+            )
                 
-                if response.status_code != 200:
-                    logger.error(f"Ошибка YooKassa API: {response.text}")
-                    raise Exception(f"Ошибка API YooKassa: {response.status_code}")
+            if response.status_code != 200:
+                logger.error(f"Ошибка YooKassa API: {response.text}")
+                raise Exception(f"Ошибка API YooKassa: {response.status_code}")
                 
-                result = response.json()
+            result = response.json()
                 
-                # Конвертируем статус YooKassa в наш формат
-                yookassa_status = result.get("status")
+            # Конвертируем статус YooKassa в наш формат
+            yookassa_status = result.get("status")
                 
-                if yookassa_status == "succeeded":
-                    return PaymentStatus.COMPLETED
-                elif yookassa_status == "canceled":
-                    return PaymentStatus.FAILED
-                elif yookassa_status == "pending":
-                    return PaymentStatus.PENDING
-                elif yookassa_status == "waiting_for_capture":
-                    return PaymentStatus.PENDING
-                else:
-                    return PaymentStatus.PENDING
+            if yookassa_status == "succeeded":
+                return PaymentStatus.COMPLETED
+            elif yookassa_status == "canceled":
+                return PaymentStatus.FAILED
+            elif yookassa_status == "pending":
+                return PaymentStatus.PENDING
+            elif yookassa_status == "waiting_for_capture":
+                return PaymentStatus.PENDING
+            else:
+                return PaymentStatus.PENDING
                 
         except Exception as e:
             logger.exception(f"Ошибка при проверке статуса платежа в YooKassa: {str(e)}")
@@ -208,18 +208,18 @@ class PaymentProcessor:
         api_url = f"{self.api_urls['yookassa']}/payments/{external_payment_id}/cancel"
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    api_url,
-                    auth=(self.api_key, self.api_secret),
-                    headers={"Idempotence-Key": str(uuid.uuid4())}
-                )
+            client = get_http_client()
+            response = await client.post(
+                api_url,
+                auth=(self.api_key, self.api_secret),
+                headers={"Idempotence-Key": str(uuid.uuid4())}
+            )
                 
-                if response.status_code != 200:
-                    logger.error(f"Ошибка YooKassa API: {response.text}")
-                    raise Exception(f"Ошибка API YooKassa: {response.status_code}")
+            if response.status_code != 200:
+                logger.error(f"Ошибка YooKassa API: {response.text}")
+                raise Exception(f"Ошибка API YooKassa: {response.status_code}")
                 
-                return True
+            return True
                 
         except Exception as e:
             logger.exception(f"Ошибка при отмене платежа в YooKassa: {str(e)}")
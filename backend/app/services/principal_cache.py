@@ -0,0 +1,154 @@
+import enum
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterable, Type, TypeVar
+
+from sqlalchemy import select, or_, inspect, DateTime, Enum
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.config import settings
+from app.models.user import User
+from app.models.subscription import Subscription, SubscriptionStatus
+from app.utils.cache import TwoTierCache
+
+logger = logging.getLogger(__name__)
+
+ModelT = TypeVar("ModelT")
+
+# Пользователь и его активная подписка для авторизованных запросов.
+# Ключи: "user:<id>" и "entitlement:<user_id>"
+principal_cache = TwoTierCache(
+    "principal",
+    local_maxsize=settings.PRINCIPAL_CACHE_LOCAL_SIZE,
+    local_ttl=settings.PRINCIPAL_CACHE_LOCAL_TTL,
+)
+
+# Хэш пароля не кладем в Redis: он не нужен для проверки токена
+_USER_EXCLUDED_COLUMNS = {"hashed_password"}
+
+
+def _snapshot(instance: Any, exclude: Iterable[str] = ()) -> Dict[str, Any]:
+    """Значения колонок ORM-объекта в виде, пригодном для JSON"""
+    data = {}
+    for attr in inspect(type(instance)).column_attrs:
+        if attr.key in exclude:
+            continue
+        value = getattr(instance, attr.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, enum.Enum):
+            value = value.value
+        data[attr.key] = value
+    return data
+
+
+async def _restore(db: AsyncSession, model: Type[ModelT], data: Dict[str, Any]) -> ModelT:
+    """
+    Восстанавливает ORM-объект из снимка и присоединяет его к сессии без запроса к БД
+
+    Объект помечается как загруженный из БД (make_transient_to_detached),
+    поэтому изменения полей и db.add() работают как с обычным объектом.
+    Колонки, которых нет в снимке, остаются невыгруженными.
+    """
+    values = {}
+    for attr in inspect(model).column_attrs:
+        if attr.key not in data:
+            continue
+        value = data[attr.key]
+        column_type = attr.columns[0].type
+        if value is not None:
+            if isinstance(column_type, DateTime):
+                value = datetime.fromisoformat(value)
+            elif isinstance(column_type, Enum) and column_type.enum_class is not None:
+                value = column_type.enum_class(value)
+        values[attr.key] = value
+
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return await db.merge(instance, load=False)
+
+
+async def get_cached_user(db: AsyncSession, user_id: int) -> Optional[User]:
+    """
+    Пользователь по ID из токена: из кэша или из БД с сохранением в кэш
+    """
+    if not settings.PRINCIPAL_CACHE_ENABLED:
+        return await db.get(User, user_id)
+
+    key = f"user:{user_id}"
+    data = await principal_cache.get(key)
+    if data is not None:
+        return await _restore(db, User, data)
+
+    user = await db.get(User, user_id)
+    if user is not None:
+        await principal_cache.set(key, _snapshot(user, _USER_EXCLUDED_COLUMNS), settings.PRINCIPAL_CACHE_TTL)
+    return user
+
+
+async def get_active_subscription(db: AsyncSession, user_id: int) -> Optional[Subscription]:
+    """
+    Активная подписка пользователя (последняя созданная): из кэша или из БД
+
+    Отсутствие подписки тоже кэшируется. Подписка, срок которой истек
+    после сохранения в кэш, не возвращается.
+    """
+    key = f"entitlement:{user_id}"
+    if settings.PRINCIPAL_CACHE_ENABLED:
+        cached = await principal_cache.get(key)
+        if cached is not None:
+            data = cached["subscription"]
+            if data is None:
+                return None
+            if data.get("end_date") and datetime.fromisoformat(data["end_date"]) <= datetime.utcnow():
+                return None
+            return await _restore(db, Subscription, data)
+
+    now = datetime.utcnow()
+    result = await db.execute(
+        select(Subscription)
+        .where(
+            Subscription.user_id == user_id,
+            Subscription.status == SubscriptionStatus.ACTIVE.value,
+            or_(Subscription.end_date.is_(None), Subscription.end_date > now),
+        )
+        .order_by(Subscription.created_at.desc())
+        .limit(1)
+    )
+    subscription = result.scalar_one_or_none()
+
+    if settings.PRINCIPAL_CACHE_ENABLED:
+        snapshot = _snapshot(subscription) if subscription is not None else None
+        await principal_cache.set(key, {"subscription": snapshot}, settings.PRINCIPAL_CACHE_TTL)
+    return subscription
+
+
+async def invalidate_user(user_id: Optional[int]) -> None:
+    """Сбрасывает кэш пользователя после изменения его полей"""
+    if user_id is not None:
+        await principal_cache.delete(f"user:{user_id}")
+
+
+async def invalidate_entitlement(user_id: Optional[int]) -> None:
+    """Сбрасывает кэш активной подписки после изменения подписок или платежей пользователя"""
+    if user_id is not None:
+        await principal_cache.delete(f"entitlement:{user_id}")
+
+
+async def invalidate_principal(user_id: Optional[int]) -> None:
+    """Сбрасывает кэш пользователя и его подписки (удаление, блокировка)"""
+    await invalidate_user(user_id)
+    await invalidate_entitlement(user_id)
+
+
+async def invalidate_subscription_owners(db: AsyncSession, subscription_ids: Iterable[int]) -> None:
+    """Сбрасывает кэш подписки владельцев подписок, измененных массовым UPDATE"""
+    subscription_ids = [subscription_id for subscription_id in subscription_ids if subscription_id]
+    if not subscription_ids:
+        return
+    result = await db.execute(
+        select(Subscription.user_id).where(Subscription.id.in_(subscription_ids)).distinct()
+    )
+    for user_id in result.scalars():
+        await invalidate_entitlement(user_id)
@@ -0,0 +1,234 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, AsyncIterator
+
+from app.core.config import settings
+from app.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Шаблон строк прогресса yt-dlp (--newline --progress-template), разбирается parse_ytdlp_progress
+PROGRESS_PREFIX = "[progress]"
+YTDLP_PROGRESS_TEMPLATES = [
+    "download:" + PROGRESS_PREFIX + " download %(progress.status)s %(progress.downloaded_bytes)s "
+    "%(progress.total_bytes)s %(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s",
+    "postprocess:" + PROGRESS_PREFIX + " postprocess %(progress.status)s %(progress.postprocessor)s",
+]
+
+# Статусы, после которых новых событий не будет (совпадают с DownloadStatus)
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "removed"}
+
+
+def progress_channel(download_id: int) -> str:
+    return f"download:{download_id}:events"
+
+
+def progress_key(download_id: int) -> str:
+    return f"download:{download_id}:progress"
+
+
+def cancel_key(download_id: int) -> str:
+    return f"download:{download_id}:cancel"
+
+
+async def request_cancel(download_id: int) -> bool:
+    """
+    Запрашивает отмену выполняющейся фоновой загрузки
+
+    Returns:
+        False, если Redis недоступен и запрос передать не удалось
+    """
+    redis = get_redis()
+    if redis is None:
+        return False
+    await redis.set(cancel_key(download_id), 1, ex=settings.DOWNLOAD_TASK_TIME_LIMIT)
+    return True
+
+
+async def wait_for_cancel(download_id: int) -> None:
+    """
+    Завершается, когда для загрузки запрошена отмена (опрос раз в DOWNLOAD_CANCEL_POLL_INTERVAL)
+    """
+    redis = get_redis()
+    if redis is None:
+        # Без Redis отменить загрузку нельзя - ждем, пока задачу не отменят снаружи
+        await asyncio.Event().wait()
+
+    while True:
+        try:
+            if await redis.exists(cancel_key(download_id)):
+                return
+        except Exception as e:
+            logger.warning(f"Failed to check cancel flag for download {download_id}: {str(e)}")
+        await asyncio.sleep(settings.DOWNLOAD_CANCEL_POLL_INTERVAL)
+
+
+def _number(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_ytdlp_progress(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Разбирает строку прогресса yt-dlp, выведенную по YTDLP_PROGRESS_TEMPLATES
+
+    Returns:
+        Событие прогресса или None, если строка не относится к прогрессу
+    """
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+
+    parts = line[len(PROGRESS_PREFIX):].split()
+    if len(parts) >= 7 and parts[0] == "download":
+        downloaded, total, estimate, speed, eta = (_number(p) for p in parts[2:7])
+        total = total or estimate
+        event = {
+            "status": "downloading",
+            "downloaded_bytes": int(downloaded) if downloaded is not None else None,
+            "total_bytes": int(total) if total else None,
+            "speed": speed,
+            "eta": int(eta) if eta is not None else None,
+            "percent": None,
+        }
+        if downloaded is not None and total:
+            event["percent"] = round(min(100.0, downloaded * 100 / total), 1)
+        return event
+
+    if len(parts) >= 3 and parts[0] == "postprocess":
+        # Склейка и перекодирование через ffmpeg после загрузки
+        return {"status": "postprocessing", "postprocessor": parts[2], "stage": parts[1]}
+
+    return None
+
+
+class FfmpegProgressParser:
+    """
+    Разбирает вывод ffmpeg -progress pipe:1 (блоки строк key=value)
+    """
+
+    def __init__(self, duration: Optional[float] = None):
+        self.duration = duration
+        self._block: Dict[str, str] = {}
+
+    def feed(self, line: str) -> Optional[Dict[str, Any]]:
+        """
+        Принимает очередную строку вывода
+
+        Returns:
+            Событие прогресса в конце блока (строка progress=...), иначе None
+        """
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        self._block[key] = value
+        if key != "progress":
+            return None
+
+        block, self._block = self._block, {}
+        out_time_us = _number(block.get("out_time_us") or block.get("out_time_ms"))
+        event = {
+            "status": "converting",
+            "out_time": round(out_time_us / 1_000_000, 1) if out_time_us is not None else None,
+            "speed": _number(block.get("speed", "").rstrip("x")),
+            "percent": None,
+        }
+        if event["out_time"] is not None and self.duration:
+            event["percent"] = round(min(100.0, event["out_time"] * 100 / self.duration), 1)
+        return event
+
+
+class ProgressReporter:
+    """
+    Публикует события прогресса загрузки в Redis
+
+    События уходят в канал pub/sub progress_channel(download_id), последнее
+    событие сохраняется в progress_key(download_id), чтобы подписавшийся
+    позже клиент сразу получил текущее состояние. Промежуточные события
+    прореживаются до одного в DOWNLOAD_PROGRESS_INTERVAL секунд.
+    """
+
+    def __init__(self, download_id: int, min_interval: Optional[float] = None):
+        self.download_id = download_id
+        self.min_interval = min_interval if min_interval is not None else settings.DOWNLOAD_PROGRESS_INTERVAL
+        self._last_published = 0.0
+        self._last_status: Optional[str] = None
+
+    async def publish(self, event: Dict[str, Any]) -> None:
+        """
+        Публикует событие; ошибки Redis не прерывают загрузку
+        """
+        status = event.get("status")
+        now = time.monotonic()
+        if status == self._last_status and now - self._last_published < self.min_interval:
+            return
+        self._last_status = status
+        self._last_published = now
+
+        redis = get_redis()
+        if redis is None:
+            return
+
+        payload = json.dumps({"id": self.download_id, **event, "ts": time.time()})
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set(progress_key(self.download_id), payload, ex=settings.DOWNLOAD_PROGRESS_TTL)
+                pipe.publish(progress_channel(self.download_id), payload)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to publish progress for download {self.download_id}: {str(e)}")
+
+
+def publish_progress_sync(redis_client, download_id: int, event: Dict[str, Any]) -> None:
+    """
+    Синхронная публикация события (для процессов пула yt-dlp, где нет event loop)
+    """
+    payload = json.dumps({"id": download_id, **event, "ts": time.time()})
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(progress_key(download_id), payload, ex=settings.DOWNLOAD_PROGRESS_TTL)
+    pipe.publish(progress_channel(download_id), payload)
+    pipe.execute()
+
+
+async def stream_progress(
+    download_id: int, keepalive: float = 15.0
+) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Подписывается на события загрузки
+
+    Сначала отдает сохраненное последнее событие, затем новые события до
+    терминального статуса. Если событий нет дольше keepalive секунд,
+    отдает None, чтобы вызывающий код мог отправить keep-alive.
+    """
+    redis = get_redis()
+    pubsub = redis.pubsub()
+    channel = progress_channel(download_id)
+    await pubsub.subscribe(channel)
+    try:
+        # Снимок читается после подписки, чтобы не потерять событие между ними
+        snapshot = await redis.get(progress_key(download_id))
+        if snapshot:
+            event = json.loads(snapshot)
+            yield event
+            if event.get("status") in TERMINAL_STATUSES:
+                return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=keepalive)
+            if message is None:
+                yield None
+                continue
+
+            event = json.loads(message["data"])
+            yield event
+            if event.get("status") in TERMINAL_STATUSES:
+                return
+    finally:
+        try:
+            await asyncio.shield(pubsub.unsubscribe(channel))
+            await pubsub.aclose()
+        except Exception as e:
+            logger.debug(f"Failed to close progress subscription {channel}: {str(e)}")
@@ -0,0 +1,166 @@
+import json
+import uuid
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Продление блокировки только ее владельцем
+_EXTEND_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Снятие блокировки только ее владельцем
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в одно выполнение
+
+    Внутри процесса ожидающие получают результат того же Future. Между
+    процессами и воркерами лидер выбирается блокировкой в Redis, а
+    результат публикуется в Redis на короткое время. Поэтому результат
+    функции должен сериализоваться в JSON. Без Redis работает только
+    объединение внутри процесса.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        lock_ttl: int = 60,
+        wait_timeout: int = 3600,
+        result_ttl: int = 30,
+        poll_interval: float = 0.5
+    ):
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет fn один раз для всех одновременных вызовов с ключом key
+
+        Args:
+            key: Ключ объединения
+            fn: Асинхронная функция, результат которой сериализуется в JSON
+
+        Returns:
+            Результат fn (общий для всех ожидающих)
+        """
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Лидер был отменен (например, клиент отключился) - пробуем стать лидером сами
+                if future.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._do_distributed(key, fn)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Помечаем исключение как полученное, если ожидающих нет
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _do_distributed(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        redis = get_redis()
+        if redis is None:
+            return await fn()
+
+        lock_key = f"singleflight:{self.namespace}:{key}:lock"
+        result_key = f"singleflight:{self.namespace}:{key}:result"
+        token = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+
+        while True:
+            try:
+                shared_result = await redis.get(result_key)
+                if shared_result is not None:
+                    return json.loads(shared_result)
+
+                acquired = await redis.set(lock_key, token, nx=True, px=self.lock_ttl * 1000)
+            except RedisError as e:
+                logger.warning(f"Single-flight Redis error for {key}, running locally: {str(e)}")
+                return await fn()
+
+            if acquired:
+                break
+
+            if loop.time() > deadline:
+                logger.warning(f"Timed out waiting for single-flight leader of {key}, running locally")
+                return await fn()
+
+            await asyncio.sleep(self.poll_interval)
+
+        refresher = asyncio.create_task(self._keep_lock(redis, lock_key, token))
+        try:
+            result = await fn()
+            try:
+                await redis.set(result_key, json.dumps(result), ex=self.result_ttl)
+            except RedisError as e:
+                logger.warning(f"Failed to publish single-flight result for {key}: {str(e)}")
+            return result
+        finally:
+            refresher.cancel()
+            try:
+                await redis.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+            except RedisError:
+                pass
+
+    async def _keep_lock(self, redis, lock_key: str, token: str) -> None:
+        """
+        Продлевает блокировку лидера, пока выполняется долгая операция
+        """
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            try:
+                await redis.eval(_EXTEND_SCRIPT, 1, lock_key, token, self.lock_ttl * 1000)
+            except RedisError as e:
+                logger.warning(f"Failed to extend single-flight lock {lock_key}: {str(e)}")
+
+
+download_singleflight = SingleFlight(
+    "downloads",
+    lock_ttl=settings.DOWNLOAD_SINGLEFLIGHT_LOCK_TTL,
+    wait_timeout=settings.DOWNLOAD_SINGLEFLIGHT_WAIT_TIMEOUT
+)
+
+conversion_singleflight = SingleFlight(
+    "conversions",
+    lock_ttl=settings.DOWNLOAD_SINGLEFLIGHT_LOCK_TTL,
+    wait_timeout=settings.CONVERT_TASK_TIME_LIMIT
+)
@@ -0,0 +1,285 @@
+import os
+import shutil
+import asyncio
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Optional, AsyncIterator
+
+from app.core.config import settings
+from app.auth.signed_url import signed_file_url
+from app.utils.file_response import content_disposition
+
+logger = logging.getLogger(__name__)
+
+
+def storage_key(file_path: str) -> str:
+    """
+    Ключ хранилища для пути файла
+
+    В Download.file_path хранится логический путь UPLOAD_DIR/<ключ>
+    независимо от того, где лежат данные.
+    """
+    return os.path.normpath(os.path.relpath(file_path, settings.UPLOAD_DIR))
+
+
+def logical_path(key: str) -> str:
+    """Логический путь файла (значение Download.file_path) по ключу хранилища"""
+    return os.path.join(settings.UPLOAD_DIR, key)
+
+
+class StorageBackend(ABC):
+    """
+    Хранилище готовых файлов (скачанных и сконвертированных видео)
+
+    yt-dlp и ffmpeg всегда работают с локальными файлами в UPLOAD_DIR;
+    после завершения результат передается в хранилище через store().
+    """
+
+    name: str
+
+    @abstractmethod
+    async def store(self, file_path: str) -> str:
+        """
+        Сохраняет локальный файл из UPLOAD_DIR в хранилище
+
+        Returns:
+            Ключ файла в хранилище
+        """
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        """Проверяет наличие файла"""
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        """Размер файла в байтах или None, если файла нет"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> bool:
+        """
+        Удаляет файл
+
+        Returns:
+            True, если файл был удален
+        """
+
+    @abstractmethod
+    def url(self, key: str, ttl: Optional[int] = None) -> str:
+        """Ссылка для скачивания файла с ограниченным сроком действия"""
+
+    @abstractmethod
+    def local_copy(self, key: str) -> "AsyncIterator[str]":
+        """
+        Асинхронный контекстный менеджер с локальным путем к файлу
+        (например, для ffmpeg). Временная копия удаляется при выходе.
+        """
+
+
+class LocalStorage(StorageBackend):
+    """Файлы остаются на диске UPLOAD_DIR и отдаются по подписанным ссылкам (nginx или backend)"""
+
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.UPLOAD_DIR
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    async def store(self, file_path: str) -> str:
+        return storage_key(file_path)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self._path(key))
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return (await asyncio.to_thread(os.stat, self._path(key))).st_size
+        except FileNotFoundError:
+            return None
+
+    async def delete(self, key: str) -> bool:
+        # Файловые операции выполняются в пуле потоков, чтобы не блокировать event loop
+        return await asyncio.to_thread(self._delete_sync, self._path(key))
+
+    def _delete_sync(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        _remove_empty_parent(path, self.root)
+        return True
+
+    def url(self, key: str, ttl: Optional[int] = None) -> str:
+        return signed_file_url(self._path(key), ttl)
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[str]:
+        yield self._path(key)
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-совместимое объектное хранилище (AWS S3, MinIO)
+
+    Файлы загружаются multipart-загрузкой частями S3_MULTIPART_CHUNK_SIZE
+    в несколько потоков, после чего локальная копия удаляется. Клиенты
+    получают presigned-ссылки прямо на хранилище, поэтому несколько
+    реплик backend могут работать без общего тома.
+    """
+
+    name = "s3"
+
+    def __init__(self):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 to be installed") from e
+
+        self.bucket = settings.S3_BUCKET
+        self.prefix = settings.S3_PREFIX.strip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            region_name=settings.S3_REGION,
+            aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+            config=Config(
+                signature_version="s3v4",
+                # MinIO и большинство S3-совместимых хранилищ требуют path-style адресацию
+                s3={"addressing_style": "path" if settings.S3_ENDPOINT_URL else "auto"},
+                max_pool_connections=settings.S3_MAX_CONCURRENCY * 2,
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=settings.S3_MULTIPART_CHUNK_SIZE,
+            max_concurrency=settings.S3_MAX_CONCURRENCY,
+            use_threads=True,
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    async def store(self, file_path: str) -> str:
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        key = storage_key(file_path)
+        try:
+            await asyncio.to_thread(
+                self.client.upload_file,
+                file_path,
+                self.bucket,
+                self._object_key(key),
+                Config=self.transfer_config,
+            )
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"S3 upload of {key} failed: {str(e)}") from e
+
+        # Локальная копия больше не нужна; файл может быть жесткой ссылкой из кэша загрузок.
+        # Вместе с ней удаляются служебные файлы yt-dlp, иначе директория загрузки остается
+        os.remove(file_path)
+        _remove_sidecar_files(file_path)
+        _remove_empty_parent(file_path, settings.UPLOAD_DIR)
+        return key
+
+    async def size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            response = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["ContentLength"]
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def delete(self, key: str) -> bool:
+        # DeleteObject идемпотентен и не сообщает, существовал ли объект
+        existed = await self.exists(key)
+        if existed:
+            await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self._object_key(key))
+        return existed
+
+    def url(self, key: str, ttl: Optional[int] = None) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self._object_key(key),
+                "ResponseContentDisposition": content_disposition(os.path.basename(key)),
+            },
+            ExpiresIn=ttl or settings.FILE_URL_TTL,
+        )
+
+    @asynccontextmanager
+    async def local_copy(self, key: str) -> AsyncIterator[str]:
+        os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=".s3-", dir=settings.UPLOAD_DIR)
+        local_path = os.path.join(temp_dir, os.path.basename(key))
+        try:
+            await asyncio.to_thread(
+                self.client.download_file,
+                self.bucket,
+                self._object_key(key),
+                local_path,
+                Config=self.transfer_config,
+            )
+            yield local_path
+        finally:
+            await asyncio.to_thread(shutil.rmtree, temp_dir, True)
+
+
+# Служебные файлы, которые yt-dlp пишет рядом с результатом (--write-info-json)
+_SIDECAR_SUFFIXES = (".info.json",)
+
+
+def _remove_sidecar_files(path: str) -> None:
+    """Удаляет служебные файлы yt-dlp, относящиеся к файлу path"""
+    stem = os.path.splitext(path)[0]
+    for suffix in _SIDECAR_SUFFIXES:
+        try:
+            os.remove(stem + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_empty_parent(path: str, root: str) -> None:
+    """Удаляет директорию загрузки, если в ней не осталось файлов"""
+    parent = os.path.dirname(path)
+    if os.path.realpath(parent) == os.path.realpath(root):
+        return
+    try:
+        os.rmdir(parent)
+    except OSError:
+        pass
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    """
+    Возвращает хранилище, выбранное настройкой STORAGE_BACKEND (local или s3)
+    """
+    global _storage
+
+    if _storage is None:
+        if settings.STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        else:
+            _storage = LocalStorage()
+
+    return _storage
+
+
+def file_url(file_path: str, ttl: Optional[int] = None) -> str:
+    """Ссылка на скачивание файла по его логическому пути (Download.file_path)"""
+    return get_storage().url(storage_key(file_path), ttl)
@@ -0,0 +1,352 @@
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+from redis.exceptions import RedisError
+from sqlalchemy import update
+
+from app.core.config import settings
+from app.models.download import Download, DownloadStatus
+from app.services.storage import get_storage, storage_key, logical_path, file_url
+from app.utils.database import AsyncSessionLocal
+from app.utils.metrics import metrics
+from app.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Индекс файлов в хранилище:
+#   storage:files - ключ файла -> {"size": ..., "user": ...}
+#   storage:lru - ключ файла со временем последней выдачи файла или ссылки на него (score)
+#   storage:bytes:total и storage:bytes:users - занятый объем всего и по пользователям
+#   storage:reservations - резервы места под выполняющиеся загрузки ("<id>:<bytes>", score - срок действия)
+FILES_KEY = "storage:files"
+LRU_KEY = "storage:lru"
+TOTAL_KEY = "storage:bytes:total"
+USERS_KEY = "storage:bytes:users"
+RESERVATIONS_KEY = "storage:reservations"
+
+# Добавление файла в индекс; повторная запись того же ключа заменяет старую
+_RECORD_SCRIPT = """
+local old = redis.call('hget', KEYS[1], ARGV[1])
+if old then
+    local m = cjson.decode(old)
+    redis.call('decrby', KEYS[3], m.size)
+    if m.user then redis.call('hincrby', KEYS[4], m.user, -m.size) end
+end
+redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+redis.call('zadd', KEYS[2], ARGV[3], ARGV[1])
+local size = tonumber(ARGV[4])
+redis.call('incrby', KEYS[3], size)
+if ARGV[5] ~= '' then redis.call('hincrby', KEYS[4], ARGV[5], size) end
+return size
+"""
+
+# Удаление файла из индекса; возвращает его размер или -1, если файла в индексе нет
+_FORGET_SCRIPT = """
+local meta = redis.call('hget', KEYS[1], ARGV[1])
+if not meta then return -1 end
+local m = cjson.decode(meta)
+redis.call('hdel', KEYS[1], ARGV[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+redis.call('decrby', KEYS[3], m.size)
+if m.user then redis.call('hincrby', KEYS[4], m.user, -m.size) end
+return m.size
+"""
+
+
+class StorageFullError(Exception):
+    """Места в хранилище не хватит даже после вытеснения файлов"""
+
+    def __init__(self, required: int, available: int):
+        super().__init__(f"Storage is full: {required} bytes required, {available} bytes available")
+        self.required = required
+        self.available = available
+
+
+class StorageManager:
+    """
+    Учет занятого места и вытеснение файлов по водяным знакам
+
+    Размер каждого готового файла записывается в индекс Redis вместе с
+    владельцем, поэтому объем по пользователям и общий объем известны без
+    обхода диска. Когда заполнение превышает STORAGE_HIGH_WATERMARK,
+    удаляются файлы, которые дольше всего не выдавались, пока заполнение не
+    опустится до STORAGE_LOW_WATERMARK. Перед загрузкой под нее резервируется
+    YTDLP_MAX_FILESIZE (больше yt-dlp не скачает); если места не хватит даже
+    после вытеснения, загрузка отклоняется заранее, а не падает на середине.
+
+    Емкость - STORAGE_MAX_BYTES, а если она не задана, размер тома UPLOAD_DIR
+    (для S3 без STORAGE_MAX_BYTES ограничения не действуют). Без Redis
+    индекс не ведется и проверяется только свободное место на диске.
+    """
+
+    @property
+    def storage(self):
+        return get_storage()
+
+    async def _capacity(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns:
+            (емкость, занято) в байтах или None, если емкость не ограничена
+        """
+        if settings.STORAGE_MAX_BYTES:
+            return settings.STORAGE_MAX_BYTES, await self.total_bytes()
+
+        if self.storage.name != "local":
+            return None
+
+        usage = await asyncio.to_thread(shutil.disk_usage, settings.UPLOAD_DIR)
+        return usage.total, usage.used
+
+    async def total_bytes(self) -> int:
+        redis = get_redis()
+        if redis is None:
+            return 0
+        return int(await redis.get(TOTAL_KEY) or 0)
+
+    async def user_bytes(self, user_id: int) -> int:
+        redis = get_redis()
+        if redis is None:
+            return 0
+        return int(await redis.hget(USERS_KEY, str(user_id)) or 0)
+
+    async def usage(self) -> Dict[str, Any]:
+        """Сводка для мониторинга"""
+        capacity = await self._capacity()
+        return {
+            "backend": self.storage.name,
+            "indexed_bytes": await self.total_bytes(),
+            "capacity_bytes": capacity[0] if capacity else None,
+            "used_bytes": capacity[1] if capacity else None,
+            "reserved_bytes": await self._reserved_bytes(),
+        }
+
+    async def record(self, file_path: str, size: int, user_id: Optional[int] = None) -> None:
+        """
+        Добавляет сохраненный файл в индекс и применяет квоту пользователя
+        """
+        redis = get_redis()
+        if redis is None:
+            return
+
+        key = storage_key(file_path)
+        # Без ключа user для анонимных файлов: null из cjson в Lua считается истиной
+        meta = {"size": size}
+        if user_id is not None:
+            meta["user"] = str(user_id)
+        try:
+            await redis.eval(
+                _RECORD_SCRIPT, 4, FILES_KEY, LRU_KEY, TOTAL_KEY, USERS_KEY,
+                key, json.dumps(meta), time.time(), size, str(user_id) if user_id is not None else ""
+            )
+        except RedisError as e:
+            logger.warning(f"Failed to record {key} in storage index: {str(e)}")
+            return
+
+        if user_id is not None and settings.STORAGE_USER_MAX_BYTES:
+            excess = await self.user_bytes(user_id) - settings.STORAGE_USER_MAX_BYTES
+            if excess > 0:
+                await self.evict(excess, user_id=user_id, exclude={key})
+
+    async def touch(self, file_path: str) -> None:
+        """Отмечает выдачу файла (файл переходит в конец очереди вытеснения)"""
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.zadd(LRU_KEY, {storage_key(file_path): time.time()}, xx=True)
+        except RedisError as e:
+            logger.debug(f"Failed to touch {file_path} in storage index: {str(e)}")
+
+    async def issue_url(self, file_path: str, ttl: Optional[int] = None) -> str:
+        """
+        Ссылка на скачивание файла; выдача ссылки отмечается как выдача файла
+
+        При FILE_DELIVERY_MODE=accel и STORAGE_BACKEND=s3 файл по ссылке отдает
+        nginx или хранилище без обращения к backend, поэтому очередь вытеснения
+        упорядочивается по последней выдаче ссылки, а не по скачиванию.
+        """
+        await self.touch(file_path)
+        return file_url(file_path, ttl)
+
+    async def forget(self, file_path: str) -> Optional[int]:
+        """
+        Убирает удаленный файл из индекса
+
+        Returns:
+            Размер файла или None, если его не было в индексе
+        """
+        redis = get_redis()
+        if redis is None:
+            return None
+        try:
+            size = await redis.eval(_FORGET_SCRIPT, 4, FILES_KEY, LRU_KEY, TOTAL_KEY, USERS_KEY, storage_key(file_path))
+        except RedisError as e:
+            logger.warning(f"Failed to remove {file_path} from storage index: {str(e)}")
+            return None
+        return int(size) if int(size) >= 0 else None
+
+    async def evict(
+        self,
+        bytes_needed: int,
+        user_id: Optional[int] = None,
+        exclude: Optional[set] = None
+    ) -> Dict[str, int]:
+        """
+        Удаляет давно не выдававшиеся файлы, пока не освободится bytes_needed байт
+
+        Args:
+            bytes_needed: Сколько байт освободить
+            user_id: Вытеснять только файлы этого пользователя (квота)
+            exclude: Ключи файлов, которые удалять нельзя
+        """
+        redis = get_redis()
+        stats = {"evicted": 0, "freed_bytes": 0, "errors": 0}
+        if redis is None or bytes_needed <= 0:
+            return stats
+
+        exclude = exclude or set()
+        batch_size = settings.STORAGE_EVICTION_BATCH
+        offset = 0
+
+        while stats["freed_bytes"] < bytes_needed:
+            keys = await redis.zrange(LRU_KEY, offset, offset + batch_size - 1)
+            if not keys:
+                break
+
+            metas = await redis.hmget(FILES_KEY, keys)
+            evicted_paths: List[str] = []
+            for key, meta in zip(keys, metas):
+                if stats["freed_bytes"] >= bytes_needed:
+                    break
+                info = json.loads(meta) if meta else {}
+                if key in exclude or (user_id is not None and info.get("user") != str(user_id)):
+                    offset += 1
+                    continue
+
+                try:
+                    await self.storage.delete(key)
+                except Exception as e:
+                    stats["errors"] += 1
+                    offset += 1
+                    logger.error(f"Failed to evict {key}: {str(e)}")
+                    continue
+
+                freed = await self.forget(logical_path(key))
+                if freed is None:
+                    # Индекс не обновился - не выбираем этот ключ повторно
+                    offset += 1
+                stats["evicted"] += 1
+                stats["freed_bytes"] += freed or 0
+                evicted_paths.append(logical_path(key))
+
+            if evicted_paths:
+                await self._detach_downloads(evicted_paths)
+            if len(keys) < batch_size and not evicted_paths:
+                break
+
+        if stats["evicted"]:
+            metrics.inc("storage_evicted_files", stats["evicted"])
+            logger.info(f"Storage eviction: {stats}")
+        return stats
+
+    async def _detach_downloads(self, file_paths: List[str]) -> None:
+        """Помечает загрузки с вытесненными файлами как удаленные"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Download)
+                .where(Download.file_path.in_(file_paths))
+                .values(status=DownloadStatus.REMOVED, file_path=None)
+            )
+            await db.commit()
+
+    async def enforce(self) -> Dict[str, int]:
+        """
+        Вытесняет файлы, если заполнение выше STORAGE_HIGH_WATERMARK,
+        до уровня STORAGE_LOW_WATERMARK
+        """
+        capacity = await self._capacity()
+        if capacity is None:
+            return {"evicted": 0, "freed_bytes": 0, "errors": 0}
+
+        total, used = capacity
+        used += await self._reserved_bytes()
+        if used <= total * settings.STORAGE_HIGH_WATERMARK:
+            return {"evicted": 0, "freed_bytes": 0, "errors": 0}
+        return await self.evict(int(used - total * settings.STORAGE_LOW_WATERMARK))
+
+    async def _reserved_bytes(self) -> int:
+        redis = get_redis()
+        if redis is None:
+            return 0
+        now = time.time()
+        try:
+            await redis.zremrangebyscore(RESERVATIONS_KEY, "-inf", now)
+            members = await redis.zrangebyscore(RESERVATIONS_KEY, now, "+inf")
+        except RedisError as e:
+            logger.warning(f"Failed to read storage reservations: {str(e)}")
+            return 0
+        return sum(int(member.rsplit(":", 1)[1]) for member in members)
+
+    @asynccontextmanager
+    async def reserve(self, expected_bytes: Optional[int] = None) -> AsyncIterator[None]:
+        """
+        Резервирует место под загрузку на время ее выполнения
+
+        Резерв виден всем процессам API и воркерам и истекает сам, если
+        процесс упал, не сняв его.
+
+        Args:
+            expected_bytes: Ожидаемый размер файла (по умолчанию YTDLP_MAX_FILESIZE)
+
+        Raises:
+            StorageFullError: Если места не хватит даже после вытеснения
+        """
+        expected_bytes = expected_bytes or settings.YTDLP_MAX_FILESIZE
+        redis = get_redis()
+        member = f"{uuid.uuid4().hex}:{expected_bytes}"
+
+        if redis is not None:
+            try:
+                await redis.zadd(RESERVATIONS_KEY, {member: time.time() + settings.DOWNLOAD_TASK_TIME_LIMIT})
+            except RedisError as e:
+                # Без резерва загрузка все равно возможна, проверяется только свободное место
+                logger.warning(f"Failed to reserve storage: {str(e)}")
+                redis = None
+        try:
+            await self._ensure_space(expected_bytes if redis is None else 0)
+            yield
+        finally:
+            if redis is not None:
+                try:
+                    await asyncio.shield(redis.zrem(RESERVATIONS_KEY, member))
+                except RedisError as e:
+                    logger.warning(f"Failed to release storage reservation: {str(e)}")
+
+    async def _ensure_space(self, pending_bytes: int) -> None:
+        """
+        Проверяет, что с учетом резервов заполнение не превысит емкость,
+        при необходимости вытесняя файлы
+        """
+        capacity = await self._capacity()
+        if capacity is None:
+            return
+
+        total, used = capacity
+        projected = used + pending_bytes + await self._reserved_bytes()
+        if projected > total * settings.STORAGE_HIGH_WATERMARK:
+            await self.evict(int(projected - total * settings.STORAGE_LOW_WATERMARK))
+            total, used = await self._capacity()
+            projected = used + pending_bytes + await self._reserved_bytes()
+
+        if projected > total:
+            metrics.inc("storage_full_rejections")
+            raise StorageFullError(projected - used, total - used)
+
+
+storage_manager = StorageManager()
@@ -0,0 +1,208 @@
+import os
+import json
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Set
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Способы конвертации, от самого дешевого к самому дорогому
+MODE_REMUX = "remux"  # Смена контейнера, все потоки копируются
+MODE_EXTRACT_AUDIO = "extract_audio"  # Звуковая дорожка копируется без видео
+MODE_COPY_VIDEO = "copy_video"  # Видео копируется, перекодируется только звук
+MODE_TRANSCODE = "transcode"  # Полное перекодирование
+
+# Кодеки, которые можно без перекодирования положить в контейнер (None - любые)
+VIDEO_CONTAINER_CODECS: Dict[str, Optional[Set[str]]] = {
+    "mp4": {"h264", "hevc", "av1"},
+    "mkv": None,
+    "avi": {"h264", "mpeg4"},
+}
+AUDIO_CONTAINER_CODECS: Dict[str, Optional[Set[str]]] = {
+    "mp4": {"aac", "mp3"},
+    "mkv": None,
+    "avi": {"mp3", "ac3"},
+    "mp3": {"mp3"},
+}
+
+# Параметры перекодирования по умолчанию для каждого формата
+AUDIO_ENCODERS: Dict[str, List[str]] = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    "mp4": ["-c:a", "aac", "-b:a", "192k"],
+    "mkv": ["-c:a", "aac", "-b:a", "192k"],
+    "avi": ["-c:a", "libmp3lame", "-b:a", "192k"],
+}
+VIDEO_ENCODER = ["-c:v", "libx264"]
+
+# Пресеты перекодирования видео: скорость libx264 и качество (CRF)
+PRESET_FAST = "fast"
+PRESET_QUALITY = "quality"
+VIDEO_PRESETS: Dict[str, List[str]] = {
+    PRESET_FAST: ["-preset", "veryfast", "-crf", "23"],
+    PRESET_QUALITY: ["-preset", "medium", "-crf", "20"],
+}
+
+
+@dataclass
+class MediaInfo:
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    duration: Optional[float] = None
+
+
+@dataclass
+class ConversionPlan:
+    mode: str
+    args: List[str] = field(default_factory=list)
+    threads: Optional[int] = None  # Значение -threads, None - выбор ffmpeg (для копирования потоков)
+
+
+def cpu_count() -> int:
+    """Число ядер, доступных процессу (с учетом привязки к CPU в контейнере)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def convert_concurrency() -> int:
+    """
+    Число процессов воркера конвертаций (CONVERT_WORKER_CONCURRENCY)
+
+    По умолчанию половина ядер: каждое перекодирование получает два потока,
+    а не один, как при процессе на ядро, и одиночная задача на простаивающей
+    машине не упирается в одно ядро. Должно совпадать с --concurrency
+    воркера в docker-compose.yml.
+    """
+    return settings.CONVERT_WORKER_CONCURRENCY or max(1, cpu_count() // 2)
+
+
+def video_threads() -> int:
+    """
+    Потоки ffmpeg на одно перекодирование видео
+
+    Ядра делятся поровну между процессами воркера конвертаций
+    (convert_concurrency), чтобы одновременные задачи не вытесняли друг друга.
+    """
+    if settings.CONVERT_VIDEO_THREADS:
+        return settings.CONVERT_VIDEO_THREADS
+    return max(1, cpu_count() // convert_concurrency())
+
+
+def _video_encoder(preset: Optional[str]) -> List[str]:
+    return [*VIDEO_ENCODER, *VIDEO_PRESETS.get(preset or settings.CONVERT_DEFAULT_PRESET, [])]
+
+
+async def probe_media(path: str) -> Optional[MediaInfo]:
+    """
+    Кодеки первых видео- и аудиопотока файла через ffprobe
+
+    Возвращает None, если ffprobe не установлен или не смог прочитать файл.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error",
+            "-show_entries", "stream=codec_type,codec_name:format=duration",
+            "-of", "json", path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        logger.warning("ffprobe not found, conversions fall back to transcoding")
+        return None
+
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=settings.FFPROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        logger.warning(f"ffprobe timed out for {path}")
+        return None
+
+    if process.returncode != 0:
+        logger.warning(f"ffprobe failed for {path}: {stderr.decode(errors='replace').strip()}")
+        return None
+
+    try:
+        data = json.loads(stdout)
+    except ValueError:
+        return None
+
+    info = MediaInfo()
+    for stream in data.get("streams", []):
+        if stream.get("codec_type") == "video" and info.video_codec is None:
+            # Обложки в mp3/m4a тоже видеопоток, но перекодировать их незачем
+            if stream.get("codec_name") not in ("mjpeg", "png"):
+                info.video_codec = stream.get("codec_name")
+        elif stream.get("codec_type") == "audio" and info.audio_codec is None:
+            info.audio_codec = stream.get("codec_name")
+
+    try:
+        info.duration = float(data.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        pass
+    return info
+
+
+def _compatible(codec: Optional[str], allowed: Optional[Set[str]]) -> bool:
+    return codec is not None and (allowed is None or codec in allowed)
+
+
+def transcode_plan(output_format: str, preset: Optional[str] = None) -> ConversionPlan:
+    """Полное перекодирование (прежнее поведение convert_video)"""
+    if output_format == "mp3":
+        # Кодирование звука однопоточное
+        return ConversionPlan(MODE_TRANSCODE, ["-vn", *AUDIO_ENCODERS["mp3"]], threads=1)
+    if output_format in VIDEO_CONTAINER_CODECS:
+        return ConversionPlan(
+            MODE_TRANSCODE,
+            [*_video_encoder(preset), *AUDIO_ENCODERS[output_format]],
+            threads=video_threads()
+        )
+    return ConversionPlan(MODE_TRANSCODE, [], threads=video_threads())
+
+
+def plan_conversion(info: Optional[MediaInfo], output_format: str, preset: Optional[str] = None) -> ConversionPlan:
+    """
+    Выбирает самый дешевый способ получить output_format из файла с кодеками info
+
+    Потоки, кодек которых допустим в целевом контейнере, копируются (-c copy),
+    перекодируется только то, что иначе в контейнер не поместить. preset
+    (fast или quality) влияет только на перекодирование видео.
+    """
+    if info is None or not settings.CONVERT_STREAM_COPY_ENABLED:
+        return transcode_plan(output_format, preset)
+
+    if output_format == "mp3":
+        if info.audio_codec == "mp3":
+            return ConversionPlan(MODE_EXTRACT_AUDIO, ["-vn", "-map", "0:a:0", "-c:a", "copy"])
+        return transcode_plan(output_format, preset)
+
+    if output_format not in VIDEO_CONTAINER_CODECS:
+        return transcode_plan(output_format, preset)
+
+    # Берем по одному видео- и аудиопотоку: субтитры и данные часто несовместимы с контейнером
+    streams = ["-map", "0:v:0?", "-map", "0:a:0?"]
+    if output_format == "mp4":
+        streams += ["-movflags", "+faststart"]
+
+    video_ok = info.video_codec is None or _compatible(info.video_codec, VIDEO_CONTAINER_CODECS[output_format])
+    audio_ok = info.audio_codec is None or _compatible(info.audio_codec, AUDIO_CONTAINER_CODECS[output_format])
+    if not video_ok:
+        return ConversionPlan(
+            MODE_TRANSCODE,
+            [*streams, *_video_encoder(preset), *AUDIO_ENCODERS[output_format]],
+            threads=video_threads()
+        )
+
+    if output_format == "mp4" and info.video_codec == "hevc":
+        # Без тега hvc1 HEVC в mp4 не воспроизводится в Safari и QuickTime
+        streams += ["-tag:v", "hvc1"]
+    if audio_ok:
+        return ConversionPlan(MODE_REMUX, [*streams, "-c", "copy"])
+    return ConversionPlan(
+        MODE_COPY_VIDEO, [*streams, "-c:v", "copy", *AUDIO_ENCODERS[output_format]], threads=1
+    )
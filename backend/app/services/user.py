@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
 from app.auth.password import get_password_hash, verify_password
+from app.services.principal_cache import invalidate_user, invalidate_principal
 
 
 class UserService:
@@ -57,6 +58,7 @@ class UserService:
             self.db.add(user)
             await self.db.commit()
             await self.db.refresh(user)
+            await invalidate_user(user.id)
             return user
         
         # Создаем нового пользователя
@@ -95,6 +97,7 @@ class UserService:
         self.db.add(user)
         await self.db.commit()
         await self.db.refresh(user)
+        await invalidate_user(user.id)
         
         return user
 
@@ -107,6 +110,7 @@ class UserService:
         
         await self.db.delete(user)
         await self.db.commit()
+        await invalidate_principal(user_id)
         
         return user
 
@@ -0,0 +1,193 @@
+import math
+import time
+import logging
+from typing import Optional
+
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.services.download_scheduler import SchedulerBusyError, TIER_ANONYMOUS, TIER_PAID
+from app.utils.metrics import metrics
+from app.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Очередь загрузок в воркерах Celery (общая для всех процессов API и воркеров):
+#   downloads:queue:backlog - задачи, поставленные в очередь и еще не получившие слот
+#     (участник - ID задачи Celery, score - время постановки)
+#   downloads:slots:all, downloads:slots:source:<платформа>, downloads:slots:user:<ключ> -
+#     выполняющиеся загрузки (участник - ID задачи, score - срок действия аренды)
+#   downloads:slots:unpaid - те же аренды загрузок пробных и анонимных пользователей
+#   downloads:slots:avg_job_seconds - скользящая оценка длительности загрузки
+BACKLOG_KEY = "downloads:queue:backlog"
+SLOTS_ALL_KEY = "downloads:slots:all"
+SLOTS_SOURCE_KEY = "downloads:slots:source:{source}"
+SLOTS_USER_KEY = "downloads:slots:user:{user}"
+SLOTS_UNPAID_KEY = "downloads:slots:unpaid"
+AVG_JOB_KEY = "downloads:slots:avg_job_seconds"
+
+# Слот выдается, только если не превышен ни один из лимитов; загрузки без платной
+# подписки (ARGV[7] = 0) не занимают зарезервированные слоты. Повторная доставка
+# задачи (acks_late), уже получившей слот, продлевает аренду
+_ACQUIRE_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    redis.call('zremrangebyscore', key, '-inf', ARGV[1])
+end
+local leases = {KEYS[1], KEYS[2], KEYS[3]}
+if ARGV[7] == '0' then
+    table.insert(leases, KEYS[4])
+end
+if not redis.call('zscore', KEYS[1], ARGV[2]) then
+    if redis.call('zcard', KEYS[1]) >= tonumber(ARGV[4])
+        or redis.call('zcard', KEYS[2]) >= tonumber(ARGV[5])
+        or redis.call('zcard', KEYS[3]) >= tonumber(ARGV[6])
+        or (ARGV[7] == '0' and redis.call('zcard', KEYS[4]) >= tonumber(ARGV[8])) then
+        return 0
+    end
+end
+for _, key in ipairs(leases) do
+    redis.call('zadd', key, ARGV[3], ARGV[2])
+end
+return 1
+"""
+
+
+class WorkerScheduler:
+    """
+    Ограничения загрузок, поставленных в очередь Celery (режим queued)
+
+    Планировщик download_scheduler действует только внутри процесса API, поэтому
+    для воркеров те же лимиты (общий, по платформам и на пользователя) ведутся
+    в Redis. Задача, не получившая слот, возвращается в очередь с задержкой и не
+    занимает процесс воркера. Приоритет брокера только меняет порядок задач в
+    очереди, поэтому reserved_slots слотов доступны лишь платным подписчикам:
+    длинные анонимные загрузки не занимают все процессы воркера. При постановке
+    в очередь проверяется ее глубина: сверх DOWNLOAD_MAX_QUEUE (вдвое больше
+    для платных подписок) API отвечает 429.
+    Без Redis ограничения не действуют: число загрузок ограничено только
+    числом процессов воркера.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        per_user_limit: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        reserved_slots: Optional[int] = None
+    ):
+        self.max_concurrent = max_concurrent or settings.DOWNLOAD_WORKER_MAX_CONCURRENT
+        self.source_limits = settings.DOWNLOAD_SOURCE_LIMITS
+        self.per_user_limit = per_user_limit or settings.DOWNLOAD_MAX_PER_USER
+        self.max_queue = max_queue if max_queue is not None else settings.DOWNLOAD_MAX_QUEUE
+        reserved = reserved_slots if reserved_slots is not None else settings.DOWNLOAD_PAID_RESERVED_SLOTS
+        # Хотя бы один слот остается доступным всем уровням
+        self.reserved_slots = max(0, min(reserved, self.max_concurrent - 1))
+
+    def _source_limit(self, source_type: str) -> int:
+        return self.source_limits.get(source_type, self.source_limits.get("other", self.max_concurrent))
+
+    async def admit(self, task_id: str, tier: str = TIER_ANONYMOUS) -> None:
+        """
+        Регистрирует задачу в очереди, если очередь не переполнена
+
+        Raises:
+            SchedulerBusyError: Если в очереди больше задач, чем допускает уровень подписки
+        """
+        redis = get_redis()
+        if redis is None:
+            return
+
+        now = time.time()
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.zremrangebyscore(BACKLOG_KEY, "-inf", now - settings.DOWNLOAD_QUEUE_WAIT_TIMEOUT)
+                pipe.zcard(BACKLOG_KEY)
+                pipe.get(AVG_JOB_KEY)
+                _, depth, avg_job_seconds = await pipe.execute()
+
+            max_queue = self.max_queue * 2 if tier == TIER_PAID else self.max_queue
+            if depth >= max_queue:
+                metrics.inc("download_worker_queue_rejected", tier=tier)
+                avg = float(avg_job_seconds or settings.DOWNLOAD_AVG_JOB_SECONDS)
+                waves = (depth + 1) / max(1, self.max_concurrent)
+                raise SchedulerBusyError(max(1, math.ceil(waves * avg)))
+
+            await redis.zadd(BACKLOG_KEY, {task_id: now})
+        except RedisError as e:
+            logger.warning(f"Failed to check download queue depth: {str(e)}")
+
+    async def try_acquire(self, task_id: str, source_type: str, user_key: str, tier: str = TIER_ANONYMOUS) -> bool:
+        """
+        Пытается занять слот загрузки в воркере
+
+        Returns:
+            True, если слот получен (задача покидает очередь), иначе False
+        """
+        redis = get_redis()
+        if redis is None:
+            return True
+
+        now = time.time()
+        try:
+            acquired = await redis.eval(
+                _ACQUIRE_SCRIPT, 4,
+                SLOTS_ALL_KEY,
+                SLOTS_SOURCE_KEY.format(source=source_type),
+                SLOTS_USER_KEY.format(user=user_key),
+                SLOTS_UNPAID_KEY,
+                now, task_id, now + settings.DOWNLOAD_TASK_TIME_LIMIT,
+                self.max_concurrent, self._source_limit(source_type), self.per_user_limit,
+                1 if tier == TIER_PAID else 0, self.max_concurrent - self.reserved_slots
+            )
+            if acquired:
+                await redis.zrem(BACKLOG_KEY, task_id)
+            return bool(acquired)
+        except RedisError as e:
+            # Лимиты не должны останавливать загрузки при недоступном Redis
+            logger.warning(f"Failed to acquire download slot: {str(e)}")
+            return True
+
+    async def release(
+        self,
+        task_id: str,
+        source_type: str,
+        user_key: str,
+        duration: Optional[float] = None
+    ) -> None:
+        """
+        Освобождает слот загрузки и обновляет оценку длительности задачи
+        """
+        redis = get_redis()
+        if redis is None:
+            return
+
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(SLOTS_ALL_KEY, task_id)
+                pipe.zrem(SLOTS_SOURCE_KEY.format(source=source_type), task_id)
+                pipe.zrem(SLOTS_USER_KEY.format(user=user_key), task_id)
+                pipe.zrem(SLOTS_UNPAID_KEY, task_id)
+                pipe.get(AVG_JOB_KEY)
+                *_, avg_job_seconds = await pipe.execute()
+
+            if duration is not None:
+                avg = float(avg_job_seconds or settings.DOWNLOAD_AVG_JOB_SECONDS)
+                await redis.set(AVG_JOB_KEY, 0.9 * avg + 0.1 * duration)
+        except RedisError as e:
+            logger.warning(f"Failed to release download slot: {str(e)}")
+
+    async def forget(self, task_id: str) -> None:
+        """
+        Убирает задачу из очереди, если она завершилась, не получив слот
+        """
+        redis = get_redis()
+        if redis is None:
+            return
+
+        try:
+            await redis.zrem(BACKLOG_KEY, task_id)
+        except RedisError as e:
+            logger.warning(f"Failed to remove task from download queue: {str(e)}")
+
+
+worker_scheduler = WorkerScheduler()
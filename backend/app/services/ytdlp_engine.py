@@ -0,0 +1,243 @@
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Синхронный клиент Redis процесса пула для публикации прогресса
+_worker_redis = None
+
+
+def _worker_init() -> None:
+    """
+    Прогревает процесс пула: импортирует yt-dlp и регистрирует экстракторы,
+    чтобы первый вызов в процессе не платил за это
+    """
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
+        ydl.get_info_extractor("Generic")
+
+
+def _extract_info(url: str, opts: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Получает информацию о видео (выполняется в процессе пула)
+    """
+    import yt_dlp
+
+    try:
+        with yt_dlp.YoutubeDL({**opts, "skip_download": True}) as ydl:
+            info = ydl.extract_info(url, download=False)
+            return {"info": ydl.sanitize_info(info)}
+    except yt_dlp.utils.DownloadError as e:
+        return {"error": str(e)}
+
+
+def _download_hooks(
+    progress_id: Optional[int],
+    deadline: Optional[float],
+    cancel_event: Optional[Any] = None
+) -> Dict[str, list]:
+    """
+    Создает hooks yt-dlp для загрузки в процессе пула
+
+    Hooks публикуют прогресс загрузки progress_id в Redis и прерывают
+    загрузку, если истек deadline (time.time()), установлен cancel_event
+    (отмена вызывающей корутины) или запрошена отмена через DELETE /downloads/{id}.
+    """
+    global _worker_redis
+    import redis
+    from yt_dlp.utils import DownloadCancelled
+    from app.services.progress import publish_progress_sync, cancel_key
+
+    if progress_id is not None and settings.REDIS_URL and _worker_redis is None:
+        _worker_redis = redis.Redis.from_url(settings.REDIS_URL)
+    redis_client = _worker_redis if progress_id is not None else None
+
+    last = {"status": None, "at": 0.0}
+
+    def tick(event: Dict[str, Any]) -> None:
+        if deadline is not None and time.time() > deadline:
+            raise DownloadCancelled("wall-clock timeout")
+
+        now = time.monotonic()
+        if event["status"] == last["status"] and now - last["at"] < settings.DOWNLOAD_PROGRESS_INTERVAL:
+            return
+        last.update(status=event["status"], at=now)
+        if cancel_event is not None and cancel_event.is_set():
+            raise DownloadCancelled("cancelled by caller")
+        if redis_client is None:
+            return
+
+        try:
+            if redis_client.exists(cancel_key(progress_id)):
+                raise DownloadCancelled("cancelled by user")
+            publish_progress_sync(redis_client, progress_id, event)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to publish progress for download {progress_id}: {str(e)}")
+
+    def on_download(d: Dict[str, Any]) -> None:
+        downloaded = d.get("downloaded_bytes")
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        tick({
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": total,
+            "speed": d.get("speed"),
+            "eta": d.get("eta"),
+            "percent": round(min(100.0, downloaded * 100 / total), 1) if downloaded and total else None,
+        })
+
+    def on_postprocess(d: Dict[str, Any]) -> None:
+        tick({"status": "postprocessing", "postprocessor": d.get("postprocessor"), "stage": d.get("status")})
+
+    return {"progress_hooks": [on_download], "postprocessor_hooks": [on_postprocess]}
+
+
+def _download(
+    url: str,
+    opts: Dict[str, Any],
+    progress_id: Optional[int] = None,
+    deadline: Optional[float] = None,
+    cancel_event: Optional[Any] = None
+) -> Dict[str, Any]:
+    """
+    Скачивает видео (выполняется в процессе пула)
+
+    Returns:
+        Словарь с title, duration и filename, как в выводе --print у CLI
+    """
+    import yt_dlp
+
+    opts = {**opts, **_download_hooks(progress_id, deadline, cancel_event)}
+
+    try:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            requested = info.get("requested_downloads") or [{}]
+            filename = requested[0].get("filepath") or ydl.prepare_filename(info)
+            return {
+                "title": info.get("title", ""),
+                "duration": info.get("duration"),
+                "filename": filename,
+            }
+    except (yt_dlp.utils.DownloadError, yt_dlp.utils.DownloadCancelled) as e:
+        return {"error": str(e)}
+
+
+class YtDlpEngine:
+    """
+    Пул прогретых процессов, вызывающих yt_dlp.YoutubeDL напрямую
+
+    Избавляет каждый вызов от запуска интерпретатора и импорта yt-dlp.
+    Процессы создаются методом spawn (в API-процессе работают потоки)
+    и перезапускаются после YTDLP_POOL_MAX_TASKS_PER_CHILD вызовов.
+    Флаги отмены загрузок передаются в процессы пула через multiprocessing.Manager.
+    """
+
+    def __init__(self, pool_size: Optional[int] = None, max_tasks_per_child: Optional[int] = None):
+        self.pool_size = pool_size or settings.YTDLP_POOL_SIZE
+        self.max_tasks_per_child = max_tasks_per_child or settings.YTDLP_POOL_MAX_TASKS_PER_CHILD
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._manager = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_worker_init,
+                max_tasks_per_child=self.max_tasks_per_child,
+            )
+        return self._pool
+
+    def _get_manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager
+
+    async def _run(self, fn, *args, cancel_event: Optional[Any] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._get_pool(), fn, *args)
+            if cancel_event is None:
+                return await future
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Процесс пула продолжает загрузку, пока hook не увидит флаг отмены.
+                # Вызывающий код (слот планировщика, доля полосы) освобождается
+                # только после того, как процесс действительно остановился
+                cancel_event.set()
+                await asyncio.wait({future})
+                raise
+        except BrokenProcessPool as e:
+            # Процесс пула упал (например, OOM) - пересоздаем пул для следующих вызовов
+            logger.error(f"yt-dlp engine pool is broken, recreating: {str(e)}")
+            self._shutdown_pool(wait=False)
+            return {"error": f"yt-dlp engine failure: {str(e)}"}
+
+    async def extract_info(self, url: str, opts: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Получает информацию о видео
+
+        Returns:
+            {"info": <словарь yt-dlp>} или {"error": <текст ошибки>}
+        """
+        return await self._run(_extract_info, url, opts)
+
+    async def download(
+        self,
+        url: str,
+        opts: Dict[str, Any],
+        progress_id: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Скачивает видео с опциями YoutubeDL
+
+        Процесс пула нельзя прервать извне, поэтому таймаут и отмена
+        проверяются в progress hooks внутри него, а зависание сети
+        ограничивается опцией socket_timeout. При отмене корутины процессу
+        передается флаг отмены, и корутина завершается только вместе с ним.
+
+        Args:
+            url: URL видео
+            opts: Опции YoutubeDL
+            progress_id: ID загрузки, прогресс которой публикуется в Redis
+            timeout: Максимальное время загрузки в секундах
+
+        Returns:
+            {"title", "duration", "filename"} или {"error": <текст ошибки>}
+        """
+        deadline = time.time() + timeout if timeout else None
+        cancel_event = self._get_manager().Event()
+        return await self._run(_download, url, opts, progress_id, deadline, cancel_event, cancel_event=cancel_event)
+
+    def warm_up(self) -> None:
+        """
+        Запускает все процессы пула заранее
+        """
+        pool = self._get_pool()
+        for _ in range(self.pool_size):
+            pool.submit(int)
+
+    def _shutdown_pool(self, wait: bool = True) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._shutdown_pool(wait=wait)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+
+ytdlp_engine = YtDlpEngine()
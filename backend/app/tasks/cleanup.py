@@ -1,79 +1,225 @@
-import os
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy import select, update, func
 
 from app.worker import celery
-from app.models.download import Download
-from app.utils.database import get_async_session
+from app.models.download import Download, DownloadStatus
+from app.utils.database import AsyncSessionLocal
+from app.utils.worker_runtime import run_async
+from app.utils.redis import get_redis
 from app.core.config import settings
+from app.services.download_cache import download_cache, conversion_cache
+from app.services.storage import get_storage, storage_key
+from app.services.storage_manager import storage_manager
+from app.services.orphans import reconcile_orphans
 
 logger = logging.getLogger(__name__)
 
+# Последний обработанный ID: прерванная очистка продолжается с него
+CHECKPOINT_KEY = "cleanup:remove_old_files:checkpoint"
+CHECKPOINT_TTL = 2 * 24 * 60 * 60
+
+@celery.task(name="app.tasks.cleanup.enforce_storage_limits")
+def enforce_storage_limits():
+    """
+    Вытесняет давно не выдававшиеся файлы, если хранилище заполнено выше
+    STORAGE_HIGH_WATERMARK (между ежедневными очистками)
+    """
+    stats = run_async(storage_manager.enforce())
+    usage = run_async(storage_manager.usage())
+    logger.info(f"Storage limits enforced: {stats}, usage: {usage}")
+    return {"status": "success", **stats, "usage": usage}
+
+
+@celery.task(name="app.tasks.cleanup.reconcile_orphan_files")
+def reconcile_orphan_files(dry_run: bool = False, action: Optional[str] = None):
+    """
+    Удаляет или переносит в карантин файлы UPLOAD_DIR, на которые не ссылается
+    ни одна запись о скачивании
+
+    Args:
+        dry_run: Только подсчитать файлы-сироты и их объем
+        action: "delete" или "quarantine" (по умолчанию ORPHAN_ACTION)
+    """
+    stats = run_async(reconcile_orphans(dry_run=dry_run, action=action))
+    return {"status": "success", "dry_run": dry_run, **stats}
+
+
 @celery.task(name="app.tasks.cleanup.remove_old_files")
-def remove_old_files(days: int = 30):
+def remove_old_files(days: int = 30, dry_run: bool = False):
     """
     Удаляет файлы старше указанного количества дней
     и обновляет статус в базе данных
-    
+
     Args:
         days: Количество дней, после которых файлы считаются устаревшими
+        dry_run: Только подсчитать файлы и освобождаемый объем, ничего не удаляя
     """
-    logger.info(f"Starting cleanup of files older than {days} days")
-    
-    # Вызываем асинхронную функцию через синхронный интерфейс
-    import asyncio
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(_remove_old_files_async(days))
+    logger.info(f"Starting cleanup of files older than {days} days (dry_run={dry_run})")
+
+    # Корутина выполняется в event loop процесса воркера
+    return run_async(_remove_old_files_async(days, dry_run))
 
 
-async def _remove_old_files_async(days: int = 30):
+async def _fetch_batch(cutoff_date: datetime, after_id: int, max_id: int) -> List[Tuple[int, str]]:
+    """
+    Следующая пачка устаревших загрузок с файлами (keyset-пагинация по id)
+
+    Загружаются только id и путь файла, без ORM-объектов.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Download.id, Download.file_path)
+            .where(
+                Download.id > after_id,
+                Download.id <= max_id,
+                Download.created_at < cutoff_date,
+                Download.file_path.isnot(None),
+            )
+            .order_by(Download.id)
+            .limit(settings.CLEANUP_BATCH_SIZE)
+        )
+        return [(row.id, row.file_path) for row in result]
+
+
+async def _load_checkpoint() -> int:
+    redis = get_redis()
+    if redis is None:
+        return 0
+    try:
+        return int(await redis.get(CHECKPOINT_KEY) or 0)
+    except Exception as e:
+        logger.warning(f"Failed to read cleanup checkpoint: {str(e)}")
+        return 0
+
+
+async def _save_checkpoint(last_id: Optional[int]) -> None:
+    redis = get_redis()
+    if redis is None:
+        return
+    try:
+        if last_id is None:
+            await redis.delete(CHECKPOINT_KEY)
+        else:
+            await redis.set(CHECKPOINT_KEY, last_id, ex=CHECKPOINT_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to save cleanup checkpoint: {str(e)}")
+
+
+async def _remove_old_files_async(days: int = 30, dry_run: bool = False) -> Dict[str, Any]:
     """
     Асинхронная реализация задачи удаления старых файлов
-    
+
+    Записи обрабатываются пачками по CLEANUP_BATCH_SIZE: файлы пачки удаляются
+    параллельно (не больше CLEANUP_CONCURRENCY одновременно, файловые операции
+    в пуле потоков), затем статусы пачки обновляются одним UPDATE и фиксируются.
+    После каждой пачки ID сохраняется в Redis, и прерванная очистка
+    продолжается с него, а не с начала таблицы.
+
     Args:
         days: Количество дней, после которых файлы считаются устаревшими
+        dry_run: Только подсчитать файлы и освобождаемый объем
     """
     cutoff_date = datetime.utcnow() - timedelta(days=days)
-    
-    async for db in get_async_session():
-        try:
-            # Получаем все записи о скачиваниях старше cutoff_date
-            query = select(Download).where(Download.created_at < cutoff_date)
-            result = await db.execute(query)
-            old_downloads = result.scalars().all()
-            
-            logger.info(f"Found {len(old_downloads)} downloads older than {days} days")
-            
-            removed_count = 0
-            error_count = 0
-            
-            for download in old_downloads:
-                # Проверяем существование файла
-                if os.path.exists(download.file_path):
-                    try:
-                        # Удаляем файл
-                        os.remove(download.file_path)
-                        removed_count += 1
-                        
-                        # Обновляем статус в базе данных
-                        download.status = "removed"
-                        db.add(download)
-                    except Exception as e:
-                        error_count += 1
-                        logger.error(f"Error removing file {download.file_path}: {str(e)}")
-            
-            # Фиксируем изменения в БД
-            await db.commit()
-            
-            return {
-                "status": "success",
-                "removed_count": removed_count,
-                "error_count": error_count,
-                "total_found": len(old_downloads)
-            }
-            
-        except Exception as e:
-            logger.exception(f"Error during file cleanup: {str(e)}")
-            return {"status": "error", "message": str(e)} 
\ No newline at end of file
+    storage = get_storage()
+    semaphore = asyncio.Semaphore(settings.CLEANUP_CONCURRENCY)
+
+    stats = {
+        "total_found": 0,
+        "removed_count": 0,
+        "missing_count": 0,
+        "error_count": 0,
+        "reclaimable_bytes": 0,
+    }
+
+    async def remove_file(file_path: str) -> Tuple[str, int]:
+        async with semaphore:
+            key = storage_key(file_path)
+            size = await storage.size(key)
+            if size is None:
+                if not dry_run:
+                    await storage_manager.forget(file_path)
+                return "missing", 0
+            if dry_run:
+                return "found", size
+
+            await storage.delete(key)
+            await storage_manager.forget(file_path)
+            return "removed", size
+
+    try:
+        # Верхняя граница фиксируется заранее: новые записи в очистку не попадут
+        async with AsyncSessionLocal() as db:
+            max_id = await db.scalar(
+                select(func.max(Download.id)).where(Download.created_at < cutoff_date)
+            )
+
+        last_id = 0 if dry_run else await _load_checkpoint()
+        if last_id:
+            logger.info(f"Resuming cleanup after download {last_id}")
+
+        while max_id:
+            batch = await _fetch_batch(cutoff_date, last_id, max_id)
+            if not batch:
+                break
+
+            outcomes = await asyncio.gather(
+                *(remove_file(file_path) for _, file_path in batch), return_exceptions=True
+            )
+
+            processed_ids = []
+            for (download_id, file_path), outcome in zip(batch, outcomes):
+                if isinstance(outcome, Exception):
+                    # Запись остается с путем к файлу и будет обработана следующей очисткой
+                    stats["error_count"] += 1
+                    logger.error(f"Error removing file {file_path}: {str(outcome)}")
+                    continue
+
+                result, size = outcome
+                processed_ids.append(download_id)
+                stats["reclaimable_bytes"] += size
+                if result == "missing":
+                    stats["missing_count"] += 1
+                elif result == "removed":
+                    stats["removed_count"] += 1
+
+            stats["total_found"] += len(batch)
+            last_id = batch[-1][0]
+
+            if not dry_run:
+                if processed_ids:
+                    # Одна транзакция на пачку: таблица не блокируется на всю очистку
+                    async with AsyncSessionLocal() as db:
+                        await db.execute(
+                            update(Download)
+                            .where(Download.id.in_(processed_ids))
+                            .values(status=DownloadStatus.REMOVED, file_path=None)
+                        )
+                        await db.commit()
+                await _save_checkpoint(last_id)
+
+        if not dry_run:
+            await _save_checkpoint(None)
+
+        logger.info(f"Cleanup of downloads older than {days} days finished: {stats}")
+
+        if dry_run:
+            return {"status": "success", "dry_run": True, **stats}
+
+        # Освобождаем кэш загрузок: устаревшие записи и записи сверх бюджета
+        cache_stats = await asyncio.to_thread(
+            download_cache.evict, settings.DOWNLOAD_CACHE_MAX_AGE_DAYS
+        )
+        logger.info(f"Download cache eviction: {cache_stats}")
+        conversion_cache_stats = await asyncio.to_thread(
+            conversion_cache.evict, settings.CONVERT_CACHE_MAX_AGE_DAYS
+        )
+        logger.info(f"Conversion cache eviction: {conversion_cache_stats}")
+
+        return {"status": "success", **stats, "cache": cache_stats, "conversion_cache": conversion_cache_stats}
+
+    except Exception as e:
+        logger.exception(f"Error during file cleanup: {str(e)}")
+        return {"status": "error", "message": str(e), **stats}
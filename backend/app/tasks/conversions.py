@@ -0,0 +1,195 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+from typing import Optional
+from sqlalchemy.future import select
+
+from app.worker import celery
+from app.models.download import Download, DownloadStatus
+from app.utils.database import AsyncSessionLocal
+from app.utils.worker_runtime import run_async
+from app.services.downloader import VideoDownloader
+from app.services.progress import ProgressReporter, wait_for_cancel
+from app.services.storage import file_url
+from app.services.storage_manager import storage_manager, StorageFullError
+from app.services.download_scheduler import TIER_ANONYMOUS
+from app.utils.metrics import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@celery.task(
+    name="app.tasks.conversions.convert_download",
+    soft_time_limit=settings.CONVERT_TASK_SOFT_TIME_LIMIT,
+    time_limit=settings.CONVERT_TASK_TIME_LIMIT,
+    bind=True,
+)
+def convert_download(
+    self,
+    download_id: int,
+    input_path: str,
+    output_format: str,
+    user_id: Optional[int] = None,
+    preset: Optional[str] = None,
+    tier: str = TIER_ANONYMOUS,
+    enqueued_at: Optional[float] = None
+):
+    """
+    Конвертирует файл в воркере очереди конвертаций и сохраняет статус в записи Download
+
+    Задача выполняется отдельным пулом (celery worker -Q conversions) размером
+    convert_concurrency, а ядра делятся между его процессами, поэтому ffmpeg не
+    конкурирует за CPU с обработкой запросов API и загрузками.
+
+    Args:
+        download_id: ID записи о результате конвертации
+        input_path: Логический путь к исходному файлу (Download.file_path)
+        output_format: Формат результата (mp4, mp3, avi и т.д.)
+        user_id: ID владельца файла
+        preset: Пресет перекодирования видео (fast или quality)
+        tier: Уровень приоритета подписки (paid, trial, anonymous)
+        enqueued_at: Время постановки в очередь (unix time) для метрики ожидания
+    """
+    if enqueued_at is not None:
+        wait_seconds = max(0.0, time.time() - enqueued_at)
+        # Метрика публикуется в Redis: память процесса воркера недоступна /admin/metrics
+        run_async(metrics.observe_shared(
+            "conversion_queue_wait_seconds", wait_seconds, tier=tier, queue=settings.CONVERT_QUEUE_NAME
+        ))
+        logger.info(f"Converting {input_path} to {output_format} as download {download_id} (queue wait {wait_seconds:.1f}s)")
+    else:
+        logger.info(f"Converting {input_path} to {output_format} as download {download_id}")
+
+    # Корутина выполняется в event loop процесса воркера
+    result = run_async(_convert_download_async(
+        download_id, input_path, output_format, user_id, preset,
+        can_wait_for_storage=self.request.retries < settings.STORAGE_FULL_MAX_RETRIES
+    ))
+
+    if result.get("status") == "retry":
+        raise self.retry(countdown=settings.STORAGE_FULL_RETRY_DELAY, max_retries=settings.STORAGE_FULL_MAX_RETRIES)
+    return result
+
+
+async def _convert_download_async(
+    download_id: int,
+    input_path: str,
+    output_format: str,
+    user_id: Optional[int] = None,
+    preset: Optional[str] = None,
+    can_wait_for_storage: bool = True
+):
+    """
+    Асинхронная реализация задачи конвертации
+    """
+    async with AsyncSessionLocal() as db, AsyncExitStack() as stack:
+        result = await db.execute(select(Download).where(Download.id == download_id))
+        download = result.scalar_one_or_none()
+
+        if not download:
+            logger.error(f"Download ID {download_id} not found in DB")
+            return {"status": "error", "message": "Download not found"}
+
+        # Повторная доставка задачи (acks_late) не должна конвертировать файл заново
+        if download.status in (DownloadStatus.COMPLETED, DownloadStatus.REMOVED):
+            return {"status": "success", "download_id": download_id}
+
+        if download.status == DownloadStatus.CANCELLED:
+            return {"status": "cancelled", "download_id": download_id}
+
+        progress = ProgressReporter(download_id)
+
+        try:
+            await stack.enter_async_context(storage_manager.reserve())
+        except StorageFullError as e:
+            if can_wait_for_storage:
+                logger.warning(f"Conversion {download_id} postponed: {str(e)}")
+                return {"status": "retry", "download_id": download_id}
+
+            error = "Недостаточно места для сохранения файла"
+            download.status = DownloadStatus.FAILED
+            download.error_message = error
+            db.add(download)
+            await db.commit()
+            await progress.publish({"status": DownloadStatus.FAILED.value, "error": error})
+            return {"status": "error", "download_id": download_id, "message": error}
+
+        download.status = DownloadStatus.PROCESSING
+        db.add(download)
+        await db.commit()
+        await progress.publish({"status": DownloadStatus.PROCESSING.value})
+
+        # Результат сохраняется рядом с исходным файлом, как при конвертации в API
+        downloader = VideoDownloader()
+        convert_task = asyncio.ensure_future(downloader.convert_video(
+            input_path=input_path,
+            output_format=output_format,
+            output_dir=os.path.dirname(input_path),
+            progress=progress,
+            user_id=user_id,
+            preset=preset
+        ))
+        cancel_task = asyncio.ensure_future(wait_for_cancel(download_id))
+        await asyncio.wait({convert_task, cancel_task}, return_when=asyncio.FIRST_COMPLETED)
+
+        if not convert_task.done():
+            # Отмена завершает ffmpeg, недописанный файл удаляется в _convert_local
+            convert_task.cancel()
+            await asyncio.gather(convert_task, return_exceptions=True)
+
+            await db.refresh(download)
+            download.status = DownloadStatus.CANCELLED
+            download.error_message = None
+            db.add(download)
+            await db.commit()
+
+            await progress.publish({"status": DownloadStatus.CANCELLED.value})
+
+            logger.info(f"Conversion {download_id} cancelled")
+            return {"status": "cancelled", "download_id": download_id}
+
+        cancel_task.cancel()
+
+        try:
+            convert_result = convert_task.result()
+            error = convert_result.error
+        except Exception as e:
+            logger.exception(f"Error during conversion {download_id}: {str(e)}")
+            convert_result = None
+            error = str(e)
+
+        if not convert_result or not convert_result.success:
+            download.status = DownloadStatus.FAILED
+            download.error_message = error
+            db.add(download)
+            await db.commit()
+
+            await progress.publish({"status": DownloadStatus.FAILED.value, "error": error})
+
+            logger.error(f"Conversion {download_id} failed: {error}")
+            return {"status": "error", "download_id": download_id, "message": error}
+
+        download.file_path = convert_result.file_path
+        download.status = DownloadStatus.COMPLETED
+        download.error_message = None
+        db.add(download)
+        await db.commit()
+
+        await progress.publish({
+            "status": DownloadStatus.COMPLETED.value,
+            "title": download.title,
+            "url": file_url(convert_result.file_path),
+            "file_size": convert_result.file_size,
+            "conversion": convert_result.conversion,
+        })
+
+        return {
+            "status": "success",
+            "download_id": download_id,
+            "file_path": convert_result.file_path,
+            "file_size": convert_result.file_size,
+            "conversion": convert_result.conversion
+        }
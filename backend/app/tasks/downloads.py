@@ -0,0 +1,288 @@
+import os
+import time
+import asyncio
+import shutil
+import uuid
+import logging
+from contextlib import AsyncExitStack
+from typing import Optional
+from sqlalchemy.future import select
+
+from app.worker import celery
+from app.models.download import Download, DownloadStatus
+from app.models.subscription import Subscription
+from app.utils.database import AsyncSessionLocal
+from app.utils.worker_runtime import run_async
+from app.services.downloader import VideoDownloader
+from app.services.progress import ProgressReporter, wait_for_cancel
+from app.services.storage import file_url
+from app.services.storage_manager import storage_manager, StorageFullError
+from app.services.download_scheduler import TIER_ANONYMOUS
+from app.services.worker_scheduler import worker_scheduler
+from app.services.principal_cache import invalidate_entitlement
+from app.utils.metrics import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@celery.task(
+    name="app.tasks.downloads.process_download",
+    soft_time_limit=settings.DOWNLOAD_TASK_SOFT_TIME_LIMIT,
+    time_limit=settings.DOWNLOAD_TASK_TIME_LIMIT,
+    bind=True,
+)
+def process_download(
+    self,
+    download_id: int,
+    url: str,
+    resolution: str,
+    user_id: Optional[int] = None,
+    subscription_id: Optional[int] = None,
+    use_instaloader: bool = False,
+    tier: str = TIER_ANONYMOUS,
+    enqueued_at: Optional[float] = None,
+    output_format: str = "mp4",
+    user_key: Optional[str] = None,
+    storage_retries: int = 0
+):
+    """
+    Скачивает видео в воркере Celery и сохраняет статус в записи Download
+
+    Перед загрузкой задача занимает слот worker_scheduler (общий лимит, лимит
+    платформы и пользователя). Если слота нет, задача возвращается в очередь
+    через DOWNLOAD_SLOT_RETRY_DELAY секунд, не занимая процесс воркера.
+
+    Args:
+        download_id: ID записи о скачивании
+        url: URL видео
+        resolution: Разрешение видео (360p, 480p, 720p и т.д.)
+        user_id: ID пользователя (None для анонимных загрузок)
+        subscription_id: ID подписки, по которой списывается скачивание
+        use_instaloader: Использовать instaloader для Instagram
+        tier: Уровень приоритета подписки (paid, trial, anonymous)
+        enqueued_at: Время постановки в очередь (unix time) для метрики ожидания
+        output_format: Формат результата (mp4, mp3, wav)
+        user_key: Ключ пользователя для лимита загрузок на пользователя
+        storage_retries: Сколько раз задача уже откладывалась из-за нехватки места
+    """
+    task_id = self.request.id
+    source_type = VideoDownloader().determine_source_type(url)
+    user_key = user_key or (f"user:{user_id}" if user_id else "anonymous")
+
+    if not run_async(worker_scheduler.try_acquire(task_id, source_type, user_key, tier)):
+        if enqueued_at is not None and time.time() - enqueued_at > settings.DOWNLOAD_QUEUE_WAIT_TIMEOUT:
+            run_async(worker_scheduler.forget(task_id))
+            return run_async(_fail_download(download_id, "Превышено время ожидания в очереди загрузок"))
+        # Повторы ожидания слота не ограничены числом: их ограничивает DOWNLOAD_QUEUE_WAIT_TIMEOUT
+        raise self.retry(countdown=settings.DOWNLOAD_SLOT_RETRY_DELAY, max_retries=None)
+
+    if enqueued_at is not None:
+        wait_seconds = max(0.0, time.time() - enqueued_at)
+        # Метрика публикуется в Redis: память процесса воркера недоступна /admin/metrics
+        run_async(metrics.observe_shared("download_queue_wait_seconds", wait_seconds, tier=tier, queue="celery"))
+        logger.info(f"Processing download {download_id} for URL {url} (tier={tier}, queue wait {wait_seconds:.1f}s)")
+    else:
+        logger.info(f"Processing download {download_id} for URL {url}")
+
+    started_at = time.monotonic()
+    try:
+        # Корутина выполняется в event loop процесса воркера
+        result = run_async(_process_download_async(
+            download_id, url, resolution, user_id, subscription_id, use_instaloader,
+            can_wait_for_storage=storage_retries < settings.STORAGE_FULL_MAX_RETRIES,
+            output_format=output_format
+        ))
+    finally:
+        run_async(worker_scheduler.release(task_id, source_type, user_key, time.monotonic() - started_at))
+
+    if result.get("status") == "retry":
+        # Места нет даже после вытеснения - загрузка ждет в очереди, пока оно освободится.
+        # Число таких повторов считается отдельно от повторов ожидания слота
+        raise self.retry(
+            kwargs={**self.request.kwargs, "storage_retries": storage_retries + 1},
+            countdown=settings.STORAGE_FULL_RETRY_DELAY,
+            max_retries=None
+        )
+    return result
+
+
+async def _fail_download(download_id: int, error: str):
+    """
+    Завершает загрузку ошибкой, не начиная ее
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Download).where(Download.id == download_id))
+        download = result.scalar_one_or_none()
+        if not download:
+            return {"status": "error", "message": "Download not found"}
+
+        if download.status == DownloadStatus.CANCELLED:
+            return {"status": "cancelled", "download_id": download_id}
+
+        download.status = DownloadStatus.FAILED
+        download.error_message = error
+        db.add(download)
+        await db.commit()
+
+    await ProgressReporter(download_id).publish({"status": DownloadStatus.FAILED.value, "error": error})
+    logger.error(f"Download {download_id} failed: {error}")
+    return {"status": "error", "download_id": download_id, "message": error}
+
+
+async def _process_download_async(
+    download_id: int,
+    url: str,
+    resolution: str,
+    user_id: Optional[int] = None,
+    subscription_id: Optional[int] = None,
+    use_instaloader: bool = False,
+    can_wait_for_storage: bool = True,
+    output_format: str = "mp4"
+):
+    """
+    Асинхронная реализация задачи скачивания видео
+    """
+    async with AsyncSessionLocal() as db, AsyncExitStack() as stack:
+        query = select(Download).where(Download.id == download_id)
+        result = await db.execute(query)
+        download = result.scalar_one_or_none()
+
+        if not download:
+            logger.error(f"Download ID {download_id} not found in DB")
+            return {"status": "error", "message": "Download not found"}
+
+        # Повторная доставка задачи (acks_late) не должна качать файл заново
+        if download.status in (DownloadStatus.COMPLETED, DownloadStatus.REMOVED):
+            return {"status": "success", "download_id": download_id}
+
+        # Загрузка отменена, пока задача ждала в очереди
+        if download.status == DownloadStatus.CANCELLED:
+            return {"status": "cancelled", "download_id": download_id}
+
+        # Место под файл резервируется до начала загрузки и освобождается после сохранения
+        try:
+            await stack.enter_async_context(storage_manager.reserve())
+        except StorageFullError as e:
+            if can_wait_for_storage:
+                logger.warning(f"Download {download_id} postponed: {str(e)}")
+                return {"status": "retry", "download_id": download_id}
+
+            error = "Недостаточно места для сохранения файла"
+            download.status = DownloadStatus.FAILED
+            download.error_message = error
+            db.add(download)
+            await db.commit()
+            await ProgressReporter(download_id).publish({"status": DownloadStatus.FAILED.value, "error": error})
+            return {"status": "error", "download_id": download_id, "message": error}
+
+        download.status = DownloadStatus.PROCESSING
+        db.add(download)
+        await db.commit()
+
+        # Прогресс загрузки транслируется клиентам через /downloads/{id}/events
+        progress = ProgressReporter(download_id)
+        await progress.publish({"status": DownloadStatus.PROCESSING.value})
+
+        # Каждая загрузка получает собственную директорию, как и в синхронном режиме
+        download_dir = os.path.join(settings.UPLOAD_DIR, str(uuid.uuid4()))
+        os.makedirs(download_dir, exist_ok=True)
+
+        downloader = VideoDownloader()
+        source_type = downloader.determine_source_type(url)
+
+        if source_type == "instagram" and use_instaloader:
+            download_coro = downloader.download_instagram_with_instaloader(
+                url=url,
+                output_dir=download_dir
+            )
+        else:
+            download_coro = downloader.download_video(
+                url=url,
+                resolution=resolution,
+                output_dir=download_dir,
+                filename_template="%(title)s.%(ext)s",
+                progress=progress,
+                output_format=output_format
+            )
+
+        # Загрузка идет параллельно с ожиданием запроса отмены (DELETE /downloads/{id})
+        download_task = asyncio.ensure_future(download_coro)
+        cancel_task = asyncio.ensure_future(wait_for_cancel(download_id))
+        await asyncio.wait({download_task, cancel_task}, return_when=asyncio.FIRST_COMPLETED)
+
+        if not download_task.done():
+            # Отмена завершает процесс yt-dlp вместе с дочерними процессами
+            download_task.cancel()
+            await asyncio.gather(download_task, return_exceptions=True)
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+            await db.refresh(download)
+            download.status = DownloadStatus.CANCELLED
+            download.error_message = None
+            db.add(download)
+            await db.commit()
+
+            await progress.publish({"status": DownloadStatus.CANCELLED.value})
+
+            logger.info(f"Download {download_id} cancelled")
+            return {"status": "cancelled", "download_id": download_id}
+
+        cancel_task.cancel()
+
+        try:
+            download_result = download_task.result()
+        except Exception as e:
+            logger.exception(f"Error during download process {download_id}: {str(e)}")
+            download_result = None
+            error = str(e)
+        else:
+            # Готовый файл передается в хранилище (для S3 - multipart-загрузка)
+            download_result = await downloader.store_result(download_result, user_id)
+            error = download_result.error
+
+        if not download_result or not download_result.success:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+            download.status = DownloadStatus.FAILED
+            download.error_message = error
+            db.add(download)
+            await db.commit()
+
+            await progress.publish({"status": DownloadStatus.FAILED.value, "error": error})
+
+            logger.error(f"Download {download_id} failed: {error}")
+            return {"status": "error", "download_id": download_id, "message": error}
+
+        download.title = download_result.title
+        download.file_path = download_result.file_path
+        download.status = DownloadStatus.COMPLETED
+        download.error_message = None
+        db.add(download)
+
+        # Списываем скачивание с подписки только после успешной загрузки
+        if subscription_id:
+            query = select(Subscription).where(Subscription.id == subscription_id)
+            sub_result = await db.execute(query)
+            subscription = sub_result.scalar_one_or_none()
+
+            if subscription:
+                subscription.downloads_used += 1
+                db.add(subscription)
+
+        await db.commit()
+        if subscription_id:
+            await invalidate_entitlement(user_id)
+
+        await progress.publish({
+            "status": DownloadStatus.COMPLETED.value,
+            "title": download_result.title,
+            "url": file_url(download_result.file_path),
+        })
+
+        return {
+            "status": "success",
+            "download_id": download_id,
+            "file_path": download_result.file_path,
+            "file_size": download_result.file_size
+        }
@@ -1,11 +1,10 @@
 import logging
-from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.worker import celery
-from app.models.payment import Payment, PaymentStatus, PaymentMethod
-from app.utils.database import get_async_session
-from app.services.payment import PaymentService
+from app.core.config import settings
+from app.utils.worker_runtime import run_async
+from app.services.payment_poller import poll_pending_payments
+from app.services.payment_events import process_event, fail_event, stale_event_ids
 
 logger = logging.getLogger(__name__)
 
@@ -16,94 +15,56 @@ def check_pending_payments():
     """
     logger.info("Checking pending payments")
     
-    # Вызываем асинхронную функцию через синхронный интерфейс
-    import asyncio
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(_check_pending_payments_async())
+    # Корутина выполняется в event loop процесса воркера
+    return run_async(_check_pending_payments_async())
 
 
 async def _check_pending_payments_async():
     """
     Асинхронная реализация задачи проверки статуса платежей
+
+    Сначала повторно ставятся в очередь уведомления, которые не дошли до
+    воркера, затем опрашиваются платежи без уведомлений: статусы запрашиваются
+    у платежных систем параллельно (см. PaymentStatusPoller), результаты
+    сохраняются пачками.
     """
-    payment_service = PaymentService()
-    
-    async for db in get_async_session():
-        try:
-            # Получаем все незавершенные платежи через UKassa
-            query = select(Payment).where(
-                Payment.status == PaymentStatus.PENDING,
-                Payment.payment_method.in_([
-                    PaymentMethod.UKASSA_CARD,
-                    PaymentMethod.UKASSA_QR
-                ])
-            )
-            result = await db.execute(query)
-            pending_payments = result.scalars().all()
-            
-            logger.info(f"Found {len(pending_payments)} pending UKassa payments")
-            
-            completed_count = 0
-            failed_count = 0
-            
-            # Проверяем статус каждого платежа
-            for payment in pending_payments:
-                # Получаем данные платежа
-                payment_data = payment.payment_data
-                if not payment_data:
-                    continue
-                
-                # Извлекаем ID платежа из данных
-                try:
-                    import json
-                    payment_json = json.loads(payment_data)
-                    ukassa_payment_id = payment_json.get('id')
-                    
-                    if not ukassa_payment_id:
-                        continue
-                    
-                    # Проверяем статус платежа в UKassa
-                    payment_status = await payment_service.check_ukassa_payment_status(ukassa_payment_id)
-                    
-                    if payment_status['success']:
-                        # Платеж успешно завершен
-                        payment.status = PaymentStatus.COMPLETED
-                        payment.transaction_id = payment_status['transaction_id']
-                        db.add(payment)
-                        
-                        # Активируем подписку
-                        subscription_id = payment.subscription_id
-                        if subscription_id:
-                            from app.models.subscription import Subscription
-                            query = select(Subscription).where(Subscription.id == subscription_id)
-                            sub_result = await db.execute(query)
-                            subscription = sub_result.scalar_one_or_none()
-                            
-                            if subscription:
-                                subscription.is_active = 1
-                                subscription.payment_id = payment.transaction_id
-                                db.add(subscription)
-                        
-                        completed_count += 1
-                    elif payment_status['payment_status'] == PaymentStatus.FAILED:
-                        # Платеж завершился неудачно
-                        payment.status = PaymentStatus.FAILED
-                        db.add(payment)
-                        failed_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error checking payment {payment.id}: {str(e)}")
-            
-            # Фиксируем изменения в БД
-            await db.commit()
-            
-            return {
-                "status": "success",
-                "total_checked": len(pending_payments),
-                "completed_count": completed_count,
-                "failed_count": failed_count
-            }
-            
-        except Exception as e:
-            logger.exception(f"Error checking pending payments: {str(e)}")
-            return {"status": "error", "message": str(e)} 
\ No newline at end of file
+    try:
+        stale_ids = await stale_event_ids()
+        for event_id in stale_ids:
+            process_payment_event.delay(event_id)
+        if stale_ids:
+            logger.warning(f"Requeued {len(stale_ids)} unprocessed payment events")
+
+        stats = await poll_pending_payments()
+        logger.info(f"Pending payments checked: {stats}")
+        return {"status": "success", **stats}
+    except Exception as e:
+        logger.exception(f"Error checking pending payments: {str(e)}")
+        return {"status": "error", "message": str(e)}
+
+
+@celery.task(
+    bind=True,
+    name="app.tasks.payments.process_payment_event",
+    max_retries=settings.PAYMENT_EVENT_MAX_RETRIES,
+)
+def process_payment_event(self, event_id: int):
+    """
+    Обрабатывает уведомление платежной системы, сохраненное вебхуком
+
+    При ошибке платежной системы или если платеж еще не сохранен обработка
+    повторяется с экспоненциальной паузой. После последней попытки событие
+    отмечается как FAILED, а платеж проверит опрос check_pending_payments.
+    """
+    try:
+        outcome = run_async(process_event(event_id))
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Payment event {event_id} failed after {self.request.retries} retries: {str(e)}")
+            run_async(fail_event(event_id, str(e)))
+            return {"status": "failed", "event_id": event_id, "message": str(e)}
+
+        logger.warning(f"Payment event {event_id} processing failed, retrying: {str(e)}")
+        raise self.retry(exc=e, countdown=settings.PAYMENT_EVENT_RETRY_DELAY * 2 ** self.request.retries)
+
+    return {"status": outcome, "event_id": event_id}
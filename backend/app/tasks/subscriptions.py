@@ -5,7 +5,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.worker import celery
 from app.models.subscription import Subscription
-from app.utils.database import get_async_session
+from app.utils.database import AsyncSessionLocal
+from app.utils.worker_runtime import run_async
+from app.services.principal_cache import invalidate_entitlement
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +18,8 @@ def expire_old_subscriptions():
     """
     logger.info("Checking for expired subscriptions")
     
-    # Вызываем асинхронную функцию через синхронный интерфейс
-    import asyncio
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(_expire_old_subscriptions_async())
+    # Корутина выполняется в event loop процесса воркера
+    return run_async(_expire_old_subscriptions_async())
 
 
 async def _expire_old_subscriptions_async():
@@ -28,7 +28,7 @@ async def _expire_old_subscriptions_async():
     """
     now = datetime.utcnow()
     
-    async for db in get_async_session():
+    async with AsyncSessionLocal() as db:
         try:
             # Получаем все активные подписки с истекшим сроком действия
             query = select(Subscription).where(
@@ -48,6 +48,8 @@ async def _expire_old_subscriptions_async():
             
             # Фиксируем изменения в БД
             await db.commit()
+            for user_id in {subscription.user_id for subscription in expired_subscriptions}:
+                await invalidate_entitlement(user_id)
             
             # Получаем активные подписки с исчерпанным лимитом скачиваний
             query = select(Subscription).where(
@@ -67,6 +69,8 @@ async def _expire_old_subscriptions_async():
             
             # Фиксируем изменения в БД
             await db.commit()
+            for user_id in {subscription.user_id for subscription in limit_reached_subscriptions}:
+                await invalidate_entitlement(user_id)
             
             return {
                 "status": "success",
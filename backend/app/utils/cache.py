@@ -0,0 +1,115 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from redis.exceptions import RedisError
+
+from app.utils.redis import get_redis
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш в памяти процесса с TTL для каждой записи
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class TwoTierCache:
+    """
+    Двухуровневый кэш: LRU в памяти процесса и общий Redis
+
+    Значения сериализуются в JSON. Локальный уровень хранит запись не дольше
+    local_ttl, чтобы изменения из других процессов становились видны быстро.
+    Если Redis не настроен или недоступен, работает только локальный уровень.
+    """
+
+    def __init__(self, namespace: str, local_maxsize: int = 1024, local_ttl: float = 30):
+        self.namespace = namespace
+        self.local_ttl = local_ttl
+        self._local = LRUCache(local_maxsize)
+
+    def _redis_key(self, key: str) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        """
+        Возвращает значение из кэша или None при промахе
+        """
+        value = self._local.get(key)
+        if value is not None:
+            metrics.inc("cache_hits", cache=self.namespace, tier="local")
+            return value
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                raw = await redis.get(self._redis_key(key))
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._local.set(key, value, self.local_ttl)
+                    metrics.inc("cache_hits", cache=self.namespace, tier="redis")
+                    return value
+            except (RedisError, ValueError) as e:
+                logger.warning(f"Cache {self.namespace} Redis read failed: {str(e)}")
+
+        metrics.inc("cache_misses", cache=self.namespace)
+        return None
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        """
+        Сохраняет значение на ttl секунд в оба уровня кэша
+        """
+        self._local.set(key, value, min(self.local_ttl, ttl))
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.set(self._redis_key(key), json.dumps(value, ensure_ascii=False), ex=ttl)
+            except RedisError as e:
+                logger.warning(f"Cache {self.namespace} Redis write failed: {str(e)}")
+
+    async def delete(self, key: str) -> None:
+        """
+        Удаляет значение из обоих уровней кэша
+        """
+        self._local.delete(key)
+
+        redis = get_redis()
+        if redis is not None:
+            try:
+                await redis.delete(self._redis_key(key))
+            except RedisError as e:
+                logger.warning(f"Cache {self.namespace} Redis delete failed: {str(e)}")
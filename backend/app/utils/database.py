@@ -1,4 +1,4 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 from typing import AsyncGenerator
@@ -37,4 +37,30 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         logger.error(f"Database error: {str(e)}")
         raise
     finally:
-        await session.close() 
\ No newline at end of file
+        await session.close() 
+
+def create_worker_engine() -> AsyncEngine:
+    """
+    Движок для процесса воркера Celery
+
+    Пул меньше, чем у API: задачи процесса выполняются по очереди, а пакетным
+    задачам (очистка, сверка файлов) нужны одно-два долгих соединения.
+    """
+    return create_async_engine(
+        settings.DATABASE_URL,
+        echo=DB_ECHO,
+        pool_pre_ping=True,
+        pool_size=settings.DB_WORKER_POOL_SIZE,
+        max_overflow=settings.DB_WORKER_MAX_OVERFLOW,
+        pool_recycle=settings.DB_WORKER_POOL_RECYCLE,
+        pool_timeout=settings.DB_WORKER_POOL_TIMEOUT,
+    )
+
+def bind_session_factory(engine: AsyncEngine) -> None:
+    """
+    Переключает AsyncSessionLocal на другой движок
+
+    sessionmaker один на все модули, поэтому импортированные ранее ссылки
+    на AsyncSessionLocal начинают использовать новый движок.
+    """
+    AsyncSessionLocal.configure(bind=engine)
@@ -0,0 +1,191 @@
+import os
+import re
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Размер блока при отдаче файла без sendfile
+_CHUNK_SIZE = 256 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """ETag файла по времени изменения и размеру (как у nginx)"""
+    return f'"{int(stat_result.st_mtime):x}-{stat_result.st_size:x}"'
+
+
+def content_disposition(filename: str) -> str:
+    """Заголовок Content-Disposition с именем файла в UTF-8 (RFC 6266)"""
+    ascii_name = filename.encode("ascii", "ignore").decode() or "download"
+    ascii_name = ascii_name.replace('"', "")
+    return f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(filename)}'
+
+
+class _RangeNotSatisfiable(Exception):
+    """Корректный диапазон bytes=, не пересекающийся с файлом"""
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбирает заголовок Range с одним диапазоном
+
+    Returns:
+        (start, end) включительно или None, если заголовок не является одним
+        корректным диапазоном bytes= (такой Range игнорируется, RFC 9110 14.2)
+
+    Raises:
+        _RangeNotSatisfiable: диапазон корректен, но не пересекается с файлом
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    start_str, end_str = match.groups()
+    if not start_str:
+        # Суффиксный диапазон: последние N байт
+        if not end_str:
+            return None
+        if int(end_str) == 0 or size == 0:
+            raise _RangeNotSatisfiable()
+        return max(0, size - int(end_str)), size - 1
+
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if end_str and end < start:
+        return None
+    if start >= size:
+        raise _RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """
+    Отдача файла с поддержкой Range, ETag, Last-Modified и If-Range
+
+    Если ASGI-сервер поддерживает расширение http.response.zerocopysend,
+    данные передаются через sendfile без копирования в процесс Python.
+    Иначе файл читается блоками в пуле потоков. Поддерживается один диапазон;
+    запрос нескольких диапазонов получает файл целиком (это допускает RFC 9110).
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        path: str,
+        filename: Optional[str] = None,
+        media_type: Optional[str] = None,
+        stat_result: Optional[os.stat_result] = None,
+        background: Optional[BackgroundTask] = None
+    ):
+        self.path = path
+        self.background = background
+        stat_result = stat_result or os.stat(path)
+        size = stat_result.st_size
+        etag = make_etag(stat_result)
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+
+        self.media_type = media_type or mimetypes.guess_type(filename or path)[0] or "application/octet-stream"
+        self.status_code = 200
+        self.offset = 0
+        self.count = size
+        self.body = b""
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-type": self.media_type,
+        }
+        if filename:
+            headers["content-disposition"] = content_disposition(filename)
+
+        if self._not_modified(request, etag, stat_result.st_mtime):
+            self.status_code = 304
+            self.count = 0
+        else:
+            range_header = request.headers.get("range")
+            if range_header and self._if_range_matches(request, etag, last_modified):
+                try:
+                    byte_range = _parse_range(range_header, size)
+                except _RangeNotSatisfiable:
+                    self.status_code = 416
+                    self.count = 0
+                    headers["content-range"] = f"bytes */{size}"
+                    byte_range = None
+                if byte_range is not None:
+                    start, end = byte_range
+                    self.status_code = 206
+                    self.offset = start
+                    self.count = end - start + 1
+                    headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        if self.status_code != 304:
+            headers["content-length"] = str(self.count)
+        self.init_headers(headers)
+
+    @staticmethod
+    def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    @staticmethod
+    def _if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+        """Range учитывается, только если файл не изменился с момента начала докачки"""
+        if_range = request.headers.get("if-range")
+        return if_range is None or if_range.strip() in (etag, last_modified)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if self.count and scope.get("method") != "HEAD":
+            with open(self.path, "rb") as file:
+                if "http.response.zerocopysend" in scope.get("extensions", {}):
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": file.fileno(),
+                        "offset": self.offset,
+                        "count": self.count,
+                        "more_body": False,
+                    })
+                else:
+                    await self._send_chunks(file, send)
+        else:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+        if self.background is not None:
+            await self.background()
+
+    async def _send_chunks(self, file, send: Send) -> None:
+        position = self.offset
+        remaining = self.count
+        while remaining > 0:
+            chunk = await run_in_threadpool(os.pread, file.fileno(), min(_CHUNK_SIZE, remaining), position)
+            if not chunk:
+                break
+            position += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # Файл укоротился во время отдачи - закрываем тело, клиент увидит неполный ответ
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
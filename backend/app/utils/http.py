@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Возвращает общий HTTP-клиент с пулом keep-alive соединений
+
+    Соединения httpx привязаны к event loop, поэтому клиент создается заново,
+    если его запрашивают из другого loop (процесс API и процесс воркера).
+    """
+    global _client, _client_loop
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.HTTP_CLIENT_TIMEOUT, connect=settings.HTTP_CLIENT_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE,
+                keepalive_expiry=30,
+            ),
+        )
+        _client_loop = loop
+
+    return _client
+
+
+async def close_http_client() -> None:
+    """Закрывает соединения общего клиента (при остановке приложения или воркера)"""
+    global _client, _client_loop
+
+    if _client is not None and not _client.is_closed:
+        try:
+            await _client.aclose()
+        except Exception as e:
+            logger.warning(f"Failed to close HTTP client: {str(e)}")
+    _client = None
+    _client_loop = None
@@ -0,0 +1,176 @@
+import json
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Any, Tuple, List
+
+from redis.exceptions import RedisError
+
+from app.utils.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних наблюдений хранится для расчета перцентилей
+_RESERVOIR_SIZE = 1024
+
+# Распределения, общие для всех процессов (API и воркеры Celery):
+# множество серий, счетчики count/sum и окно последних значений каждой серии
+SHARED_SERIES_KEY = "metrics:shared:series"
+SHARED_STATS_KEY = "metrics:shared:stats"
+SHARED_WINDOW_KEY = "metrics:shared:window:{series}"
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Metrics:
+    """
+    Простейший реестр метрик процесса (счетчики, текущие значения и распределения)
+
+    Значения хранятся в памяти текущего процесса и отдаются через
+    административный эндпоинт /admin/metrics. Наблюдения воркеров Celery
+    (процессы, отличные от API) публикуются в Redis через observe_shared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple, float]] = defaultdict(lambda: defaultdict(float))
+        self._gauges: Dict[str, Dict[Tuple, float]] = defaultdict(dict)
+        self._observations: Dict[str, Dict[Tuple, Dict[str, Any]]] = defaultdict(dict)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Увеличивает счетчик name с указанными метками
+        """
+        with self._lock:
+            self._counters[name][_label_key(labels)] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Устанавливает текущее значение показателя name (например, длину очереди)
+        """
+        with self._lock:
+            self._gauges[name][_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Добавляет наблюдение в распределение name (например, время ожидания в очереди)
+
+        Для перцентилей хранятся только последние _RESERVOIR_SIZE значений
+        """
+        with self._lock:
+            series = self._observations[name].get(_label_key(labels))
+            if series is None:
+                series = {"count": 0, "sum": 0.0, "window": deque(maxlen=_RESERVOIR_SIZE)}
+                self._observations[name][_label_key(labels)] = series
+            series["count"] += 1
+            series["sum"] += value
+            series["window"].append(value)
+
+    async def observe_shared(self, name: str, value: float, **labels) -> None:
+        """
+        Добавляет наблюдение в распределение name, общее для всех процессов
+
+        Используется в воркерах Celery: их метрики в памяти недоступны
+        эндпоинту /admin/metrics процесса API. Без Redis наблюдение
+        сохраняется только в текущем процессе.
+        """
+        redis = get_redis()
+        if redis is None:
+            self.observe(name, value, **labels)
+            return
+
+        series = json.dumps([name, dict(_label_key(labels))], sort_keys=True)
+        window_key = SHARED_WINDOW_KEY.format(series=series)
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.sadd(SHARED_SERIES_KEY, series)
+                pipe.hincrby(SHARED_STATS_KEY, f"{series}:count", 1)
+                pipe.hincrbyfloat(SHARED_STATS_KEY, f"{series}:sum", value)
+                pipe.lpush(window_key, value)
+                pipe.ltrim(window_key, 0, _RESERVOIR_SIZE - 1)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to publish metric {name}: {str(e)}")
+            self.observe(name, value, **labels)
+
+    async def shared_distributions(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Возвращает распределения, опубликованные через observe_shared всеми процессами
+        """
+        redis = get_redis()
+        if redis is None:
+            return {}
+
+        try:
+            series_ids = sorted(await redis.smembers(SHARED_SERIES_KEY))
+            if not series_ids:
+                return {}
+            async with redis.pipeline(transaction=False) as pipe:
+                for series in series_ids:
+                    pipe.hmget(SHARED_STATS_KEY, f"{series}:count", f"{series}:sum")
+                    pipe.lrange(SHARED_WINDOW_KEY.format(series=series), 0, -1)
+                replies = await pipe.execute()
+        except RedisError as e:
+            logger.warning(f"Failed to read shared metrics: {str(e)}")
+            return {}
+
+        distributions: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for i, series in enumerate(series_ids):
+            name, labels = json.loads(series)
+            (count, total), window = replies[2 * i], replies[2 * i + 1]
+            data = {
+                "count": int(count or 0),
+                "sum": float(total or 0.0),
+                "window": [float(v) for v in window],
+            }
+            distributions[name].append({"labels": labels, **self._summary(data)})
+        return dict(distributions)
+
+    @staticmethod
+    def _summary(series: Dict[str, Any]) -> Dict[str, float]:
+        window = sorted(series["window"])
+
+        def percentile(q: float) -> float:
+            return window[min(len(window) - 1, int(len(window) * q))] if window else 0.0
+
+        return {
+            "count": series["count"],
+            "avg": series["sum"] / series["count"] if series["count"] else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Возвращает текущие значения всех метрик
+        """
+        with self._lock:
+            return {
+                "counters": {
+                    name: [
+                        {"labels": dict(labels), "value": value}
+                        for labels, value in series.items()
+                    ]
+                    for name, series in self._counters.items()
+                },
+                "gauges": {
+                    name: [
+                        {"labels": dict(labels), "value": value}
+                        for labels, value in series.items()
+                    ]
+                    for name, series in self._gauges.items()
+                },
+                "distributions": {
+                    name: [
+                        {"labels": dict(labels), **self._summary(data)}
+                        for labels, data in series.items()
+                    ]
+                    for name, series in self._observations.items()
+                }
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,207 @@
+import os
+import signal
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, List, Callable, Awaitable, Deque
+
+logger = logging.getLogger(__name__)
+
+# Размер блока чтения из pipe
+_READ_CHUNK_SIZE = 64 * 1024
+# Более длинные строки обрезаются, чтобы одна строка без перевода не заняла всю память
+MAX_LINE_LENGTH = 8 * 1024
+
+# Сколько ждать завершения по SIGTERM перед SIGKILL
+KILL_GRACE_SECONDS = 5.0
+# Период проверки таймаутов
+_WATCHDOG_INTERVAL = 1.0
+
+# Обработчик строки; если он вернул True, строка считается разобранной и не попадает в хвост
+LineHandler = Callable[[str], Awaitable[Optional[bool]]]
+
+
+class ProcessTimeoutError(Exception):
+    """Процесс превысил общее время работы или слишком долго ничего не выводил"""
+
+    def __init__(self, reason: str, timeout: float):
+        super().__init__(f"Process {reason} timeout after {timeout:.0f}s")
+        self.reason = reason
+        self.timeout = timeout
+
+
+class LineRingBuffer:
+    """
+    Хранит последние max_lines строк вывода для текста ошибки
+    """
+
+    def __init__(self, max_lines: int):
+        self._lines: Deque[str] = deque(maxlen=max_lines)
+
+    def append(self, line: str) -> None:
+        self._lines.append(line)
+
+    @property
+    def lines(self) -> List[str]:
+        return list(self._lines)
+
+    def text(self) -> str:
+        return "\n".join(self._lines)
+
+
+@dataclass
+class ProcessResult:
+    returncode: int
+    stdout_tail: List[str] = field(default_factory=list)
+    stderr_tail: str = ""
+
+
+async def _read_lines(
+    stream: asyncio.StreamReader,
+    tail: LineRingBuffer,
+    handler: Optional[LineHandler],
+    activity: List[float]
+) -> None:
+    """
+    Читает поток блоками и передает строки обработчику по мере поступления
+
+    Строки разделяются по \\n и \\r (ffmpeg и yt-dlp перерисовывают прогресс
+    через \\r). Незавершенная строка не растет больше MAX_LINE_LENGTH.
+    Строки, которые обработчик разобрал (вернул True), в хвост не попадают.
+    """
+    pending = b""
+    truncated = False
+
+    async def emit(raw: bytes) -> None:
+        line = raw.decode("utf-8", errors="replace").rstrip()
+        if not line:
+            return
+        activity[0] = asyncio.get_running_loop().time()
+        if handler and await handler(line):
+            return
+        tail.append(line)
+
+    while True:
+        chunk = await stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        pending += chunk.replace(b"\r", b"\n")
+        *lines, pending = pending.split(b"\n")
+        for raw in lines:
+            if truncated:
+                # Хвост обрезанной строки отбрасывается
+                truncated = False
+                continue
+            await emit(raw[:MAX_LINE_LENGTH])
+
+        if len(pending) > MAX_LINE_LENGTH:
+            if not truncated:
+                await emit(pending[:MAX_LINE_LENGTH])
+                truncated = True
+            pending = b""
+
+    if pending and not truncated:
+        await emit(pending[:MAX_LINE_LENGTH])
+
+
+async def kill_process_tree(process: asyncio.subprocess.Process, grace: float = KILL_GRACE_SECONDS) -> None:
+    """
+    Завершает процесс вместе с дочерними (ffmpeg, запущенный yt-dlp)
+
+    Процесс должен быть запущен в собственной сессии (start_new_session=True),
+    тогда его pid совпадает с идентификатором группы процессов.
+    """
+    def signal_group(sig: int) -> None:
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    signal_group(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        signal_group(signal.SIGKILL)
+        await process.wait()
+
+
+async def run_process(
+    cmd: List[str],
+    on_stdout_line: Optional[LineHandler] = None,
+    on_stderr_line: Optional[LineHandler] = None,
+    stdout_tail_lines: int = 20,
+    stderr_tail_lines: int = 50,
+    cwd: Optional[str] = None,
+    timeout: Optional[float] = None,
+    idle_timeout: Optional[float] = None
+) -> ProcessResult:
+    """
+    Запускает процесс и читает stdout и stderr построчно, не накапливая вывод целиком
+
+    В отличие от communicate() память ограничена хвостом последних строк
+    (stdout_tail_lines и stderr_tail_lines), который возвращается для
+    разбора результата и текста ошибки. При отмене вызывающей задачи или
+    превышении таймаута завершается вся группа процессов.
+
+    Args:
+        cmd: Команда и аргументы
+        on_stdout_line: Обработчик строк stdout
+        on_stderr_line: Обработчик строк stderr
+        stdout_tail_lines: Сколько последних строк stdout вернуть
+        stderr_tail_lines: Сколько последних строк stderr вернуть
+        cwd: Рабочая директория процесса
+        timeout: Максимальное время работы процесса в секундах
+        idle_timeout: Максимальное время без вывода в секундах
+
+    Returns:
+        ProcessResult с кодом возврата и хвостами вывода
+
+    Raises:
+        ProcessTimeoutError: Если превышен timeout или idle_timeout
+    """
+    loop = asyncio.get_running_loop()
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        start_new_session=True
+    )
+
+    started_at = loop.time()
+    activity = [started_at]
+    stdout_tail = LineRingBuffer(stdout_tail_lines)
+    stderr_tail = LineRingBuffer(stderr_tail_lines)
+    readers = asyncio.ensure_future(asyncio.gather(
+        _read_lines(process.stdout, stdout_tail, on_stdout_line, activity),
+        _read_lines(process.stderr, stderr_tail, on_stderr_line, activity),
+    ))
+    try:
+        while True:
+            await asyncio.wait({readers}, timeout=_WATCHDOG_INTERVAL)
+            if readers.done():
+                break
+            now = loop.time()
+            if timeout and now - started_at > timeout:
+                raise ProcessTimeoutError("wall-clock", timeout)
+            if idle_timeout and now - activity[0] > idle_timeout:
+                raise ProcessTimeoutError("idle", idle_timeout)
+
+        readers.result()
+        returncode = await process.wait()
+    finally:
+        if process.returncode is None:
+            await kill_process_tree(process)
+        if not readers.done():
+            readers.cancel()
+        # Исключение читателей уже передано вызывающему коду или больше не нужно
+        await asyncio.gather(readers, return_exceptions=True)
+
+    return ProcessResult(
+        returncode=returncode,
+        stdout_tail=stdout_tail.lines,
+        stderr_tail=stderr_tail.text()
+    )
@@ -0,0 +1,32 @@
+import logging
+from typing import TYPE_CHECKING, Optional
+
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+
+
+def get_redis() -> Optional["aioredis.Redis"]:
+    """
+    Возвращает общий асинхронный клиент Redis
+
+    Returns:
+        Клиент Redis или None, если REDIS_URL не настроен
+    """
+    global _redis_client
+
+    if _redis_client is None and settings.REDIS_URL:
+        import redis.asyncio as aioredis
+
+        _redis_client = aioredis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            health_check_interval=30,
+        )
+
+    return _redis_client
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Optional, Awaitable, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.utils.database import async_engine, create_worker_engine, bind_session_factory
+from app.utils.http import close_http_client
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Event loop и движок БД процесса воркера Celery
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_engine: Optional[AsyncEngine] = None
+
+
+def init_worker_runtime() -> None:
+    """
+    Создает event loop и движок БД процесса воркера (сигнал worker_process_init)
+
+    Соединения aiomysql привязаны к event loop, в котором открыты, поэтому
+    все задачи процесса выполняются в одном loop и переиспользуют пул
+    движка, а не открывают соединения заново.
+    """
+    global _loop, _engine
+
+    if _loop is not None:
+        return
+
+    # Пул движка API, унаследованный от родительского процесса при fork,
+    # не должен закрывать соединения родителя
+    async_engine.sync_engine.dispose(close=False)
+
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _engine = create_worker_engine()
+    bind_session_factory(_engine)
+    logger.info("Worker async runtime initialized")
+
+
+def shutdown_worker_runtime() -> None:
+    """
+    Закрывает соединения пула и event loop (сигнал worker_process_shutdown)
+    """
+    global _loop, _engine
+
+    if _loop is None:
+        return
+
+    try:
+        _loop.run_until_complete(close_http_client())
+        if _engine is not None:
+            _loop.run_until_complete(_engine.dispose())
+        _loop.run_until_complete(_loop.shutdown_asyncgens())
+    except Exception as e:
+        logger.warning(f"Failed to shut down worker runtime cleanly: {str(e)}")
+    finally:
+        _loop.close()
+        _loop = None
+        _engine = None
+
+
+def run_async(coro: Awaitable[T]) -> T:
+    """
+    Выполняет корутину задачи в event loop процесса воркера
+
+    Если процесс запущен без worker_process_init (например, воркер с пулом
+    solo), loop и движок создаются при первом вызове.
+
+    Loop живет дольше задачи, поэтому при прерывании (SoftTimeLimitExceeded
+    из обработчика сигнала, KeyboardInterrupt) корутина отменяется и
+    дожидается завершения здесь же: иначе она продолжилась бы в следующей
+    задаче вместе со своим процессом yt-dlp/ffmpeg, резервом места и сессией БД.
+    """
+    if _loop is None:
+        init_worker_runtime()
+
+    task = _loop.create_task(coro)
+    try:
+        return _loop.run_until_complete(task)
+    except BaseException:
+        if not task.done():
+            task.cancel()
+            _loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+        raise
@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
 import logging
 import os
 from datetime import timedelta
@@ -27,6 +28,26 @@ celery.conf.update(
     task_time_limit=600,  # 10 минут максимум
     worker_prefetch_multiplier=1,
     task_acks_late=True,
+    # Загрузки видео выполняются в отдельной очереди, чтобы не блокировать периодические задачи,
+    # конвертации - в своей, которую обслуживает пул воркеров на половину ядер
+    task_routes={
+        "app.tasks.downloads.*": {"queue": settings.DOWNLOAD_QUEUE_NAME},
+        "app.tasks.conversions.*": {"queue": settings.CONVERT_QUEUE_NAME},
+    },
+    # Приоритеты задач (платные подписки раньше пробных и анонимных); для Redis 0 - наивысший
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
+    task_default_priority=5,
+    imports=(
+        "app.tasks.cleanup",
+        "app.tasks.payments",
+        "app.tasks.subscriptions",
+        "app.tasks.downloads",
+        "app.tasks.conversions",
+    ),
 )
 
 # Настройка периодических задач
@@ -36,6 +57,14 @@ celery.conf.beat_schedule = {
         "schedule": timedelta(days=1),  # Запускать раз в день
         "kwargs": {"days": 30}  # Удалять файлы старше 30 дней
     },
+    "reconcile_orphan_files": {
+        "task": "app.tasks.cleanup.reconcile_orphan_files",
+        "schedule": timedelta(hours=6),  # Файлы без записей в БД и остатки неудачных загрузок
+    },
+    "enforce_storage_limits": {
+        "task": "app.tasks.cleanup.enforce_storage_limits",
+        "schedule": timedelta(minutes=10),  # Вытеснение файлов по водяным знакам
+    },
     "check_pending_payments": {
         "task": "app.tasks.payments.check_pending_payments",
         "schedule": timedelta(minutes=15),  # Запускать каждые 15 минут
@@ -46,6 +75,17 @@ celery.conf.beat_schedule = {
     }
 }
 
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Один event loop и один движок БД на процесс воркера"""
+    from app.utils.worker_runtime import init_worker_runtime
+    init_worker_runtime()
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    from app.utils.worker_runtime import shutdown_worker_runtime
+    shutdown_worker_runtime()
+
 # Автоматически обнаруживать задачи в указанных модулях
 celery.autodiscover_tasks(["app.tasks"])
 
@@ -0,0 +1,27 @@
+"""add download job fields
+
+Revision ID: a3c91f0d2b47
+Revises: 7bf1350f6eb2
+Create Date: 2025-05-02 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c91f0d2b47'
+down_revision = '7bf1350f6eb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Колонки для отслеживания фоновых загрузок через Celery
+    op.add_column('downloads', sa.Column('task_id', sa.String(length=255), nullable=True))
+    op.add_column('downloads', sa.Column('error_message', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('downloads', 'error_message')
+    op.drop_column('downloads', 'task_id')
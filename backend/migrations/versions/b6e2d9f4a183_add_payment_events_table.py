@@ -0,0 +1,44 @@
+"""add payment events table
+
+Revision ID: b6e2d9f4a183
+Revises: f3b8d1a6c274
+Create Date: 2025-05-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d9f4a183'
+down_revision = 'f3b8d1a6c274'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payment_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('provider', sa.String(length=20), nullable=False),
+    sa.Column('event_id', sa.String(length=255), nullable=False),
+    sa.Column('event_type', sa.String(length=100), nullable=True),
+    sa.Column('provider_payment_id', sa.String(length=255), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.Enum('RECEIVED', 'PROCESSED', 'IGNORED', 'FAILED', name='paymenteventstatus'), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('error_message', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('provider', 'event_id', name='uq_payment_events_provider_event')
+    )
+    op.create_index(op.f('ix_payment_events_id'), 'payment_events', ['id'], unique=False)
+    op.create_index(op.f('ix_payment_events_provider_payment_id'), 'payment_events', ['provider_payment_id'], unique=False)
+    op.create_index(op.f('ix_payment_events_status'), 'payment_events', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_payment_events_status'), table_name='payment_events')
+    op.drop_index(op.f('ix_payment_events_provider_payment_id'), table_name='payment_events')
+    op.drop_index(op.f('ix_payment_events_id'), table_name='payment_events')
+    op.drop_table('payment_events')
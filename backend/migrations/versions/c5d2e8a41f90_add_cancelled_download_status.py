@@ -0,0 +1,40 @@
+"""add cancelled download status
+
+Revision ID: c5d2e8a41f90
+Revises: a3c91f0d2b47
+Create Date: 2025-05-06 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d2e8a41f90'
+down_revision = 'a3c91f0d2b47'
+branch_labels = None
+depends_on = None
+
+
+OLD_STATUSES = ('PENDING', 'PROCESSING', 'COMPLETED', 'FAILED')
+NEW_STATUSES = OLD_STATUSES + ('CANCELLED',)
+
+
+def upgrade():
+    # В MariaDB ENUM задается в определении колонки, поэтому колонка пересоздается с новым списком
+    op.alter_column(
+        'downloads', 'status',
+        existing_type=sa.Enum(*OLD_STATUSES, name='downloadstatus'),
+        type_=sa.Enum(*NEW_STATUSES, name='downloadstatus'),
+        existing_nullable=True
+    )
+
+
+def downgrade():
+    op.execute("UPDATE downloads SET status = 'FAILED' WHERE status = 'CANCELLED'")
+    op.alter_column(
+        'downloads', 'status',
+        existing_type=sa.Enum(*NEW_STATUSES, name='downloadstatus'),
+        type_=sa.Enum(*OLD_STATUSES, name='downloadstatus'),
+        existing_nullable=True
+    )
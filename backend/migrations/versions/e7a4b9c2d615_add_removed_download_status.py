@@ -0,0 +1,39 @@
+"""add removed download status
+
+Revision ID: e7a4b9c2d615
+Revises: c5d2e8a41f90
+Create Date: 2025-05-12 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a4b9c2d615'
+down_revision = 'c5d2e8a41f90'
+branch_labels = None
+depends_on = None
+
+
+OLD_STATUSES = ('PENDING', 'PROCESSING', 'COMPLETED', 'FAILED', 'CANCELLED')
+NEW_STATUSES = OLD_STATUSES + ('REMOVED',)
+
+
+def upgrade():
+    op.alter_column(
+        'downloads', 'status',
+        existing_type=sa.Enum(*OLD_STATUSES, name='downloadstatus'),
+        type_=sa.Enum(*NEW_STATUSES, name='downloadstatus'),
+        existing_nullable=True
+    )
+
+
+def downgrade():
+    op.execute("UPDATE downloads SET status = 'COMPLETED' WHERE status = 'REMOVED'")
+    op.alter_column(
+        'downloads', 'status',
+        existing_type=sa.Enum(*NEW_STATUSES, name='downloadstatus'),
+        type_=sa.Enum(*OLD_STATUSES, name='downloadstatus'),
+        existing_nullable=True
+    )
@@ -0,0 +1,24 @@
+"""add downloads file_path index
+
+Revision ID: f3b8d1a6c274
+Revises: e7a4b9c2d615
+Create Date: 2025-05-14 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8d1a6c274'
+down_revision = 'e7a4b9c2d615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Сверка файлов UPLOAD_DIR с таблицей ищет записи по file_path пачками
+    op.create_index('ix_downloads_file_path', 'downloads', ['file_path'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_downloads_file_path', table_name='downloads')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Сравнение конвертации: полное перекодирование против плана по кодекам исходника
+
+Скрипт генерирует через ffmpeg тестовые файлы с разными кодеками и для каждого
+замеряет прежнюю конвертацию (libx264/libmp3lame) и выбранный planner способ
+(remux, extract_audio, copy_video или transcode).
+
+Пример:
+    python scripts/benchmark_convert.py --duration 60 --iterations 3
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Добавляем путь к приложению
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.downloader import VideoDownloader
+from app.services.transcode import probe_media, plan_conversion, transcode_plan
+
+# (имя файла, кодеки ffmpeg для генерации, целевой формат)
+SAMPLES = [
+    ("h264_aac.mkv", ["-c:v", "libx264", "-c:a", "aac"], "mp4"),
+    ("h264_opus.mkv", ["-c:v", "libx264", "-c:a", "libopus"], "mp4"),
+    ("vp9_opus.webm", ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-c:a", "libopus"], "mp4"),
+    ("h264_mp3.mkv", ["-c:v", "libx264", "-c:a", "libmp3lame"], "mp3"),
+]
+
+
+def generate_sample(path: str, codec_args: list, duration: int) -> None:
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+            *codec_args, "-shortest", path,
+        ],
+        check=True
+    )
+
+
+async def run_plan(downloader: VideoDownloader, input_path: str, output_path: str, plan) -> float:
+    start = time.perf_counter()
+    result = await downloader._run_ffmpeg(input_path, output_path, plan, None, None)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr_tail)
+    return time.perf_counter() - start
+
+
+async def main(duration: int, iterations: int, work_dir: str) -> None:
+    downloader = VideoDownloader()
+    print(f"{'sample':<16} {'format':<6} {'mode':<14} {'transcode':>10} {'planned':>10} {'speedup':>8}")
+
+    for name, codec_args, output_format in SAMPLES:
+        input_path = os.path.join(work_dir, name)
+        try:
+            generate_sample(input_path, codec_args, duration)
+        except subprocess.CalledProcessError:
+            print(f"{name:<16} пропущен: ffmpeg собран без нужного кодека")
+            continue
+
+        output_path = os.path.join(work_dir, f"out.{output_format}")
+        plan = plan_conversion(await probe_media(input_path), output_format)
+
+        transcode_samples = [
+            await run_plan(downloader, input_path, output_path, transcode_plan(output_format))
+            for _ in range(iterations)
+        ]
+        planned_samples = [
+            await run_plan(downloader, input_path, output_path, plan)
+            for _ in range(iterations)
+        ]
+
+        transcode_time = statistics.median(transcode_samples)
+        planned_time = statistics.median(planned_samples)
+        print(
+            f"{name:<16} {output_format:<6} {plan.mode:<14} "
+            f"{transcode_time:9.2f}s {planned_time:9.2f}s {transcode_time / planned_time:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=int, default=30, help="Длительность тестовых файлов, секунды")
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        sys.exit("Для бенчмарка нужны ffmpeg и ffprobe")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(main(args.duration, args.iterations, tmp_dir))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Сравнение проверки статусов платежей: последовательные запросы против PaymentStatusPoller
+
+Скрипт поднимает локальный сервер, имитирующий API ЮKassa с заданной
+задержкой ответа, и проверяет одни и те же платежи двумя способами:
+по одному запросу с новым HTTP-клиентом (как раньше) и параллельно через
+общий клиент с keep-alive соединениями. База данных и Redis не нужны.
+
+Пример:
+    python scripts/benchmark_payment_poller.py --payments 200 --latency 0.1
+"""
+import argparse
+import asyncio
+import http.server
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import httpx
+
+# Добавляем путь к приложению
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.config import settings
+from app.services.payment_poller import PaymentStatusPoller, PendingPayment, fetch_yookassa_status
+
+
+def make_handler(latency: float):
+    class FakeYooKassaHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            payment_id = self.path.rsplit("/", 1)[-1]
+            body = json.dumps({
+                "id": payment_id,
+                "status": "succeeded" if payment_id[0] in "01234567" else "pending",
+                "metadata": {},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return FakeYooKassaHandler
+
+
+class FakeProviderServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь по умолчанию (5) не вмещает одновременные подключения пула
+    request_queue_size = 128
+
+
+def start_fake_provider(latency: float) -> http.server.ThreadingHTTPServer:
+    server = FakeProviderServer(("127.0.0.1", 0), make_handler(latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run_serial(payments: list) -> list:
+    samples = []
+    for payment in payments:
+        start = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            await fetch_yookassa_status(client, payment.provider_payment_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def run_poller(payments: list, concurrency: int, rate: float) -> list:
+    samples = []
+    async with httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=concurrency)) as client:
+        poller = PaymentStatusPoller(client=client, concurrency=concurrency, rate_limits={"yookassa": rate})
+
+        async def timed(payment):
+            start = time.perf_counter()
+            await poller.check(payment)
+            samples.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(timed(payment) for payment in payments))
+    return samples
+
+
+def report(name: str, total: float, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{name:<8} total={total:7.2f}s throughput={len(samples) / total:7.1f}/s "
+        f"mean={statistics.mean(samples) * 1000:8.1f}ms "
+        f"p50={statistics.median(samples) * 1000:8.1f}ms p95={p95 * 1000:8.1f}ms"
+    )
+
+
+async def main(count: int, concurrency: int, rate: float) -> None:
+    payments = [PendingPayment(i, str(uuid.uuid4())) for i in range(1, count + 1)]
+
+    start = time.perf_counter()
+    serial_samples = await run_serial(payments)
+    serial_total = time.perf_counter() - start
+
+    start = time.perf_counter()
+    poller_samples = await run_poller(payments, concurrency, rate)
+    poller_total = time.perf_counter() - start
+
+    report("serial", serial_total, serial_samples)
+    # Для параллельного режима время запроса включает ожидание в очереди семафора
+    report("poller", poller_total, poller_samples)
+    print(f"Ускорение: {serial_total / poller_total:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payments", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.1, help="Задержка ответа фейкового API, секунды")
+    parser.add_argument("--concurrency", type=int, default=settings.PAYMENT_POLL_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=1000.0, help="Лимит запросов в секунду")
+    args = parser.parse_args()
+
+    server = start_fake_provider(args.latency)
+    settings.YOOKASSA_API_URL = f"http://127.0.0.1:{server.server_address[1]}/v3"
+    try:
+        asyncio.run(main(args.payments, args.concurrency, args.rate))
+    finally:
+        server.shutdown()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Сравнение накладных расходов на вызов yt-dlp: CLI-подпроцесс против пула прогретых процессов
+
+Скрипт поднимает локальный HTTP-сервер с небольшим файлом, чтобы измерять
+именно стоимость запуска и извлечения информации, а не скорость сети.
+
+Пример:
+    python scripts/benchmark_ytdlp_engine.py --iterations 20
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Добавляем путь к приложению
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ytdlp_engine import YtDlpEngine
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_file_server(directory: str) -> http.server.ThreadingHTTPServer:
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def ytdlp_command() -> list:
+    if shutil.which("yt-dlp"):
+        return ["yt-dlp"]
+    return [sys.executable, "-m", "yt_dlp"]
+
+
+async def run_cli(url: str) -> float:
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *ytdlp_command(), "--skip-download", "--dump-json", url,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError("yt-dlp CLI failed")
+    return time.perf_counter() - start
+
+
+async def run_engine(engine: YtDlpEngine, url: str) -> float:
+    start = time.perf_counter()
+    outcome = await engine.extract_info(url, {"quiet": True, "no_warnings": True})
+    if "error" in outcome:
+        raise RuntimeError(outcome["error"])
+    return time.perf_counter() - start
+
+
+def report(name: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(
+        f"{name:<10} mean={statistics.mean(samples) * 1000:8.1f}ms "
+        f"p50={statistics.median(samples) * 1000:8.1f}ms p95={p95 * 1000:8.1f}ms"
+    )
+
+
+async def main(iterations: int, url: str) -> None:
+    cli_samples = [await run_cli(url) for _ in range(iterations)]
+
+    engine = YtDlpEngine(pool_size=1)
+    # Первый вызов прогревает процесс пула и в замеры не входит
+    await run_engine(engine, url)
+    engine_samples = [await run_engine(engine, url) for _ in range(iterations)]
+    engine.shutdown()
+
+    report("subprocess", cli_samples)
+    report("library", engine_samples)
+    saved = statistics.mean(cli_samples) - statistics.mean(engine_samples)
+    print(f"Экономия на вызов: {saved * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--url", help="URL видео (по умолчанию локальный тестовый файл)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = args.url
+        if not url:
+            with open(os.path.join(tmp_dir, "sample.mp4"), "wb") as f:
+                f.write(os.urandom(64 * 1024))
+            server = start_file_server(tmp_dir)
+            url = f"http://127.0.0.1:{server.server_address[1]}/sample.mp4"
+
+        asyncio.run(main(args.iterations, url))